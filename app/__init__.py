@@ -2,12 +2,27 @@ import os
 
 from flask import Flask
 from flask_cors import CORS
+from pymongo.errors import OperationFailure
 
 from app.config import DevelopmentConfig, TestingConfig, ProductionConfig
 from app.api import api_v1
 from app.api.health.view import healthcheck_bp
-from app.db import mongo
-from app.commands import create_collection
+from app.api.metrics import instrumentation
+from app.api.metrics.view import metrics_bp
+from app.api.profiling.profiler import request_profiler
+from app.api.profiling.view import profiling_bp
+from app.db import mongo, ensure_indexes
+from app.api.file.cache import file_cache
+from app.api.file.mirror import file_mirror
+from app.api.file.response_cache import response_cache
+from app.api.file.service import DUPLICATE_KEY_ERROR
+from app.commands import (
+    create_collection,
+    ensure_indexes as ensure_indexes_command,
+    ingest_worker,
+    reindex,
+    verify_indexes,
+)
 
 
 def create_app(deploy_env: str = os.getenv("FLASK_ENV", "Development")) -> Flask:
@@ -21,12 +36,21 @@ def create_app(deploy_env: str = os.getenv("FLASK_ENV", "Development")) -> Flask
     app.config.from_object(configuration)
     with app.app_context():
         __configure_extensions(app)
+        if app.config["ENSURE_INDEXES_ON_STARTUP"]:
+            __ensure_indexes(app)
     app.app_context().push()
 
     app.register_blueprint(healthcheck_bp, url_prefix="/api")
+    app.register_blueprint(metrics_bp, url_prefix="/api")
+    if app.config["PROFILING_ENABLED"]:
+        app.register_blueprint(profiling_bp, url_prefix="/api")
     app.register_blueprint(api_v1, url_prefix="/api/v1")
 
     app.cli.add_command(create_collection)
+    app.cli.add_command(ensure_indexes_command)
+    app.cli.add_command(ingest_worker)
+    app.cli.add_command(reindex)
+    app.cli.add_command(verify_indexes)
 
     return app
 
@@ -34,4 +58,24 @@ def create_app(deploy_env: str = os.getenv("FLASK_ENV", "Development")) -> Flask
 def __configure_extensions(app: Flask):
     cors = CORS(app, resources={r"/*": {"origin": "*"}})
     cors.init_app(app)
-    mongo.init_app(app)
+    instrumentation.init_app(app)
+    mongo.init_app(app, event_listeners=[instrumentation.command_timer])
+    file_cache.init_app(app)
+    file_mirror.init_app(app)
+    response_cache.init_app(app)
+    request_profiler.init_app(app)
+
+
+def __ensure_indexes(app: Flask):
+    try:
+        ensure_indexes()
+    except OperationFailure as err:
+        if err.code != DUPLICATE_KEY_ERROR:
+            raise
+        # Files stored twice before uploads were deduplicated block the unique
+        # hash index; the workers keep serving until they are dropped.
+        app.logger.error(
+            "Could not create the unique index on file hashes: %s. Run "
+            "`flask --app manage ensure-indexes --drop-duplicates` to delete the duplicates.",
+            err,
+        )
@@ -0,0 +1,56 @@
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+
+from app.api.file.exceptions import InvalidArchiveException
+
+
+def read_archive(stream, spool_size):
+    """
+    List the regular files of a tar (optionally compressed) or zip archive.
+    Tar members can only be read in order, so each one is copied to a spooled
+    temporary file; zip members are opened on demand. Either way every member
+    can be read, and re-read, independently of the others.
+    Args:
+        stream (file): Seekable stream of the uploaded archive.
+        spool_size (int): Size up to which a tar member is kept in memory.
+    Returns:
+        list: ``(name, open)`` pairs, where ``open()`` returns a fresh binary
+              stream over the member's bytes.
+    Raises:
+        InvalidArchiveException: If the stream is neither a tar nor a zip file.
+    """
+    if zipfile.is_zipfile(stream):
+        stream.seek(0)
+        archive = zipfile.ZipFile(stream)
+        return [
+            (os.path.basename(info.filename), lambda info=info: archive.open(info))
+            for info in archive.infolist()
+            if not info.is_dir()
+        ]
+
+    stream.seek(0)
+    try:
+        archive = tarfile.open(fileobj=stream, mode="r:*")
+    except tarfile.TarError:
+        raise InvalidArchiveException()
+
+    members = []
+    with archive:
+        for info in archive:
+            if not info.isfile():
+                continue
+            spooled = tempfile.SpooledTemporaryFile(max_size=spool_size)
+            shutil.copyfileobj(archive.extractfile(info), spooled, spool_size)
+            members.append((os.path.basename(info.name), _reopen(spooled)))
+    return members
+
+
+def _reopen(spooled):
+    def open_member():
+        spooled.seek(0)
+        return spooled
+
+    return open_member
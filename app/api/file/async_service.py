@@ -0,0 +1,576 @@
+import asyncio
+import itertools
+import random
+
+from app.db import async_mongo
+from app.api.file.compression import frame_bounds
+from app.api.file.exceptions import FileNotFound, NoContentFound
+from app.api.file.indexes import unpack_offsets
+from app.api.file.search import intersect_postings, trigrams
+from app.api.file.service import (
+    CORPUS_LONGEST_LINES_ID,
+    FILES_BUCKET,
+    FILES_COUNTER_ID,
+    GRAM_COUNT_LIMIT,
+    LAYOUT_FIELDS,
+    LETTERS_BUCKET,
+    LONGEST_LINES_BATCH,
+    OFFSETS_BUCKET,
+    OWNER_SORT,
+    RANDOM_FILE_ATTEMPTS,
+    UNINDEXED,
+    UNSEARCHABLE,
+    CorpusDraw,
+    FileServiceBase,
+    TextFileService,
+    cache_latest_file,
+    cache_layout,
+    cached_frames,
+    cached_latest_file,
+    cached_layout,
+    count_draws,
+    counter_version,
+    decode_letters,
+    decode_lines,
+    decode_window,
+    decompress_frames,
+    gram_query,
+    holds,
+    letter_ranges,
+    line_bounds,
+    matching_lines,
+    merge_picks,
+    offset_ranges,
+    owner_query,
+    postings_queries,
+    random_seqs,
+    rarest_first,
+    sample,
+    spread_sample,
+    top_lines,
+    verify_batches,
+    window_batches,
+    window_range,
+)
+from app.api.file.storage import get_async_storage, slice_blocks
+
+
+class AsyncTextFileService(FileServiceBase):
+    """
+    Non-blocking counterpart of TextFileService for the ASGI app. It reads the
+    same metadata, indexes and worker cache through AsyncMongoClient, and runs
+    the independent reads of a request concurrently: the lines of several files,
+    the lines and letters of a file, and the chunk queries of a read.
+
+    Uploads, and reads that need a whole file, such as those of files not
+    indexed yet or of more longest lines than the stored top-K lists hold, are
+    left to TextFileService, called in a worker thread. Only the I/O differs
+    between the two: how lines are drawn, located and decoded is shared through
+    the helpers of the service module.
+    """
+
+    def __init__(self, app):
+        """
+        Args:
+            app (Flask): The application whose configuration is used, and in
+                whose context TextFileService is called.
+        """
+        self.app = app
+        self.db = async_mongo.db
+        self.storage = get_async_storage(
+            app.config["STORAGE_BACKEND"], app.config["STORAGE_DIR"], self.db
+        )
+        self.top_k = app.config["LONGEST_LINES_TOP_K"]
+
+    async def _run_sync(self, name, *args):
+        """
+        Call a method of TextFileService in a worker thread.
+        Args:
+            name (str): Name of the method.
+            args: Arguments of the method.
+        Returns:
+            The method's result.
+        """
+
+        def call():
+            with self.app.app_context():
+                return getattr(TextFileService(), name)(*args)
+
+        return await asyncio.to_thread(call)
+
+    async def _iter_sync(self, name, *args):
+        """
+        Iterate over a generator method of TextFileService, whose items are
+        pulled LONGEST_LINES_BATCH at a time in a worker thread.
+        Args:
+            name (str): Name of the method.
+            args: Arguments of the method.
+        Yields:
+            The method's items.
+        """
+        items = None
+
+        def pull():
+            nonlocal items
+            with self.app.app_context():
+                if items is None:
+                    items = getattr(TextFileService(), name)(*args)
+                return list(itertools.islice(items, LONGEST_LINES_BATCH))
+
+        try:
+            while batch := await asyncio.to_thread(pull):
+                for item in batch:
+                    yield item
+        finally:
+            if items is not None:
+                await asyncio.to_thread(items.close)
+
+    async def get_file_metadata(self, file_id):
+        """
+        Retrieve the metadata of a file.
+        Args:
+            file_id (str): ObjectId of the file, or ``latest`` for the most
+                recently uploaded one.
+        Returns:
+            dict: Metadata of the file.
+        Raises:
+            FileNotFound: If no file is found with the given ID.
+        """
+        if file_id == "latest":
+            return await self.get_last_file_metadata()
+        doc = await self.db.files.find_one({"file_id": file_id})
+        if doc is None:
+            raise FileNotFound(f"No file found with id: {file_id}")
+        return doc
+
+    async def get_version(self):
+        return counter_version(
+            await self.db.counters.find_one(
+                {"_id": FILES_COUNTER_ID}, {"epoch": 1, "generation": 1}
+            )
+        )
+
+    async def get_last_file_metadata(self):
+        """
+        Retrieve metadata for the most recently uploaded file, cached per worker
+        until the version of the stored files changes.
+        Returns:
+            dict: Metadata of the latest file.
+        Raises:
+            NoContentFound: If no file has been uploaded yet.
+        """
+        version = await self.get_version()
+        doc = cached_latest_file(version)
+        if doc is not None:
+            return doc
+        doc = await self.db.files.find_one(sort=[("_id", -1)])
+        return cache_latest_file(version, doc)
+
+    async def _get_layout(self, file_id):
+        layout = cached_layout(file_id)
+        if layout is None:
+            doc = await self.db.files.find_one({"file_id": file_id}, LAYOUT_FIELDS)
+            layout = cache_layout(file_id, doc)
+        return layout or None
+
+    async def get_lines(self, file_id, line_numbers, errors="strict"):
+        """
+        Read several lines of a file using its line-offset index.
+        Args:
+            file_id (str): ObjectId of the file to read from.
+            line_numbers (iterable): Zero-based numbers of the lines to read.
+            errors (str): How to handle bytes that are not valid UTF-8.
+        Returns:
+            dict: The text of each requested line, keyed by line number.
+        """
+        numbers = sorted(set(line_numbers))
+        entries = await self.storage.read_ranges(
+            OFFSETS_BUCKET, file_id, offset_ranges(numbers)
+        )
+        raws = await self._read_content_ranges(file_id, line_bounds(entries))
+        return decode_lines(numbers, raws, errors)
+
+    async def _read_content_ranges(self, file_id, ranges):
+        """
+        Read byte ranges of a file's original content, decompressing only the
+        frames they span when the file is compressed.
+        Args:
+            file_id (str): ObjectId of the file.
+            ranges (list): ``(start, end)`` byte ranges of the original content.
+        Returns:
+            list: The bytes of each range, in the order requested.
+        """
+        layout = await self._get_layout(file_id)
+        if layout is None:
+            return await self.storage.read_ranges(FILES_BUCKET, file_id, ranges)
+
+        codec, size, ends = layout
+        frames, missing = cached_frames(file_id, ranges, size)
+        if missing:
+            compressed = await self.storage.read_ranges(
+                FILES_BUCKET, file_id, [frame_bounds(ends, n) for n in missing]
+            )
+            decompress_frames(file_id, codec, frames, missing, compressed)
+        return slice_blocks(frames, ranges, size)
+
+    async def get_line_letters(self, doc, line_numbers):
+        """
+        Look up the most frequent letter of lines, as recorded when the file was
+        indexed.
+        Args:
+            doc (dict): Metadata of an indexed file, including its ``letters``.
+            line_numbers (iterable): Zero-based numbers of the lines.
+        Returns:
+            dict: The most frequent letter of each line, keyed by line number.
+        """
+        numbers = sorted(set(line_numbers))
+        entries = await self.storage.read_ranges(
+            LETTERS_BUCKET, doc["file_id"], letter_ranges(doc, numbers)
+        )
+        return decode_letters(doc, numbers, entries)
+
+    async def _read_lines(self, doc, numbers):
+        reads = [self.get_lines(doc["file_id"], numbers)]
+        if "letters" in doc:
+            reads.append(self.get_line_letters(doc, numbers))
+        texts, *letters = await asyncio.gather(*reads)
+        lines = [
+            {"line": number, "text": texts[number], "file_name": doc["filename"]}
+            for number in numbers
+        ]
+        for found in letters:
+            for line in lines:
+                line["most_frequent_letter"] = found[line["line"]]
+        return lines
+
+    async def _pick_random_lines(self, doc, count, replace):
+        line_count = doc.get("line_count")
+        if line_count is None:
+            return await self._run_sync("_pick_random_lines", doc, count, replace)
+        if not line_count:
+            raise NoContentFound(f"File with id {doc['file_id']} is empty.")
+
+        numbers = sample(range(line_count), count, replace)
+        return await self._read_lines(doc, numbers)
+
+    async def get_random_line(self):
+        """
+        Retrieve a random line from the most recent file.
+        Returns:
+            dict: The line text, line number, filename and most frequent letter.
+        """
+        return (await self.get_random_lines(1))[0]
+
+    async def get_random_lines(self, count, replace=True):
+        """
+        Retrieve several random lines from the most recent file.
+        Args:
+            count (int): Number of lines to sample.
+            replace (bool): Whether the same line may be sampled more than once.
+        Returns:
+            list: The line text, line number, filename and most frequent letter
+                  of each line.
+        Raises:
+            NoContentFound: If the latest file has no lines.
+        """
+        last_doc = await self.get_last_file_metadata()
+        lines = await self._pick_random_lines(last_doc, count, replace)
+        return self._describe_lines(lines)
+
+    async def get_random_corpus_line(self):
+        """
+        Retrieve a line chosen uniformly over every line of every file.
+        Returns:
+            dict: The line text, line number, filename and most frequent letter.
+        """
+        return (await self.get_random_corpus_lines(1))[0]
+
+    async def get_random_corpus_lines(self, count, replace=True):
+        """
+        Retrieve lines chosen uniformly over every line of every file. Global
+        line numbers are resolved to their files through the ``line_start``
+        prefix sums, and the lines of every file are read concurrently.
+        Args:
+            count (int): Number of lines to sample.
+            replace (bool): Whether the same line may be sampled more than once.
+        Returns:
+            list: The line text, line number, filename and most frequent letter
+                  of each line.
+        Raises:
+            NoContentFound: If no lines have been uploaded yet.
+        """
+        counter = await self.db.counters.find_one({"_id": FILES_COUNTER_ID})
+        if not counter or not counter.get("lines"):
+            # No file is indexed yet, so the chosen files are scanned in full.
+            return await self._run_sync("get_random_corpus_lines", count, replace)
+
+        lines = []
+        draw = CorpusDraw(counter["lines"], count, replace)
+        for positions in draw.rounds():
+            doc = None
+            for position in positions:
+                if not holds(doc, position):
+                    doc = await self.db.files.find_one(
+                        owner_query(position), sort=OWNER_SORT
+                    )
+                draw.assign(position, doc)
+            for file_lines in await asyncio.gather(
+                *(self._read_lines(doc, numbers) for doc, numbers in draw.picks())
+            ):
+                lines += file_lines
+        return self._describe_lines(draw.finish(lines))
+
+    async def get_random_file_metadata(self):
+        """
+        Pick the metadata of a random file by its upload sequence number.
+        Returns:
+            dict: Metadata of the chosen file.
+        Raises:
+            NoContentFound: If no file has been uploaded yet.
+        """
+        counter = await self.db.counters.find_one({"_id": FILES_COUNTER_ID})
+        if not counter or not counter.get("seq"):
+            return (await self._sample_files(1))[0]
+
+        for _ in range(RANDOM_FILE_ATTEMPTS):
+            doc = await self.db.files.find_one(
+                {"seq": random.randint(1, counter["seq"])}
+            )
+            if doc:
+                return doc
+
+        # The drawn numbers belong to uploads still being registered.
+        return (await self._sample_files(1))[0]
+
+    async def _sample_files(self, count):
+        cursor = await self.db.files.aggregate([{"$sample": {"size": count}}])
+        return spread_sample(await cursor.to_list(count), count)
+
+    async def get_random_line_backward(self):
+        """
+        Retrieve a random line from a random file, reversed.
+        Returns:
+            str: The reversed text of the line.
+        """
+        return (await self.get_random_lines_backward(1))[0]
+
+    async def get_random_lines_backward(self, count, replace=True):
+        """
+        Retrieve several reversed lines, each from a randomly chosen file. The
+        lines of every chosen file are read concurrently.
+        Args:
+            count (int): Number of lines to sample.
+            replace (bool): Whether the same line of a file may be sampled more
+                than once.
+        Returns:
+            list: The reversed text of each sampled line.
+        Raises:
+            NoContentFound: If none of the chosen files has lines.
+        """
+        drawn = await self._draw_random_files(count)
+        picked = await asyncio.gather(
+            *(
+                self._pick_random_lines(doc, doc_count, replace)
+                for doc, doc_count in count_draws(drawn)
+            ),
+            return_exceptions=True,
+        )
+        return [line["text"][::-1] for line in merge_picks(picked)]
+
+    async def _draw_random_files(self, count):
+        counter = await self.db.counters.find_one({"_id": FILES_COUNTER_ID})
+        if not counter or not counter.get("seq"):
+            return await self._sample_files(count)
+
+        seqs = random_seqs(counter["seq"], count)
+        docs = {
+            doc["seq"]: doc
+            async for doc in self.db.files.find({"seq": {"$in": list(set(seqs))}})
+        }
+        return [docs.get(seq) or await self.get_random_file_metadata() for seq in seqs]
+
+    async def iter_line_window(self, doc, start, count):
+        """
+        Read a contiguous window of lines, LINE_WINDOW_BATCH at a time. The next
+        batch is read while the current one is consumed. Files not indexed yet
+        are read by TextFileService in a worker thread.
+        Args:
+            doc (dict): Metadata of the file to read from.
+            start (int): Zero-based number of the first line.
+            count (int): Maximum number of lines to read.
+        Yields:
+            dict: The line number and text of each line in the window.
+        """
+        file_id = doc["file_id"]
+        line_count = doc.get("line_count")
+        if line_count is None:
+            async for line in self._iter_sync("iter_line_window", doc, start, count):
+                yield line
+            return
+
+        batches = window_batches(start, count, line_count)
+        pending = None
+        try:
+            for i, (first, last) in enumerate(batches):
+                if pending is None:
+                    pending = self._read_window(file_id, first, last)
+                lines = await pending
+                pending = None
+                if i + 1 < len(batches):
+                    pending = asyncio.ensure_future(
+                        self._read_window(file_id, *batches[i + 1])
+                    )
+                for line in lines:
+                    yield line
+        finally:
+            if isinstance(pending, asyncio.Future):
+                pending.cancel()
+
+    async def _read_window(self, file_id, first, last):
+        (entries,) = await self.storage.read_ranges(
+            OFFSETS_BUCKET, file_id, [window_range(first, last)]
+        )
+        offsets = unpack_offsets(entries)
+        (data,) = await self._read_content_ranges(file_id, [(offsets[0], offsets[-1])])
+        return decode_window(first, offsets, data)
+
+    async def get_longest_lines(self, number):
+        """
+        Retrieve the longest lines from all stored files.
+        Args:
+            number (int): Number of longest lines to retrieve.
+        Returns:
+            list: The line number, text and file_id of each line, longest first.
+        """
+        return [line async for line in self.iter_longest_lines(number)]
+
+    async def iter_longest_lines(self, number):
+        """
+        Yield the longest lines from all stored files, from the corpus top-K list
+        when it holds enough lines and every file is indexed, or else from
+        TextFileService.iter_longest_lines() in a worker thread.
+        Args:
+            number (int): Number of longest lines to retrieve.
+        Yields:
+            dict: The line number, text and file_id of each line, longest first.
+        """
+        indexed = not await self.db.files.find_one(UNINDEXED, {"_id": 1})
+        if number <= self.top_k and indexed:
+            for line in await self._get_top_lines(CORPUS_LONGEST_LINES_ID, number):
+                yield line
+            return
+        async for line in self._iter_sync("iter_longest_lines", number):
+            yield line
+
+    async def get_longest_lines_single_file(self, number):
+        """
+        Retrieve the longest lines from the most recent file.
+        Args:
+            number (int): Number of longest lines to retrieve.
+        Returns:
+            list: The line number and text of each line, longest first.
+        """
+        return [line async for line in self.iter_longest_lines_single_file(number)]
+
+    async def iter_longest_lines_single_file(self, number):
+        """
+        Yield the longest lines from the most recent file.
+        Args:
+            number (int): Number of longest lines to retrieve.
+        Yields:
+            dict: The line number and text of each line, longest first.
+        """
+        last_doc = await self.get_last_file_metadata()
+        if number <= self.top_k and "line_count" in last_doc:
+            for line in await self._get_top_lines(last_doc["file_id"], number):
+                yield line
+            return
+        async for line in self._iter_sync("iter_longest_lines_single_file", number):
+            yield line
+
+    async def _get_top_lines(self, key, number):
+        doc = await self.db.longest_lines.find_one(
+            {"_id": key}, {"lines": {"$slice": number}}
+        )
+        return top_lines(doc)
+
+    def iter_search(self, query, limit):
+        """
+        Find the lines containing a text, across the files in the trigram index
+        and then in the files not indexed yet, which are scanned in a worker
+        thread.
+        Args:
+            query (str): Text to look for, at least three bytes long in UTF-8.
+            limit (int): Maximum number of lines to return.
+        Returns:
+            async iterator: The file_id, line number and text of each matching
+                            line, in upload order and then line order.
+        Raises:
+            ValueError: If the query is too short to be looked up.
+        """
+        grams = trigrams(query.encode("utf-8"))
+        if not grams:
+            raise ValueError("q must be at least 3 bytes long in UTF-8")
+        return self._search(query, grams, limit)
+
+    async def _search(self, query, grams, limit):
+        if not limit:
+            return
+        async for file_id, docs in self._iter_postings(grams):
+            for numbers in verify_batches(intersect_postings(docs, grams)):
+                texts = await self.get_lines(file_id, numbers, errors="replace")
+                for match in matching_lines(file_id, numbers, texts, query):
+                    yield match
+                    limit -= 1
+                    if not limit:
+                        return
+
+        async for doc in self.db.files.find(UNSEARCHABLE, {"file_id": 1}).sort(
+            "_id", 1
+        ):
+            for match in await self._run_sync(
+                "_scan_for", doc["file_id"], query, limit
+            ):
+                yield match
+                limit -= 1
+            if not limit:
+                return
+
+    async def _iter_postings(self, grams):
+        counts = {
+            gram: await self.db.trigrams.count_documents(
+                {"gram": gram}, limit=GRAM_COUNT_LIMIT
+            )
+            for gram in grams
+        }
+        file_ids = None
+        for gram in rarest_first(counts):
+            file_ids = await self.db.trigrams.distinct(
+                "file_id", gram_query(gram, file_ids)
+            )
+            if not file_ids:
+                return
+        for query in postings_queries(grams, sorted(file_ids)):
+            file_id, docs = None, []
+            async for doc in self.db.trigrams.find(*query).sort("file_id", 1):
+                if doc["file_id"] != file_id and docs:
+                    yield file_id, docs
+                    docs = []
+                file_id = doc["file_id"]
+                docs.append(doc)
+            if docs:
+                yield file_id, docs
+
+    async def get_letter_stats(self, doc):
+        """
+        Retrieve the letter frequencies of a file, as computed when it was
+        indexed. Files indexed before that are scanned in a worker thread.
+        Args:
+            doc (dict): Metadata of the file.
+        Returns:
+            dict: The file's id and letter frequencies.
+        """
+        stats = await self.db.letter_stats.find_one({"_id": doc["file_id"]}, {"_id": 0})
+        if stats is None:
+            return await self._run_sync("get_letter_stats", doc)
+        return dict(file_id=doc["file_id"], **stats)
@@ -0,0 +1,319 @@
+import asyncio
+import functools
+import time
+from http import HTTPStatus
+
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+from werkzeug.utils import get_content_type
+
+from app.api.file.async_service import AsyncTextFileService
+from app.api.file.exceptions import FileNotFound, NoContentFound
+from app.api.file.response_cache import response_cache
+from app.api.file.serializers import (
+    JSON_MIMETYPE,
+    MSGPACK_MIMETYPE,
+    NDJSON_MIMETYPE,
+    TEXT_MIMETYPE,
+    dumps_json,
+    encode,
+    line_body,
+    lines_body,
+    negotiate,
+)
+from app.api.file.view import (
+    LINE_MIMETYPES,
+    LINE_WINDOW_STREAM_THRESHOLD,
+    MAX_LINE_WINDOW,
+    MAX_SEARCH_LIMIT,
+    parse_non_negative,
+    parse_sample_count,
+)
+from app.api.metrics.instrumentation import (
+    REQUEST_SECONDS,
+    RESPONSE_CACHE_REQUESTS,
+    timed,
+)
+
+PREFIX = "/api/v1/file"
+
+
+def respond(body, mimetype, status=HTTPStatus.OK):
+    """
+    Build a response with the same Content-Type header as Flask would send.
+    """
+    return Response(body, status, media_type=get_content_type(mimetype, "utf-8"))
+
+
+def render(request, data, status=HTTPStatus.OK):
+    """
+    Build a JSON or MessagePack response, whichever the client prefers.
+    """
+    mimetype = negotiate([JSON_MIMETYPE, MSGPACK_MIMETYPE], accept=accept(request))
+    return respond(encode(data, mimetype), mimetype, status)
+
+
+def error(message, status):
+    return respond(dumps_json({"error": message}) + b"\n", JSON_MIMETYPE, status)
+
+
+def accept(request):
+    return parse_accept_header(request.headers.get("accept"), MIMEAccept)
+
+
+def ndjson_response(items):
+    """
+    Stream items as newline-delimited JSON.
+    Args:
+        items (async iterable): JSON-serializable items.
+    """
+
+    async def generate():
+        async for item in items:
+            yield dumps_json(item) + b"\n"
+
+    return StreamingResponse(generate(), media_type=NDJSON_MIMETYPE)
+
+
+def service(request):
+    return AsyncTextFileService(request.app.state.flask_app)
+
+
+def instrumented(path, endpoint):
+    """
+    Record the latency of an endpoint in the request metrics of the sync app.
+    """
+
+    @functools.wraps(endpoint)
+    async def wrapper(request):
+        started = time.perf_counter()
+        response = await endpoint(request)
+        REQUEST_SECONDS.labels(path, request.method, response.status_code).observe(
+            time.perf_counter() - started
+        )
+        return response
+
+    return wrapper
+
+
+def cached(path, endpoint):
+    """
+    Serve an endpoint through the response cache of the sync app, like the
+    cached() decorator of its views: both apps answer a URL with the same ETag,
+    Cache-Control and 304 Not Modified, and share the cached bodies. Entries of
+    RESPONSE_CACHE_DIR are read and written in a worker thread.
+    """
+
+    @functools.wraps(endpoint)
+    async def wrapper(request):
+        if not request.app.state.flask_app.config.get("RESPONSE_CACHE_ENABLED"):
+            return await endpoint(request)
+        version = await service(request).get_version()
+        if version is None:
+            return await endpoint(request)
+
+        generation = version[1]
+        key = response_cache.key(
+            version,
+            request.url.path,
+            request.query_params.multi_items(),
+            request.headers.get("accept", ""),
+        )
+        if parse_etags(request.headers.get("if-none-match")).contains_weak(key):
+            RESPONSE_CACHE_REQUESTS.labels(path, "not_modified").inc()
+            return validated(Response(status_code=HTTPStatus.NOT_MODIFIED), key)
+
+        entry = await off_loop(response_cache.get, generation, key)
+        if entry is not None:
+            RESPONSE_CACHE_REQUESTS.labels(path, "hit").inc()
+            content_type, body = entry
+            return validated(Response(body, media_type=content_type), key)
+
+        RESPONSE_CACHE_REQUESTS.labels(path, "miss").inc()
+        response = await endpoint(request)
+        if response.status_code != HTTPStatus.OK:
+            return response
+        if not isinstance(response, StreamingResponse):
+            await off_loop(
+                response_cache.put,
+                generation,
+                key,
+                response.headers["content-type"],
+                response.body,
+            )
+        return validated(response, key)
+
+    return wrapper
+
+
+def validated(response, key):
+    """
+    Add the validators of a cacheable response, as ResponseCache.conditional.
+    """
+    response.headers["ETag"] = quote_etag(key)
+    response.headers["Vary"] = "Accept"
+    response.headers["Cache-Control"] = response_cache.cache_control()
+    return response
+
+
+async def off_loop(method, *args):
+    if response_cache.directory:
+        return await asyncio.to_thread(method, *args)
+    return method(*args)
+
+
+async def random_line(request):
+    """
+    Async GET /file/line/random, answering like RandomLineView.
+    """
+    scope = request.query_params.get("scope", "latest")
+    if scope not in ("latest", "all"):
+        return error(f"Unknown scope: {scope}", HTTPStatus.BAD_REQUEST)
+    try:
+        count = parse_sample_count(request.query_params)
+    except ValueError as err:
+        return error(str(err), HTTPStatus.BAD_REQUEST)
+
+    files = service(request)
+    mimetypes = accept(request)
+    mimetype = negotiate(LINE_MIMETYPES, TEXT_MIMETYPE, mimetypes)
+    # application/* as the preferred type asks for the line with its metadata.
+    detailed = mimetypes.best == "application/*"
+
+    if count is not None:
+        replace = request.query_params.get("replace", "true").lower() == "true"
+        if scope == "all":
+            lines = await files.get_random_corpus_lines(count, replace)
+        else:
+            lines = await files.get_random_lines(count, replace)
+        with timed("serialize"):
+            if detailed:
+                return render(request, lines)
+            return respond(lines_body(lines, mimetype), mimetype)
+
+    if scope == "all":
+        line_info = await files.get_random_corpus_line()
+    else:
+        line_info = await files.get_random_line()
+    with timed("serialize"):
+        if detailed:
+            return render(request, line_info)
+        return respond(line_body(line_info, mimetype), mimetype)
+
+
+async def random_line_backward(request):
+    """
+    Async GET /file/line/random-backward, answering like RandomLineBackwardView.
+    """
+    try:
+        count = parse_sample_count(request.query_params)
+    except ValueError as err:
+        return error(str(err), HTTPStatus.BAD_REQUEST)
+
+    files = service(request)
+    if count is not None:
+        replace = request.query_params.get("replace", "true").lower() == "true"
+        lines = await files.get_random_lines_backward(count, replace)
+        return render(request, {"lines": lines})
+
+    line = await files.get_random_line_backward()
+    return render(request, {"line": line})
+
+
+async def longest_lines(request):
+    """
+    Async GET /file/longest, answering like FileLineLongestView.
+    """
+    try:
+        number = parse_non_negative("number", 100, args=request.query_params)
+    except ValueError as err:
+        return error(str(err), HTTPStatus.BAD_REQUEST)
+
+    files = service(request)
+    if request.query_params.get("single", "false").lower() == "true":
+        lines = files.iter_longest_lines_single_file(number)
+    else:
+        lines = files.iter_longest_lines(number)
+
+    streamed = request.query_params.get("stream", "false").lower() == "true"
+    if streamed or accept(request).best == NDJSON_MIMETYPE:
+        return ndjson_response(lines)
+    return render(request, [line async for line in lines])
+
+
+async def search(request):
+    """
+    Async GET /file/search, answering like FileSearchView.
+    """
+    try:
+        limit = parse_non_negative(
+            "limit", 100, MAX_SEARCH_LIMIT, args=request.query_params
+        )
+        matches = service(request).iter_search(request.query_params.get("q", ""), limit)
+    except ValueError as err:
+        return error(str(err), HTTPStatus.BAD_REQUEST)
+
+    return ndjson_response(matches)
+
+
+async def file_lines(request):
+    """
+    Async GET /file/<file_id>/lines, answering like FileLinesView.
+    """
+    try:
+        start = parse_non_negative("start", 0, args=request.query_params)
+        count = parse_non_negative(
+            "count", 100, MAX_LINE_WINDOW, args=request.query_params
+        )
+    except ValueError as err:
+        return error(str(err), HTTPStatus.BAD_REQUEST)
+
+    files = service(request)
+    try:
+        doc = await files.get_file_metadata(request.path_params["file_id"])
+    except (FileNotFound, NoContentFound) as err:
+        return error(str(err), HTTPStatus.NOT_FOUND)
+
+    lines = files.iter_line_window(doc, start, count)
+    streamed = accept(request).best == NDJSON_MIMETYPE
+    if streamed or count > LINE_WINDOW_STREAM_THRESHOLD:
+        return ndjson_response(lines)
+
+    window = {
+        "file_id": doc["file_id"],
+        "start": start,
+        "lines": [line async for line in lines],
+    }
+    return render(request, window)
+
+
+async def file_letters(request):
+    """
+    Async GET /file/<file_id>/letters, answering like FileLettersView.
+    """
+    files = service(request)
+    try:
+        doc = await files.get_file_metadata(request.path_params["file_id"])
+    except (FileNotFound, NoContentFound) as err:
+        return error(str(err), HTTPStatus.NOT_FOUND)
+
+    return render(request, await files.get_letter_stats(doc))
+
+
+def route(path, endpoint, cacheable=False):
+    path = PREFIX + path
+    if cacheable:
+        endpoint = cached(path, endpoint)
+    return Route(path, instrumented(path, endpoint), methods=["GET"])
+
+
+routes = [
+    route("/line/random", random_line),
+    route("/line/random-backward", random_line_backward),
+    route("/longest", longest_lines, cacheable=True),
+    route("/search", search, cacheable=True),
+    route("/{file_id}/lines", file_lines, cacheable=True),
+    route("/{file_id}/letters", file_letters, cacheable=True),
+]
@@ -0,0 +1,87 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    In-process cache bounded by the total size of its values, evicting the least
+    recently used entries first. Each uWSGI worker holds its own instance.
+    """
+
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_bytes = app.config["FILE_CACHE_MAX_BYTES"]
+        self.clear()
+
+    def get(self, key):
+        """
+        Look up a cached value and mark it as recently used.
+        Args:
+            key (hashable): The key the value was stored under.
+        Returns:
+            The cached value, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=None):
+        """
+        Store a value, evicting older entries until the cache fits its budget.
+        Values larger than the whole budget are not stored.
+        Args:
+            key (hashable): The key to store the value under.
+            value: The value to store.
+            size (int): Bytes charged for the value, ``len(value)`` by default.
+        """
+        size = len(value) if size is None else size
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """
+        Report the cache usage counters of this worker.
+        Returns:
+            dict: Hits, misses, evictions, entries and bytes in use.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+file_cache = LRUCache()
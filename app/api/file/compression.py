@@ -0,0 +1,195 @@
+import gzip
+import io
+from array import array
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FRAME_TYPECODE = "Q"
+
+
+class GzipCodec:
+    name = "gzip"
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def decompress(self, data):
+        return gzip.decompress(data)
+
+
+class ZstdCodec:
+    name = "zstd"
+
+    def __init__(self, level=3):
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def decompress(self, data):
+        return self.decompressor.decompress(data)
+
+
+def get_codec(name, fallback=True):
+    """
+    Build the codec files are compressed or decompressed with.
+    zstd needs the ``compression`` extra; without it, new files fall back to gzip.
+    Args:
+        name (str): ``zstd``, ``gzip``, or ``none``/None for no compression.
+        fallback (bool): Whether gzip may replace zstd when it is not installed,
+            which is only right for compressing new files.
+    Returns:
+        GzipCodec, ZstdCodec or None.
+    Raises:
+        ValueError: If the codec is unknown, or is zstd without the extra and
+            without fallback.
+    """
+    if name in (None, "none"):
+        return None
+    if name == "zstd" and zstandard is not None:
+        return ZstdCodec()
+    if name == "gzip" or (name == "zstd" and fallback):
+        return GzipCodec()
+    if name == "zstd":
+        raise ValueError("Reading zstd compressed files needs the zstandard package")
+    raise ValueError(f"Unknown compression codec: {name}")
+
+
+class FrameWriter:
+    """
+    Compress a stream in frames of a fixed uncompressed size, each decodable on
+    its own. Byte ``i`` of the original content is therefore in frame
+    ``i // frame_size``, so line offsets need no translation and reading a line
+    only decompresses the frames it spans.
+    """
+
+    def __init__(self, codec, frame_size, write):
+        self.codec = codec
+        self.frame_size = frame_size
+        self.ends = array(FRAME_TYPECODE)
+        self._write = write
+        self.size = 0
+        self._buffer = bytearray()
+        self._written = 0
+
+    def feed(self, data):
+        self.size += len(data)
+        self._buffer += data
+        while len(self._buffer) >= self.frame_size:
+            self._flush(self._buffer[: self.frame_size])
+            del self._buffer[: self.frame_size]
+
+    def close(self):
+        if self._buffer:
+            self._flush(self._buffer)
+            self._buffer = bytearray()
+
+    def layout(self):
+        """
+        Describe the stored frames, to be saved with the file's metadata.
+        Returns:
+            dict: The codec name, the uncompressed frame and content sizes and
+                  the packed compressed end offset of each frame.
+        """
+        return {
+            "codec": self.codec.name,
+            "frame_size": self.frame_size,
+            "frames": self.ends.tobytes(),
+            "size": self.size,
+        }
+
+    def _flush(self, frame):
+        compressed = self.codec.compress(bytes(frame))
+        self._write(compressed)
+        self._written += len(compressed)
+        self.ends.append(self._written)
+
+
+class FrameReader(io.RawIOBase):
+    """
+    Seekable read-only view of the original content of a compressed file.
+    Only the frame holding the current position is kept decompressed.
+    """
+
+    def __init__(self, raw, codec, frame_size, ends, size):
+        self.raw = raw
+        self.codec = codec
+        self.frame_size = frame_size
+        self.ends = ends
+        self.size = size
+        self._position = 0
+        self._frame = (None, b"")
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self.size}
+        self._position = max(0, base[whence] + offset)
+        return self._position
+
+    def readinto(self, buffer):
+        if self._position >= self.size:
+            return 0
+        n, offset = divmod(self._position, self.frame_size)
+        if self._frame[0] != n:
+            start, end = frame_bounds(self.ends, n)
+            self.raw.seek(start)
+            self._frame = (n, self.codec.decompress(self.raw.read(end - start)))
+        data = self._frame[1][offset : offset + len(buffer)]
+        buffer[: len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+def unpack_frames(data):
+    frames = array(FRAME_TYPECODE)
+    frames.frombytes(data)
+    return frames
+
+
+def frame_bounds(ends, n):
+    """
+    Return the compressed ``(start, end)`` byte range of frame ``n``.
+    """
+    return (ends[n - 1] if n else 0), ends[n]
+
+
+def iter_decompressed(codec, ends, pieces):
+    """
+    Decompress a stored file frame by frame as its bytes arrive.
+    Args:
+        codec: The codec the file was compressed with.
+        ends (array): Compressed end offset of each frame.
+        pieces (iterable): The stored bytes, in any number of pieces.
+    Yields:
+        bytes: The uncompressed content of each frame.
+    """
+    buffer = bytearray()
+    consumed = 0
+    frame = 0
+    for piece in pieces:
+        buffer += piece
+        while frame < len(ends) and consumed + len(buffer) >= ends[frame]:
+            size = ends[frame] - consumed
+            yield codec.decompress(bytes(buffer[:size]))
+            del buffer[:size]
+            consumed += size
+            frame += 1
@@ -35,3 +35,12 @@ class NoContentFound(Exception):
 
     def __str__(self):
         return self.message
+
+
+class InvalidArchiveException(Exception):
+    def __init__(self, message="The uploaded archive is not a valid tar or zip file."):
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return self.message
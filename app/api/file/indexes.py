@@ -0,0 +1,146 @@
+import heapq
+from array import array
+
+from app.api.file.letters import LetterIndexer
+
+OFFSET_TYPECODE = "Q"
+OFFSET_SIZE = array(OFFSET_TYPECODE).itemsize
+
+
+class LineIndexer:
+    """
+    Incrementally build the per-file line indexes from a stream of bytes.
+
+    Content is fed in arbitrary chunks, so the indexes can be built while the file
+    is being stored. Once closed, ``offsets`` holds the byte offset where every line
+    starts plus a trailing sentinel with the file size, so line ``i`` spans
+    ``offsets[i]:offsets[i + 1]``. When ``top_k`` is set, the longest lines are kept
+    in a bounded heap along the way, and with ``letters`` set, the most frequent
+    letter of every line is recorded by a LetterIndexer. Lines are also fed to the
+    ``trigrams`` indexer when one is given, to build the search index.
+
+    Offsets can be handed off with ``pop_offsets`` as they accumulate, so memory
+    stays bounded by the chunk size and K rather than by the number of lines. Only
+    the letter codes, a byte per line for most files, are held until the end.
+    """
+
+    def __init__(self, top_k=0, letters=False, trigrams=None):
+        self.offsets = array(OFFSET_TYPECODE)
+        self.size = 0
+        self.line_count = 0
+        self.top_k = top_k
+        self.letters = LetterIndexer() if letters else None
+        self.trigrams = trigrams
+        self._longest = []
+        self._pending = []
+        self._line_start = 0
+
+    def feed(self, chunk):
+        """
+        Index the lines completed by the next chunk of the file.
+        Args:
+            chunk (bytes): The next slice of the file content.
+        """
+        if not chunk:
+            return
+
+        lines = chunk.split(b"\n")
+        tail = lines.pop()
+        if lines:
+            if self._pending:
+                self._pending.append(lines[0])
+                lines[0] = b"".join(self._pending)
+                self._pending = []
+            for raw in lines:
+                self._add_line(raw)
+        if tail:
+            self._pending.append(tail)
+        self.size += len(chunk)
+
+    def close(self):
+        """
+        Index the last line and append the end-of-file sentinel.
+        Returns:
+            array: The line start offsets followed by the file size.
+        """
+        if self._pending:
+            self._add_line(b"".join(self._pending))
+            self._pending = []
+        self.offsets.append(self.size)
+        return self.offsets
+
+    def pop_offsets(self):
+        """
+        Take the offsets collected since the last call, packed for storage.
+        Returns:
+            bytes: The packed offsets, in line order.
+        """
+        data = self.offsets.tobytes()
+        del self.offsets[:]
+        return data
+
+    def longest(self):
+        """
+        List the longest lines seen, longest first and earliest first on ties.
+        Returns:
+            list: Dictionaries with the line number, text and length of each line.
+        """
+        return [
+            {"line": -number, "text": text, "length": length}
+            for length, number, text in sorted(self._longest, reverse=True)
+        ]
+
+    def _add_line(self, raw):
+        number = self.line_count
+        self.line_count += 1
+        self.offsets.append(self._line_start)
+        self._line_start += len(raw) + 1
+        if self.top_k:
+            self._track_longest(number, raw)
+        if self.letters is not None:
+            self.letters.add(raw)
+        if self.trigrams is not None:
+            self.trigrams.add(number, raw)
+
+    def _track_longest(self, number, raw):
+        heap = self._longest
+        # A line never has more characters than bytes, so short lines are
+        # discarded before paying for the decode.
+        if len(heap) == self.top_k and len(raw) <= heap[0][0]:
+            return
+
+        text = decode_line(raw, errors="replace")
+        entry = (len(text), -number, text)
+        if len(heap) < self.top_k:
+            heapq.heappush(heap, entry)
+        else:
+            heapq.heappushpop(heap, entry)
+
+
+def unpack_offsets(data):
+    """
+    Decode a packed slice of a line-offset index.
+    Args:
+        data (bytes): Raw bytes read from the stored index.
+    Returns:
+        array: The offsets contained in the slice.
+    """
+    offsets = array(OFFSET_TYPECODE)
+    offsets.frombytes(data)
+    return offsets
+
+
+def decode_line(raw, errors="strict"):
+    """
+    Turn the raw bytes of a single line into text, dropping its line break.
+    Args:
+        raw (bytes): Bytes spanning one line, including the trailing newline.
+        errors (str): How to handle bytes that are not valid UTF-8.
+    Returns:
+        str: The decoded line.
+    """
+    if raw.endswith(b"\n"):
+        raw = raw[:-1]
+    if raw.endswith(b"\r"):
+        raw = raw[:-1]
+    return raw.decode("utf-8", errors)
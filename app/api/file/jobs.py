@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta, timezone
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+
+from app.db import mongo
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class IngestQueue:
+    """
+    Queue of indexing jobs stored in the ``jobs`` collection, so background
+    workers need nothing but MongoDB. Jobs are claimed atomically; a running job
+    whose worker has not finished it within the timeout is handed out again.
+    """
+
+    def enqueue(self, file_id):
+        """
+        Queue the indexing of a stored file.
+        Args:
+            file_id (str): ObjectId of the file to index.
+        Returns:
+            ObjectId: The id of the new job.
+        """
+        result = mongo.db.jobs.insert_one(
+            {
+                "file_id": file_id,
+                "status": QUEUED,
+                "attempts": 0,
+                "created_at": datetime.now(timezone.utc),
+            }
+        )
+        return result.inserted_id
+
+    def claim(self, worker, timeout):
+        """
+        Take the oldest queued job, or a running job that timed out.
+        Args:
+            worker (str): Name of the claiming worker, recorded on the job.
+            timeout (int): Seconds after which a running job is considered lost.
+        Returns:
+            dict or None: The claimed job, or None if there is nothing to do.
+        """
+        now = datetime.now(timezone.utc)
+        return mongo.db.jobs.find_one_and_update(
+            {
+                "$or": [
+                    {"status": QUEUED},
+                    {
+                        "status": RUNNING,
+                        "started_at": {"$lt": now - timedelta(seconds=timeout)},
+                    },
+                ]
+            },
+            {
+                "$set": {"status": RUNNING, "started_at": now, "worker": worker},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("_id", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def complete(self, job_id):
+        mongo.db.jobs.update_one(
+            {"_id": job_id},
+            {"$set": {"status": DONE, "finished_at": datetime.now(timezone.utc)}},
+        )
+
+    def fail(self, job, error, max_attempts):
+        """
+        Record a failed attempt, queueing the job again until it has been tried
+        max_attempts times.
+        Args:
+            job (dict): The job as returned by claim().
+            error (str): Description of the failure.
+            max_attempts (int): Number of attempts before the job is abandoned.
+        """
+        status = FAILED if job["attempts"] >= max_attempts else QUEUED
+        mongo.db.jobs.update_one(
+            {"_id": job["_id"]},
+            {
+                "$set": {
+                    "status": status,
+                    "error": error,
+                    "finished_at": datetime.now(timezone.utc),
+                }
+            },
+        )
+
+    def get(self, job_id):
+        """
+        Look up a job by id.
+        Args:
+            job_id (str): ObjectId of the job.
+        Returns:
+            dict or None: The job, or None if the id is unknown or malformed.
+        """
+        try:
+            return mongo.db.jobs.find_one({"_id": ObjectId(job_id)})
+        except InvalidId:
+            return None
+
+
+ingest_queue = IngestQueue()
@@ -0,0 +1,129 @@
+import string
+from array import array
+from collections import Counter
+
+ASCII_LETTERS = string.ascii_letters.encode()
+ASCII_LOWERCASE = string.ascii_lowercase.encode()
+# Lowercases ASCII letters, while the delete argument drops every other byte.
+LOWERCASE_TABLE = bytes.maketrans(string.ascii_uppercase.encode(), ASCII_LOWERCASE)
+NON_LETTERS = bytes(code for code in range(128) if code not in ASCII_LETTERS)
+CODE_TYPECODES = ("B", "H", "I")
+ASCII_BUFFER_SIZE = 1024 * 1024
+
+
+def most_frequent_letter(text):
+    """
+    Identify the most frequent letter in a text, case-insensitively. Ties go to
+    the letter that appears first.
+    Args:
+        text (str or bytes): Text content, or the UTF-8 bytes of a line.
+    Returns:
+        str or None: The most frequent letter, or None if no letters are found.
+    """
+    letters = _letters(text)
+    if not letters:
+        return None
+    letter, _ = Counter(letters).most_common(1)[0]
+    return chr(letter) if isinstance(letter, int) else letter
+
+
+def _letters(text):
+    # ASCII text is lowercased and stripped of non-letters by one translate()
+    # call, leaving bytes that Counter tallies in C.
+    if isinstance(text, str):
+        if text.isascii():
+            text = text.encode("ascii")
+        else:
+            return [char.lower() for char in text if char.isalpha()]
+    elif not text.isascii():
+        text = text.decode("utf-8", "replace")
+        return [char.lower() for char in text if char.isalpha()]
+    return text.translate(LOWERCASE_TABLE, NON_LETTERS)
+
+
+class LetterIndexer:
+    """
+    Record the most frequent letter of every line of a file, and the letter
+    frequencies of the whole file, as the lines are indexed.
+
+    Each line's letter is kept as a code into ``alphabet``, 0 meaning no letter,
+    in an array of the smallest type that holds them, so line ``i``'s code is
+    stored at ``codes[i]``. Letters of ASCII lines are buffered and counted in
+    bulk with ``bytes.count``.
+    """
+
+    def __init__(self):
+        self.alphabet = []
+        self.codes = array(CODE_TYPECODES[0])
+        self._codes = {}
+        self._totals = Counter()
+        self._ascii = bytearray()
+
+    def add(self, raw):
+        """
+        Record the letters of the next line.
+        Args:
+            raw (bytes or str): The line's content, without its line break.
+        """
+        letters = _letters(raw)
+        if not letters:
+            self.codes.append(0)
+            return
+
+        letter, _ = Counter(letters).most_common(1)[0]
+        if isinstance(letters, bytes):
+            letter = chr(letter)
+            self._ascii += letters
+            if len(self._ascii) >= ASCII_BUFFER_SIZE:
+                self._count_ascii()
+        else:
+            self._totals.update(letters)
+
+        code = self._codes.get(letter)
+        if code is None:
+            self.alphabet.append(letter)
+            code = self._codes[letter] = len(self.alphabet)
+            self._widen(code)
+        self.codes.append(code)
+
+    def layout(self):
+        """
+        Describe how the line codes are stored, to be saved with the file's
+        metadata so a line's letter can be read without the statistics.
+        Returns:
+            dict: The alphabet and array typecode of the codes.
+        """
+        return {"alphabet": self.alphabet, "typecode": self.codes.typecode}
+
+    def stats(self):
+        """
+        Aggregate the letter frequencies of the file.
+        Returns:
+            dict: The count of each letter in the whole file, the number of lines
+                  each letter is the most frequent of, and the number of lines
+                  without letters, most frequent letters first.
+        """
+        self._count_ascii()
+        lines = Counter(self.codes)
+        return {
+            "letters": dict(self._totals.most_common()),
+            "most_frequent": {
+                self.alphabet[code - 1]: count
+                for code, count in lines.most_common()
+                if code
+            },
+            "lines_without_letters": lines[0],
+        }
+
+    def _count_ascii(self):
+        for code in ASCII_LOWERCASE:
+            count = self._ascii.count(code)
+            if count:
+                self._totals[chr(code)] += count
+        self._ascii.clear()
+
+    def _widen(self, code):
+        limit = 1 << (8 * self.codes.itemsize)
+        if code >= limit:
+            typecode = CODE_TYPECODES[CODE_TYPECODES.index(self.codes.typecode) + 1]
+            self.codes = array(typecode, self.codes)
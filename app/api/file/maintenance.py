@@ -0,0 +1,292 @@
+import heapq
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from bson.objectid import ObjectId
+from flask import current_app
+from pymongo import UpdateOne
+
+from app.db import mongo
+from app.api.file.indexes import OFFSET_SIZE
+from app.api.file.service import (
+    CORPUS_LONGEST_LINES_ID,
+    FILES_COUNTER_ID,
+    OFFSETS_BUCKET,
+    PENDING,
+    TextFileService,
+)
+
+REINDEX_CHECKPOINT_ID = "reindex"
+EXPECTED_INDEXES = {
+    "files": ["hash_1", "seq_1", "line_start_1"],
+    "jobs": ["status_1_started_at_1"],
+    "trigrams": ["gram_1_file_id_1", "file_id_1"],
+}
+
+
+def find_duplicate_hashes():
+    """
+    Find files stored more than once, which prevent the unique index on ``hash``
+    from being built. Only files uploaded before that index existed can be
+    duplicated.
+    Returns:
+        list: One document per duplicated hash with the ``ids`` and ``file_ids``
+              of its copies, oldest first.
+    """
+    return list(
+        mongo.db.files.aggregate(
+            [
+                {"$sort": {"_id": 1}},
+                {
+                    "$group": {
+                        "_id": "$hash",
+                        "ids": {"$push": "$_id"},
+                        "file_ids": {"$push": "$file_id"},
+                        "count": {"$sum": 1},
+                    }
+                },
+                {"$match": {"count": {"$gt": 1}}},
+            ],
+            allowDiskUse=True,
+        )
+    )
+
+
+def drop_duplicate_files():
+    """
+    Keep the oldest copy of every duplicated file and delete the others, along
+    with their stored content and indexes. The sequence numbers, line totals
+    and corpus longest lines are then rebuilt without them, so uploads should
+    be stopped while this runs.
+    Returns:
+        int: Number of copies deleted.
+    """
+    service = TextFileService()
+    dropped = 0
+    for group in find_duplicate_hashes():
+        kept = group["file_ids"][0]
+        for doc_id, file_id in zip(group["ids"][1:], group["file_ids"][1:]):
+            mongo.db.files.delete_one({"_id": doc_id})
+            if file_id != kept:
+                service._discard(file_id)
+                mongo.db.longest_lines.delete_one({"_id": file_id})
+            dropped += 1
+    if dropped:
+        rebuild_corpus_longest_lines(service.top_k)
+        renumber_files()
+    return dropped
+
+
+def rebuild_corpus_longest_lines(top_k):
+    """
+    Rebuild the corpus-wide top-K list of longest lines from the lists of each
+    file, e.g. after files were deleted.
+    Args:
+        top_k (int): Number of lines the list keeps.
+    """
+    lines = heapq.nsmallest(
+        top_k,
+        (
+            dict(line, file_id=doc["_id"])
+            for doc in mongo.db.longest_lines.find(
+                {"_id": {"$ne": CORPUS_LONGEST_LINES_ID}}
+            )
+            for line in doc["lines"]
+        ),
+        key=lambda line: (-line["length"], line["file_id"], line["line"]),
+    )
+    mongo.db.longest_lines.replace_one(
+        {"_id": CORPUS_LONGEST_LINES_ID}, {"lines": lines}, upsert=True
+    )
+
+
+def renumber_files():
+    """
+    Hand out the sequence numbers and ``line_start`` prefix sums again in
+    upload order, closing the gaps left by deleted files, and reset the
+    counters to match. Files move down one at a time, into numbers already
+    freed, so the unique index on ``seq`` holds throughout.
+    """
+    seq, line_start, requests = 0, 0, []
+    for doc in mongo.db.files.find(
+        {"seq": {"$exists": True}}, {"seq": 1, "line_start": 1, "line_count": 1}
+    ).sort("seq", 1):
+        seq += 1
+        if doc["seq"] != seq or doc.get("line_start") != line_start:
+            requests.append(
+                UpdateOne(
+                    {"_id": doc["_id"]},
+                    {"$set": {"seq": seq, "line_start": line_start}},
+                )
+            )
+        line_start += doc.get("line_count", 0)
+    if requests:
+        mongo.db.files.bulk_write(requests, ordered=True)
+    mongo.db.counters.update_one(
+        {"_id": FILES_COUNTER_ID},
+        {
+            "$set": {"seq": seq, "lines": line_start},
+            "$inc": {"generation": 1},
+            "$setOnInsert": {"epoch": ObjectId()},
+        },
+        upsert=True,
+    )
+
+
+def reindex_query(since=None):
+    """
+    Select the files missing their line-offset, letters or search index, which
+    are those uploaded before they existed or whose indexing failed. The search
+    index is only expected when SEARCH_INDEX_ENABLED is set. Files queued for
+    the ingest workers are left to them.
+    Args:
+        since (ObjectId): Only select metadata documents created after this one.
+    """
+    missing = [
+        {"line_count": {"$exists": False}},
+        {"letters": {"$exists": False}},
+    ]
+    if current_app.config["SEARCH_INDEX_ENABLED"]:
+        missing.append({"trigrams": {"$exists": False}})
+    query = {"$or": missing, "status": {"$ne": PENDING}}
+    if since is not None:
+        query["_id"] = {"$gt": since}
+    return query
+
+
+def reindex_batches(since, batch_size):
+    """
+    Walk the files to reindex in ``_id`` order.
+    Args:
+        since (ObjectId): Start after this metadata document, if given.
+        batch_size (int): Number of files per batch.
+    Yields:
+        list: ``(_id, file_id)`` of each file of the next batch.
+    """
+    while True:
+        batch = [
+            (doc["_id"], doc["file_id"])
+            for doc in mongo.db.files.find(reindex_query(since), {"file_id": 1})
+            .sort("_id", 1)
+            .limit(batch_size)
+        ]
+        if not batch:
+            return
+        yield batch
+        since = batch[-1][0]
+
+
+def load_checkpoint():
+    doc = mongo.db.maintenance.find_one({"_id": REINDEX_CHECKPOINT_ID})
+    return doc["last_id"] if doc else None
+
+
+def save_checkpoint(last_id):
+    mongo.db.maintenance.update_one(
+        {"_id": REINDEX_CHECKPOINT_ID},
+        {"$set": {"last_id": last_id, "updated_at": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+
+
+@contextmanager
+def index_pool(workers, deploy_env):
+    """
+    Provide a function indexing many files, in a pool of worker processes when
+    more than one worker is requested. Each process builds its own app, and so
+    its own MongoDB client.
+    Args:
+        workers (int): Number of worker processes.
+        deploy_env (str): Configuration the worker processes are created with.
+    Yields:
+        callable: Takes an iterable of file ids and returns an iterator of
+        ``(file_id, bytes_indexed, error)``, in the same order.
+    """
+    if workers <= 1:
+        yield lambda file_ids: map(_index_one, file_ids)
+        return
+
+    with ProcessPoolExecutor(
+        workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(deploy_env,),
+    ) as pool:
+        yield lambda file_ids: pool.map(_index_one, file_ids, chunksize=4)
+
+
+def _init_worker(deploy_env):
+    from app import create_app
+
+    create_app(deploy_env)
+
+
+def _index_one(file_id):
+    try:
+        return file_id, TextFileService().index_file(file_id), None
+    except Exception as err:
+        return file_id, 0, f"{type(err).__name__}: {err}"
+
+
+def verify_indexes():
+    """
+    Check that every stored file has consistent metadata and indexes.
+    Returns:
+        list: A description of each problem found; empty when all is well.
+    """
+    problems = []
+    for collection, names in EXPECTED_INDEXES.items():
+        existing = mongo.db[collection].index_information()
+        missing = [name for name in names if name not in existing]
+        if missing:
+            problems.append(f"{collection} is missing indexes: {', '.join(missing)}")
+
+    duplicates = find_duplicate_hashes()
+    if duplicates:
+        problems.append(f"{len(duplicates)} hashes are stored more than once")
+
+    unindexed = mongo.db.files.count_documents(reindex_query())
+    if unindexed:
+        problems.append(
+            f"{unindexed} files have no line-offset, letters or search index"
+        )
+
+    service = TextFileService()
+    offsets = service.storage.sizes(OFFSETS_BUCKET)
+    longest = {doc["_id"] for doc in mongo.db.longest_lines.find({}, {"_id": 1})}
+    bad_offsets, no_longest, no_seq = 0, 0, 0
+    registered, registered_lines = 0, 0
+    for doc in mongo.db.files.find(
+        {"line_count": {"$exists": True}}, {"file_id": 1, "line_count": 1, "seq": 1}
+    ):
+        if offsets.get(doc["file_id"]) != (doc["line_count"] + 1) * OFFSET_SIZE:
+            bad_offsets += 1
+        if doc["file_id"] not in longest:
+            no_longest += 1
+        if "seq" in doc:
+            registered += 1
+            registered_lines += doc["line_count"]
+        else:
+            no_seq += 1
+
+    if bad_offsets:
+        problems.append(f"{bad_offsets} files have a missing or truncated index")
+    if no_longest:
+        problems.append(f"{no_longest} files have no longest-lines list")
+    if no_seq:
+        problems.append(f"{no_seq} indexed files have no sequence number")
+
+    counter = mongo.db.counters.find_one({"_id": FILES_COUNTER_ID}) or {}
+    if counter.get("seq", 0) != registered:
+        problems.append(
+            f"{counter.get('seq', 0)} sequence numbers were handed out "
+            f"for {registered} files"
+        )
+    if counter.get("lines", 0) != registered_lines:
+        problems.append(
+            f"The line total is {counter.get('lines', 0)} "
+            f"but registered files hold {registered_lines} lines"
+        )
+    return problems
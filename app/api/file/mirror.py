@@ -0,0 +1,121 @@
+import mmap
+import os
+import tempfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+
+class FileMirror:
+    """
+    Read-through copy of hot GridFS files on local disk, served through mmap.
+
+    A file is copied once it has been read FILE_MIRROR_MIN_READS times by a
+    worker. Copies are written to a temporary name and atomically renamed into
+    place, so every uWSGI worker on the host can share the directory safely.
+    The directory is kept under FILE_MIRROR_MAX_BYTES by removing the least
+    recently read copies; workers still mapping a removed copy keep their view.
+    """
+
+    def __init__(self):
+        self.directory = None
+        self.max_bytes = 0
+        self.min_reads = 1
+        self._reads = Counter()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.directory = app.config["FILE_MIRROR_DIR"]
+        self.max_bytes = app.config["FILE_MIRROR_MAX_BYTES"]
+        self.min_reads = app.config["FILE_MIRROR_MIN_READS"]
+        self._reads.clear()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    @contextmanager
+    def open(self, bucket, file_id, fetch):
+        """
+        Map the local copy of a file, copying it first once it is hot enough.
+        Args:
+            bucket (str): Name of the GridFS bucket holding the file.
+            file_id (str): ObjectId of the file.
+            fetch (callable): Returns an iterator over the file's bytes.
+        Yields:
+            memoryview or None: A read-only view of the file's bytes, or None when
+            the file is not mirrored.
+        """
+        path = os.path.join(self.directory, f"{bucket}.{file_id}")
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            file = self._fill(bucket, file_id, path, fetch)
+        if file is None:
+            yield None
+            return
+
+        with file:
+            # Through the descriptor, as another worker may have evicted the copy.
+            os.utime(file.fileno())
+            if not os.fstat(file.fileno()).st_size:
+                yield memoryview(b"")
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    yield view
+                finally:
+                    view.release()
+
+    def _fill(self, bucket, file_id, path, fetch):
+        with self._lock:
+            if len(self._reads) > 10000:
+                self._reads.clear()
+            self._reads[(bucket, file_id)] += 1
+            if self._reads[(bucket, file_id)] < self.min_reads:
+                return None
+
+        temporary = tempfile.NamedTemporaryFile(
+            dir=self.directory, prefix=".", delete=False
+        )
+        try:
+            with temporary:
+                for chunk in fetch():
+                    temporary.write(chunk)
+            os.replace(temporary.name, path)
+        except BaseException:
+            os.unlink(temporary.name)
+            raise
+        self._evict()
+
+        try:
+            return open(path, "rb")
+        except FileNotFoundError:
+            return None
+
+    def _evict(self):
+        copies = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            copies.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in copies)
+        for _, size, path in sorted(copies):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+file_mirror = FileMirror()
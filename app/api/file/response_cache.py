@@ -0,0 +1,232 @@
+import functools
+import hashlib
+import os
+import tempfile
+from http import HTTPStatus
+
+from flask import Response, current_app, request
+
+from app.api.file.cache import LRUCache
+from app.api.file.service import TextFileService
+from app.api.metrics.instrumentation import RESPONSE_CACHE_REQUESTS
+
+
+class ResponseCache:
+    """
+    Cache of the responses of read endpoints that only depend on the request and
+    on the stored files, such as the longest lines.
+
+    Responses are keyed by the request's path, query string and Accept header,
+    and by the version of the stored files: the upload generation, which every
+    upload, reindex and dropped duplicate bumps once it is complete, and the
+    epoch of the database, so a dropped and repopulated one whose generations
+    start over never finds the old bodies. Entries are therefore never
+    invalidated: those of older versions are simply no longer looked up.
+    Bodies are kept in an LRU of RESPONSE_CACHE_MAX_BYTES per worker and, when
+    RESPONSE_CACHE_DIR is set, in that directory too, where every uWSGI worker on
+    the host finds them. Files are written to a temporary name and atomically
+    renamed into place, like the local mirror's.
+    """
+
+    def __init__(self):
+        self.max_age = 0
+        self.directory = None
+        self.directory_max_bytes = 0
+        self.memory = LRUCache()
+
+    def init_app(self, app):
+        self.max_age = app.config["RESPONSE_CACHE_MAX_AGE"]
+        self.directory = app.config["RESPONSE_CACHE_DIR"]
+        self.directory_max_bytes = app.config["RESPONSE_CACHE_DIR_MAX_BYTES"]
+        self.memory.max_bytes = app.config["RESPONSE_CACHE_MAX_BYTES"]
+        self.memory.clear()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def clear(self):
+        """
+        Drop every cached response, in this worker and in the shared directory.
+        """
+        self.memory.clear()
+        if not self.directory:
+            return
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def key(self, version, path, args, accept):
+        """
+        Digest a request and the version of the stored files. The digest is also
+        the ETag of the response.
+        Args:
+            version (tuple): The ``(epoch, generation)`` of the stored files.
+            path (str): The path of the request.
+            args (list): The ``(name, value)`` pairs of its query string.
+            accept (str): Its Accept header.
+        Returns:
+            str: The key of the request's response.
+        """
+        parts = (path, sorted(args), accept, version)
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def get(self, generation, key):
+        """
+        Look up a cached response, in this worker first and then in the shared
+        directory.
+        Args:
+            generation (int): The upload generation the key was computed for.
+            key (str): The key of the response.
+        Returns:
+            tuple or None: The Content-Type and body of the response, or None on a
+            miss.
+        """
+        entry = self.memory.get(key)
+        if entry is not None or not self.directory:
+            return entry
+
+        try:
+            with open(self._path(generation, key), "rb") as file:
+                content_type, body = file.read().split(b"\n", 1)
+        except FileNotFoundError:
+            return None
+        entry = (content_type.decode(), body)
+        self.memory.put(key, entry, size=len(body))
+        return entry
+
+    def put(self, generation, key, content_type, body):
+        """
+        Store a response in this worker and in the shared directory.
+        Args:
+            generation (int): The upload generation the key was computed for.
+            key (str): The key of the response.
+            content_type (str): The Content-Type header of the response.
+            body (bytes): The body of the response.
+        """
+        self.memory.put(key, (content_type, body), size=len(body))
+        if not self.directory or len(body) > self.directory_max_bytes:
+            return
+
+        temporary = tempfile.NamedTemporaryFile(
+            dir=self.directory, prefix=".", delete=False
+        )
+        try:
+            with temporary:
+                temporary.write(content_type.encode() + b"\n" + body)
+            os.replace(temporary.name, self._path(generation, key))
+        except BaseException:
+            os.unlink(temporary.name)
+            raise
+        self._evict(generation)
+
+    def conditional(self, response, key):
+        """
+        Add the validators of a cacheable response.
+        Args:
+            response (Response): The response.
+            key (str): The key of the response, used as its ETag.
+        Returns:
+            Response: The same response.
+        """
+        response.set_etag(key)
+        response.vary.add("Accept")
+        response.headers["Cache-Control"] = self.cache_control()
+        return response
+
+    def cache_control(self):
+        """
+        Returns:
+            str: The Cache-Control header of cacheable responses.
+        """
+        if self.max_age:
+            return f"max-age={self.max_age}"
+        return "no-cache"
+
+    def _path(self, generation, key):
+        return os.path.join(self.directory, f"{generation}.{key}")
+
+    def _evict(self, generation):
+        """
+        Remove the entries of older generations, then the least recently written
+        ones until the directory fits RESPONSE_CACHE_DIR_MAX_BYTES.
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+                if int(entry.name.split(".", 1)[0]) < generation:
+                    os.unlink(entry.path)
+                    continue
+            except (FileNotFoundError, ValueError):
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.directory_max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+response_cache = ResponseCache()
+
+
+def cached(get):
+    """
+    Serve a resource's GET method through the response cache when
+    RESPONSE_CACHE_ENABLED is set. Successful responses get the cache key as
+    their ETag, so a client revalidating with If-None-Match costs a read of the
+    files counter and a comparison. Streamed responses are revalidated the
+    same way but their bodies are not stored.
+    """
+
+    @functools.wraps(get)
+    def wrapper(resource, *args, **kwargs):
+        if not current_app.config.get("RESPONSE_CACHE_ENABLED"):
+            return get(resource, *args, **kwargs)
+        version = TextFileService().get_version()
+        if version is None:
+            return get(resource, *args, **kwargs)
+
+        endpoint = request.url_rule.rule
+        generation = version[1]
+        key = response_cache.key(
+            version,
+            request.path,
+            request.args.items(multi=True),
+            request.headers.get("Accept", ""),
+        )
+        if request.if_none_match.contains_weak(key):
+            RESPONSE_CACHE_REQUESTS.labels(endpoint, "not_modified").inc()
+            return response_cache.conditional(
+                Response(status=HTTPStatus.NOT_MODIFIED), key
+            )
+
+        entry = response_cache.get(generation, key)
+        if entry is not None:
+            RESPONSE_CACHE_REQUESTS.labels(endpoint, "hit").inc()
+            content_type, body = entry
+            return response_cache.conditional(
+                Response(body, content_type=content_type), key
+            )
+
+        RESPONSE_CACHE_REQUESTS.labels(endpoint, "miss").inc()
+        response = get(resource, *args, **kwargs)
+        if response.status_code != HTTPStatus.OK:
+            return response
+        if not response.is_streamed:
+            response_cache.put(
+                generation, key, response.content_type, response.get_data()
+            )
+        return response_cache.conditional(response, key)
+
+    return wrapper
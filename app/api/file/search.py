@@ -0,0 +1,123 @@
+from collections import defaultdict
+
+GRAM_SIZE = 3
+FLUSH_POSTINGS = 500_000
+
+
+def trigrams(data):
+    """
+    List the distinct byte trigrams of a text.
+    Args:
+        data (bytes): UTF-8 encoded text.
+    Returns:
+        set: The trigrams, as bytes.
+    """
+    return {data[i : i + GRAM_SIZE] for i in range(len(data) - GRAM_SIZE + 1)}
+
+
+def encode_postings(lines):
+    """
+    Pack ascending line numbers as varints of the gaps between them.
+    Args:
+        lines (iterable): Line numbers in ascending order.
+    Returns:
+        bytes: The packed postings.
+    """
+    packed = bytearray()
+    previous = 0
+    for line in lines:
+        delta = line - previous
+        previous = line
+        while delta > 0x7F:
+            packed.append(delta & 0x7F | 0x80)
+            delta >>= 7
+        packed.append(delta)
+    return bytes(packed)
+
+
+def decode_postings(data):
+    """
+    Unpack postings written by encode_postings.
+    Args:
+        data (bytes): The packed postings.
+    Returns:
+        list: The line numbers, in ascending order.
+    """
+    lines = []
+    line = value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            line += value
+            lines.append(line)
+            value = shift = 0
+    return lines
+
+
+def intersect_postings(docs, grams):
+    """
+    Find the lines of a file holding every trigram of a query.
+    Args:
+        docs (iterable): The file's documents in the trigram index for the
+            query's trigrams.
+        grams (set): The query's trigrams.
+    Returns:
+        list: The numbers of the lines holding them all, in ascending order.
+    """
+    postings = defaultdict(set)
+    for doc in docs:
+        postings[doc["gram"]].update(decode_postings(doc["lines"]))
+    if len(postings) < len(grams):
+        return []
+    return sorted(set.intersection(*sorted(postings.values(), key=len)))
+
+
+class TrigramIndexer:
+    """
+    Build the postings of a file's lines in the trigram index, mapping every
+    byte trigram to the lines containing it.
+
+    Postings are handed to ``write`` as ``(trigram, packed lines)`` pairs
+    whenever FLUSH_POSTINGS of them have accumulated, and on close, so memory
+    stays bounded however large the file is. A trigram may therefore have
+    several postings per file, each covering a later range of lines.
+    """
+
+    def __init__(self, write, flush_postings=FLUSH_POSTINGS):
+        self.write = write
+        self.flush_postings = flush_postings
+        self._postings = defaultdict(list)
+        self._count = 0
+
+    def add(self, number, raw):
+        """
+        Index the next line.
+        Args:
+            number (int): Zero-based number of the line.
+            raw (bytes): The line's content, without its line break.
+        """
+        grams = trigrams(raw)
+        postings = self._postings
+        for gram in grams:
+            postings[gram].append(number)
+        self._count += len(grams)
+        if self._count >= self.flush_postings:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the postings accumulated so far.
+        """
+        if self._postings:
+            self.write(
+                [
+                    (gram, encode_postings(lines))
+                    for gram, lines in self._postings.items()
+                ]
+            )
+        self._postings = defaultdict(list)
+        self._count = 0
+
+    close = flush
@@ -0,0 +1,188 @@
+import json
+from datetime import date
+from http import HTTPStatus
+
+from flask import Response, request, stream_with_context
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+TEXT_MIMETYPE = "text/plain"
+JSON_MIMETYPE = "application/json"
+XML_MIMETYPE = "application/xml"
+MSGPACK_MIMETYPE = "application/msgpack"
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+# Characters that may not appear in XML 1.0 documents become U+FFFD, and the
+# markup characters are escaped, all in a single str.translate() pass.
+XML_ESCAPES = str.maketrans(
+    {
+        **{code: "\ufffd" for code in range(0x20) if code not in (0x9, 0xA, 0xD)},
+        0xFFFE: "\ufffd",
+        0xFFFF: "\ufffd",
+        ord("&"): "&amp;",
+        ord("<"): "&lt;",
+        ord(">"): "&gt;",
+    }
+)
+
+
+def _default(value):
+    # Dates are written as HTTP dates, as Flask's JSON provider does.
+    if isinstance(value, date):
+        return http_date(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+def dumps_json(data):
+    """
+    Serialize data to JSON, with orjson when the ``serializers`` extra is installed.
+    Returns:
+        bytes: The UTF-8 encoded document.
+    """
+    if orjson is not None:
+        return orjson.dumps(
+            data, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME
+        )
+    return json.dumps(
+        data, default=_default, ensure_ascii=False, separators=(",", ":")
+    ).encode()
+
+
+def dumps_msgpack(data):
+    """
+    Serialize data to MessagePack. Needs the ``serializers`` extra.
+    Returns:
+        bytes: The packed document.
+    """
+    return msgpack.packb(data, default=_default, use_bin_type=True)
+
+
+def escape_xml(text):
+    """
+    Escape text for use as XML character data.
+    Args:
+        text (str): Any text, including control characters.
+    Returns:
+        str: Text that can be embedded between two XML tags.
+    """
+    return text.translate(XML_ESCAPES)
+
+
+def xml_line(line):
+    """
+    Render a line as ``<line><text>...</text></line>``.
+    Args:
+        line (dict): A line with its text.
+    """
+    return f"<line><text>{escape_xml(line['text'])}</text></line>"
+
+
+def xml_lines(lines):
+    """
+    Render lines as ``<lines>`` holding one ``<line>`` element per line.
+    Args:
+        lines (list): Lines with their text.
+    """
+    return "".join(("<lines>", *map(xml_line, lines), "</lines>"))
+
+
+def line_body(line, mimetype):
+    """
+    Render the text of a line in a negotiated format.
+    Args:
+        line (dict): A line with its text.
+        mimetype (str): One of the text, XML, JSON or MessagePack mimetypes.
+    Returns:
+        str or bytes: The response body.
+    """
+    if mimetype == TEXT_MIMETYPE:
+        return line["text"]
+    if mimetype == XML_MIMETYPE:
+        return xml_line(line)
+    return encode({"text": line["text"]}, mimetype)
+
+
+def lines_body(lines, mimetype):
+    """
+    Render the texts of lines in a negotiated format, one per line in plain text.
+    Args:
+        lines (list): Lines with their text.
+        mimetype (str): One of the text, XML, JSON or MessagePack mimetypes.
+    Returns:
+        str or bytes: The response body.
+    """
+    if mimetype == TEXT_MIMETYPE:
+        return "\n".join(line["text"] for line in lines)
+    if mimetype == XML_MIMETYPE:
+        return xml_lines(lines)
+    return encode([{"text": line["text"]} for line in lines], mimetype)
+
+
+def negotiate(offered, default=JSON_MIMETYPE, accept=None):
+    """
+    Pick the response format from the Accept header of the current request,
+    honouring q-values and wildcards. MessagePack is only offered when msgpack
+    is installed.
+    Args:
+        offered (list): Mimetypes the endpoint can produce, in order of preference.
+        default (str): Mimetype to use when the request has no Accept header, or
+            accepts none of the offered mimetypes.
+        accept (MIMEAccept): Parsed Accept header to use instead of the one of
+            the current Flask request.
+    Returns:
+        str: One of offered, or default.
+    """
+    if msgpack is None:
+        offered = [mimetype for mimetype in offered if mimetype != MSGPACK_MIMETYPE]
+    if accept is None:
+        accept = request.accept_mimetypes
+    return accept.best_match(offered, default)
+
+
+def encode(data, mimetype):
+    """
+    Serialize data to MessagePack when that is the mimetype, and to JSON otherwise.
+    Returns:
+        bytes: The serialized document.
+    """
+    if mimetype == MSGPACK_MIMETYPE:
+        return dumps_msgpack(data)
+    return dumps_json(data)
+
+
+def render(data, status=HTTPStatus.OK, mimetype=None):
+    """
+    Build a JSON or MessagePack response, whichever the client prefers.
+    Args:
+        data: Serializable response data.
+        status (int): HTTP status of the response.
+        mimetype (str): Format to use instead of negotiating one.
+    Returns:
+        Response: The serialized response.
+    """
+    mimetype = mimetype or negotiate([JSON_MIMETYPE, MSGPACK_MIMETYPE])
+    return Response(encode(data, mimetype), status=status, mimetype=mimetype)
+
+
+def ndjson_response(items):
+    """
+    Stream items as newline-delimited JSON with chunked transfer encoding, so
+    the response never has to be built in memory.
+    Args:
+        items (iterable): JSON-serializable items, typically a generator.
+    """
+
+    def generate():
+        for item in items:
+            yield dumps_json(item) + b"\n"
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
@@ -1,17 +1,610 @@
 import hashlib
+import heapq
+import itertools
+import io
 import random
-import gridfs
-from io import BytesIO
-from collections import Counter
+from array import array
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 from bson.objectid import ObjectId
+from flask import current_app
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
 from app.db import mongo, fs
+from app.api.file.cache import file_cache
+from app.api.file.compression import (
+    FrameReader,
+    FrameWriter,
+    frame_bounds,
+    get_codec,
+    iter_decompressed,
+    unpack_frames,
+)
+from app.api.file.jobs import ingest_queue
+from app.api.file.letters import LetterIndexer, most_frequent_letter
+from app.api.file.search import TrigramIndexer, intersect_postings, trigrams
+from app.api.file.storage import (
+    READ_SIZE,
+    blocks_spanned,
+    get_storage,
+    slice_blocks,
+)
+from app.api.metrics.instrumentation import timed
 from app.api.file.exceptions import (
     FileAlreadyExistsException,
     FileNotFound,
     NoContentFound,
 )
+from app.api.file.indexes import (
+    OFFSET_SIZE,
+    LineIndexer,
+    decode_line,
+    unpack_offsets,
+)
+
+FILES_BUCKET = "fs"
+OFFSETS_BUCKET = "line_offsets"
+LETTERS_BUCKET = "line_letters"
+CORPUS_LONGEST_LINES_ID = "corpus"
+FILES_COUNTER_ID = "files"
+LATEST_FILE_CACHE_KEY = "latest_file"
+LAYOUT_CACHE_KEY = "layout"
+RANDOM_FILE_ATTEMPTS = 3
+LINE_WINDOW_BATCH = 1000
+LONGEST_LINES_BATCH = 1000
+SEARCH_VERIFY_BATCH = 1000
+SEARCH_FILES_BATCH = 1000
+GRAM_COUNT_LIMIT = 10_000
+DUPLICATE_KEY_ERROR = 11000
+PENDING = "pending"
+LAYOUT_FIELDS = {"codec": 1, "frame_size": 1, "frames": 1}
+OWNER_SORT = [("line_start", -1)]
+UNINDEXED = {"line_count": {"$exists": False}}
+UNSEARCHABLE = {"trigrams": {"$exists": False}}
+
+
+def load_layout(doc):
+    """
+    Describe how a file's content is stored from its metadata.
+    Args:
+        doc (dict): Metadata of the file, with at least its LAYOUT_FIELDS.
+    Returns:
+        tuple: The codec, uncompressed frame size and compressed frame end
+               offsets of a compressed file, or an empty tuple for a file stored
+               as is.
+    """
+    if not doc or not doc.get("codec"):
+        return ()
+    codec = get_codec(doc["codec"], fallback=False)
+    return codec, doc["frame_size"], unpack_frames(doc["frames"])
+
+
+def letter_ranges(doc, line_numbers):
+    """
+    Locate the codes of lines in a file's letters index.
+    Args:
+        doc (dict): Metadata of an indexed file, including its ``letters``.
+        line_numbers (list): Zero-based numbers of the lines.
+    Returns:
+        list: The ``(start, end)`` byte range of each line's code.
+    """
+    size = array(doc["letters"]["typecode"]).itemsize
+    return [(n * size, (n + 1) * size) for n in line_numbers]
+
+
+def decode_letters(doc, line_numbers, entries):
+    """
+    Turn codes read from a file's letters index into letters.
+    Args:
+        doc (dict): Metadata of an indexed file, including its ``letters``.
+        line_numbers (list): Zero-based numbers of the lines.
+        entries (list): The bytes read at each line's letter_ranges.
+    Returns:
+        dict: The most frequent letter of each line, or None for lines without
+              letters, keyed by line number.
+    """
+    typecode = doc["letters"]["typecode"]
+    alphabet = [None] + doc["letters"]["alphabet"]
+    return {
+        number: alphabet[array(typecode, entry)[0]]
+        for number, entry in zip(line_numbers, entries)
+    }
+
+
+def top_lines(doc):
+    """
+    List the lines of a stored top-K list of longest lines.
+    Args:
+        doc (dict or None): A ``longest_lines`` document.
+    Returns:
+        list: The lines, longest first, without their lengths.
+    """
+    if not doc:
+        return []
+    return [
+        {name: value for name, value in line.items() if name != "length"}
+        for line in doc["lines"]
+    ]
+
+
+def sample(population, count, replace):
+    """
+    Draw random members of a population.
+    Args:
+        population (sequence): The members to draw from.
+        count (int): Number of members to draw.
+        replace (bool): Whether a member may be drawn more than once. Without
+            replacement at most len(population) members are drawn.
+    Returns:
+        list: The drawn members.
+    """
+    if replace:
+        return random.choices(population, k=count)
+    return random.sample(population, min(count, len(population)))
+
+
+def sample_unseen(size, count, seen):
+    """
+    Draw distinct numbers below ``size`` that were not drawn before, to replace
+    draws without replacement that were missed.
+    Args:
+        size (int): Numbers are drawn from ``range(size)``.
+        count (int): Number of numbers to draw. At most the number of unseen
+            numbers are drawn.
+        seen (set): The numbers drawn before.
+    Returns:
+        list: The drawn numbers.
+    """
+    count = min(count, size - len(seen))
+    if count <= 0:
+        return []
+    if len(seen) * 2 > size:
+        return random.sample([n for n in range(size) if n not in seen], count)
+    drawn = set()
+    while len(drawn) < count:
+        n = random.randrange(size)
+        if n not in seen:
+            drawn.add(n)
+    return list(drawn)
+
+
+def counter_version(counter):
+    """
+    Get the version of the stored files from the files counter.
+    Args:
+        counter (dict or None): The counter document.
+    Returns:
+        tuple or None: ``(epoch, generation)``, or None before the first upload.
+    """
+    if counter is None:
+        return None
+    return counter.get("epoch"), counter.get("generation")
+
+
+def cached_latest_file(version):
+    """
+    Look up the metadata of the latest file in the worker cache.
+    Args:
+        version (tuple or None): The current version given by counter_version().
+    Returns:
+        dict or None: The metadata cached at this version, or None on a miss.
+    """
+    cached = file_cache.get(LATEST_FILE_CACHE_KEY)
+    if cached and version is not None and cached[0] == version:
+        return dict(cached[1])
+    return None
+
+
+def cache_latest_file(version, doc):
+    """
+    Keep the metadata of the latest file in the worker cache until the version
+    of the stored files changes.
+    Args:
+        version (tuple or None): The version it was looked up at.
+        doc (dict or None): Metadata of the latest file, if there is one.
+    Returns:
+        dict: The metadata.
+    Raises:
+        NoContentFound: If no file has been uploaded yet.
+    """
+    if doc is None:
+        raise NoContentFound("No files have been uploaded yet.")
+    if version is not None:
+        file_cache.put(LATEST_FILE_CACHE_KEY, (version, dict(doc)), size=0)
+    return doc
+
+
+def cached_layout(file_id):
+    """
+    Look up how a file's content is stored in the worker cache.
+    Returns:
+        tuple or None: The layout given by load_layout(), or None on a miss.
+    """
+    return file_cache.get((LAYOUT_CACHE_KEY, file_id))
+
+
+def cache_layout(file_id, doc):
+    """
+    Keep how a file's content is stored in the worker cache.
+    Args:
+        file_id (str): ObjectId of the file.
+        doc (dict): The file's LAYOUT_FIELDS.
+    Returns:
+        tuple: The layout given by load_layout().
+    """
+    layout = load_layout(doc)
+    file_cache.put(
+        (LAYOUT_CACHE_KEY, file_id), layout, size=len(doc["frames"]) if layout else 0
+    )
+    return layout
+
+
+def cached_frames(file_id, ranges, frame_size):
+    """
+    Find the frames of a compressed file spanned by byte ranges of its content.
+    Args:
+        file_id (str): ObjectId of the file.
+        ranges (list): ``(start, end)`` byte ranges of the original content.
+        frame_size (int): Uncompressed size of the file's frames.
+    Returns:
+        tuple: The decompressed frames found in the worker cache, keyed by
+               number, and the numbers of the frames left to read.
+    """
+    frames, missing = {}, []
+    for n in blocks_spanned(ranges, frame_size):
+        data = file_cache.get((FILES_BUCKET, file_id, "frame", n))
+        if data is None:
+            missing.append(n)
+        else:
+            frames[n] = data
+    return frames, missing
+
+
+def decompress_frames(file_id, codec, frames, missing, compressed):
+    """
+    Decompress the frames read for cached_frames() and keep them in the worker
+    cache.
+    Args:
+        file_id (str): ObjectId of the file.
+        codec: The file's codec.
+        frames (dict): Decompressed frames, updated in place.
+        missing (list): Numbers of the frames read.
+        compressed (list): The bytes read for each of them.
+    """
+    with timed("decode"):
+        for n, data in zip(missing, compressed):
+            frames[n] = codec.decompress(data)
+            file_cache.put((FILES_BUCKET, file_id, "frame", n), frames[n])
+
+
+def offset_ranges(line_numbers):
+    """
+    Locate the line-offset index entries bounding lines.
+    Args:
+        line_numbers (list): Zero-based numbers of the lines.
+    Returns:
+        list: The ``(start, end)`` byte range of each line's two entries.
+    """
+    return [(n * OFFSET_SIZE, (n + 2) * OFFSET_SIZE) for n in line_numbers]
+
+
+def line_bounds(entries):
+    """
+    Turn entries read at offset_ranges() into the byte range of each line.
+    """
+    return [tuple(unpack_offsets(entry)) for entry in entries]
+
+
+def decode_lines(line_numbers, raws, errors):
+    """
+    Decode the bytes read at each line's line_bounds().
+    Returns:
+        dict: The text of each line, keyed by line number.
+    """
+    with timed("decode"):
+        return {
+            number: decode_line(raw, errors) for number, raw in zip(line_numbers, raws)
+        }
+
+
+def split_pieces(pieces):
+    """
+    Split a file's content into lines on line feeds, like the line-offset index.
+    A line spanning several pieces is joined once, as LineIndexer does.
+    Args:
+        pieces (iterable): The content, in any number of pieces.
+    Yields:
+        tuple: The number and text of each line.
+    """
+    pending = []
+    number = 0
+    for piece in pieces:
+        raws = piece.split(b"\n")
+        tail = raws.pop()
+        if raws:
+            if pending:
+                pending.append(raws[0])
+                raws[0] = b"".join(pending)
+                pending = []
+            for raw in raws:
+                yield number, decode_line(raw, errors="replace")
+                number += 1
+        if tail:
+            pending.append(tail)
+    if pending:
+        yield number, decode_line(b"".join(pending), errors="replace")
+
+
+def window_batches(start, count, line_count):
+    """
+    Split a window of lines into the LINE_WINDOW_BATCH lines read at a time.
+    Args:
+        start (int): Zero-based number of the first line.
+        count (int): Maximum number of lines in the window.
+        line_count (int): Number of lines of the file.
+    Returns:
+        list: The ``(first, last)`` line numbers of each batch, last excluded.
+    """
+    end = min(start + count, line_count)
+    return [
+        (first, min(first + LINE_WINDOW_BATCH, end))
+        for first in range(start, end, LINE_WINDOW_BATCH)
+    ]
+
+
+def window_range(first, last):
+    """
+    Locate the line-offset index entries bounding a batch of window_batches().
+    """
+    return (first * OFFSET_SIZE, (last + 1) * OFFSET_SIZE)
+
+
+def decode_window(first, offsets, data):
+    """
+    Decode a batch of window_batches().
+    Args:
+        first (int): Zero-based number of the batch's first line.
+        offsets (list): The entries read at the batch's window_range().
+        data (bytes): The content from the first offset to the last.
+    Returns:
+        list: The line number and text of each line of the batch.
+    """
+    with timed("decode"):
+        base = offsets[0]
+        return [
+            {
+                "line": first + i,
+                "text": decode_line(data[offsets[i] - base : offsets[i + 1] - base]),
+            }
+            for i in range(len(offsets) - 1)
+        ]
+
+
+def owner_query(position):
+    """
+    Build the lookup of the file holding a global line number, through the
+    indexed ``line_start`` prefix sums. Its sort is OWNER_SORT.
+    """
+    return {"line_start": {"$lte": position}, "line_count": {"$gt": 0}}
+
+
+def holds(doc, position):
+    """
+    Tell whether a registered file holds a global line number.
+    """
+    return bool(doc) and (
+        doc["line_start"] <= position < doc["line_start"] + doc["line_count"]
+    )
+
+
+class CorpusDraw:
+    """
+    Lines drawn uniformly over every line of every file, as global line numbers
+    resolved to their files by the caller. Positions a lookup misses belong to
+    uploads still being registered and are drawn again, up to
+    RANDOM_FILE_ATTEMPTS times, among the positions not drawn yet when drawing
+    without replacement.
+    """
+
+    def __init__(self, total, count, replace):
+        """
+        Args:
+            total (int): The running line total.
+            count (int): Number of lines to draw.
+            replace (bool): Whether the same line may be drawn more than once.
+        """
+        self.total = total
+        self.replace = replace
+        self.positions = sample(range(total), count, replace)
+        self.drawn = set(self.positions)
+        self.docs, self.numbers, self.missed = {}, defaultdict(list), 0
+
+    def rounds(self):
+        """
+        Yields:
+            list: The sorted positions of each attempt, to be looked up and
+                  passed to assign() in that order.
+        """
+        for _ in range(RANDOM_FILE_ATTEMPTS):
+            self.docs, self.numbers, self.missed = {}, defaultdict(list), 0
+            yield sorted(self.positions)
+            if not self.missed:
+                return
+            if self.replace:
+                self.positions = sample(range(self.total), self.missed, True)
+            else:
+                self.positions = sample_unseen(self.total, self.missed, self.drawn)
+                self.drawn.update(self.positions)
+
+    def assign(self, position, doc):
+        """
+        Record the file a lookup found for a position, or the miss.
+        Args:
+            position (int): The global line number.
+            doc (dict or None): The file found by owner_query(position).
+        """
+        if holds(doc, position):
+            self.docs[doc["file_id"]] = doc
+            self.numbers[doc["file_id"]].append(position - doc["line_start"])
+        else:
+            self.missed += 1
+
+    def picks(self):
+        """
+        Returns:
+            list: Each file of the attempt and the line numbers drawn from it.
+        """
+        return [
+            (self.docs[file_id], numbers) for file_id, numbers in self.numbers.items()
+        ]
+
+    @staticmethod
+    def finish(lines):
+        if not lines:
+            raise NoContentFound("No registered file holds the chosen lines.")
+        random.shuffle(lines)
+        return lines
+
+
+def random_seqs(total, count):
+    """
+    Draw the sequence numbers of random files, uniformly among the ``total``
+    handed out, possibly the same more than once.
+    """
+    return [random.randint(1, total) for _ in range(count)]
+
+
+def spread_sample(docs, count):
+    """
+    Draw files, possibly the same more than once, among those a $sample of up to
+    ``count`` files returned.
+    Args:
+        docs (list): Metadata of the sampled files.
+        count (int): Number of files to draw.
+    Returns:
+        list: Metadata of each drawn file.
+    Raises:
+        NoContentFound: If no file has been uploaded yet.
+    """
+    if not docs:
+        raise NoContentFound("No files have been uploaded yet.")
+    return random.choices(docs, k=count)
+
+
+def count_draws(drawn):
+    """
+    Group files drawn at random, possibly more than once.
+    Args:
+        drawn (list): Metadata of each drawn file.
+    Returns:
+        list: Each distinct file and the number of times it was drawn.
+    """
+    docs = {}
+    picks = Counter()
+    for doc in drawn:
+        docs[doc["file_id"]] = doc
+        picks[doc["file_id"]] += 1
+    return [(docs[file_id], count) for file_id, count in picks.items()]
+
+
+def merge_picks(results):
+    """
+    Merge the lines picked from each file of count_draws(), leaving out the
+    empty ones.
+    Args:
+        results (list): The lines picked from each file, or the exception
+            raised picking them.
+    Returns:
+        list: The picked lines, shuffled.
+    Raises:
+        NoContentFound: If none of the files has lines.
+    """
+    lines = []
+    for result in results:
+        if isinstance(result, NoContentFound):
+            continue
+        if isinstance(result, BaseException):
+            raise result
+        lines += result
+    if not lines:
+        raise NoContentFound("The chosen files are empty.")
+    random.shuffle(lines)
+    return lines
+
+
+def gram_query(gram, file_ids=None):
+    """
+    Build the lookup of a trigram's postings, within some files only if given.
+    """
+    query = {"gram": gram}
+    if file_ids is not None:
+        query["file_id"] = {"$in": file_ids}
+    return query
+
+
+def rarest_first(counts):
+    """
+    Order the trigrams of a query from the one with the fewest postings, as
+    counted up to GRAM_COUNT_LIMIT.
+    Args:
+        counts (dict): The number of postings of each trigram.
+    Returns:
+        list: The trigrams.
+    """
+    return sorted(counts, key=lambda gram: (counts[gram], gram))
+
+
+def postings_queries(grams, file_ids):
+    """
+    Build the lookups of the postings of trigrams in the candidate files, in
+    batches of SEARCH_FILES_BATCH files, each to sort by file_id.
+    Args:
+        grams (set): The query's trigrams.
+        file_ids (list): The files holding them all, in ascending order.
+    Returns:
+        list: The filter and projection of each query.
+    """
+    projection = {"_id": 0, "gram": 1, "file_id": 1, "lines": 1}
+    return [
+        (
+            {
+                "gram": {"$in": list(grams)},
+                "file_id": {"$in": file_ids[start : start + SEARCH_FILES_BATCH]},
+            },
+            projection,
+        )
+        for start in range(0, len(file_ids), SEARCH_FILES_BATCH)
+    ]
+
+
+def verify_batches(candidates):
+    """
+    Split the candidate lines of a file into the batches read back to check them.
+    """
+    return [
+        candidates[start : start + SEARCH_VERIFY_BATCH]
+        for start in range(0, len(candidates), SEARCH_VERIFY_BATCH)
+    ]
+
+
+def matching_lines(file_id, numbers, texts, query):
+    """
+    Keep the candidate lines that hold the searched text.
+    Args:
+        file_id (str): ObjectId of the file.
+        numbers (list): Zero-based numbers of the candidate lines.
+        texts (dict): The text of each candidate line, keyed by line number.
+        query (str): The searched text.
+    Returns:
+        list: The file_id, line number and text of each matching line.
+    """
+    return [
+        {"file_id": file_id, "line": number, "text": texts[number]}
+        for number in numbers
+        if query in texts[number]
+    ]
 
 
 class FileServiceBase:
@@ -41,44 +634,126 @@ class FileServiceBase:
         Returns:
             str or None: The most frequent letter, or None if no letters are found.
         """
-        letters = [char.lower() for char in text if char.isalpha()]
-        if not letters:
-            return None
+        return most_frequent_letter(text)
+
+    def get_most_frequent_letters(self, texts):
+        """
+        Identify the most frequent letter of several texts in one pass. Repeated
+        texts, common when sampling with replacement, are only analyzed once.
+        Args:
+            texts (list): Text contents to analyze.
+        Returns:
+            list: The most frequent letter of each text, or None where no letters
+                  are found.
+        """
+        letters = {}
+        for text in texts:
+            if text not in letters:
+                letters[text] = self.get_most_frequent_letter(text)
+        return [letters[text] for text in texts]
 
-        counter = Counter(letters)
-        letter, _ = counter.most_common(1)[0]
-        return letter
+    def _describe_lines(self, lines):
+        # Lines of files indexed before letters were recorded are analyzed here.
+        missing = [line for line in lines if "most_frequent_letter" not in line]
+        letters = self.get_most_frequent_letters([line["text"] for line in missing])
+        for line, letter in zip(missing, letters):
+            line["most_frequent_letter"] = letter
+        return lines
 
     def process(self, file):
         raise NotImplementedError
 
-    def get_file_lines(self):
+    def process_batch(self, members):
+        raise NotImplementedError
+
+    def process_async(self, file):
+        raise NotImplementedError
+
+    def process_batch_async(self, members):
+        raise NotImplementedError
+
+    def index_file(self, file_id):
+        raise NotImplementedError
+
+    def open_file(self, file_id):
+        raise NotImplementedError
+
+    def get_file_metadata(self, file_id):
+        raise NotImplementedError
+
+    def iter_line_window(self, doc, start, count):
+        raise NotImplementedError
+
+    def get_letter_stats(self, doc):
+        raise NotImplementedError
+
+    def get_file_lines(self, file_id):
+        raise NotImplementedError
+
+    def scan_file_lines(self, file_id):
+        raise NotImplementedError
+
+    def get_line(self, file_id, line_number):
+        raise NotImplementedError
+
+    def get_lines(self, file_id, line_numbers, errors="strict"):
         raise NotImplementedError
 
     def get_random_line(self):
         raise NotImplementedError
 
+    def get_random_lines(self, count, replace):
+        raise NotImplementedError
+
     def get_random_line_backward():
         raise NotImplementedError
 
+    def get_random_lines_backward(self, count, replace):
+        raise NotImplementedError
+
+    def get_random_corpus_line(self):
+        raise NotImplementedError
+
+    def get_random_corpus_lines(self, count, replace):
+        raise NotImplementedError
+
     def get_longest_lines(self, single):
         raise NotImplementedError
 
     def get_longest_lines_single_file(self):
         raise NotImplementedError
 
+    def iter_longest_lines(self, number):
+        raise NotImplementedError
+
+    def iter_longest_lines_single_file(self, number):
+        raise NotImplementedError
+
+    def iter_search(self, query, limit):
+        raise NotImplementedError
+
 
 class TextFileService(FileServiceBase):
     """
-    Service for handling text files stored in MongoDB via GridFS, providing methods for
-    uploading, processing, and retrieving lines from files.
+    Service for handling text files stored in MongoDB via GridFS, or in a local
+    directory with STORAGE_BACKEND=local, providing methods for uploading,
+    processing, and retrieving lines from files.
     """
 
     def __init__(self):
         """
-        Initialize the TextFileService with access to GridFS and MongoDB.
+        Initialize the TextFileService with access to MongoDB and the storage
+        engine selected by STORAGE_BACKEND.
         """
-        self.fs = gridfs.GridFS(mongo.db)
+        self.storage = get_storage(
+            current_app.config["STORAGE_BACKEND"], current_app.config["STORAGE_DIR"]
+        )
+        self.top_k = current_app.config["LONGEST_LINES_TOP_K"]
+        self.chunk_size = current_app.config["UPLOAD_CHUNK_SIZE"]
+        self.codec = get_codec(current_app.config["STORAGE_COMPRESSION"])
+        self.frame_size = current_app.config["COMPRESSION_FRAME_SIZE"]
+        self.batch_workers = current_app.config["BATCH_UPLOAD_WORKERS"]
+        self.search_index = current_app.config["SEARCH_INDEX_ENABLED"]
 
     def get_file_by_id(self, file_id):
         """
@@ -86,132 +761,1264 @@ class TextFileService(FileServiceBase):
         Args:
             file_id (str): ObjectId of the file to retrieve.
         Returns:
-            GridOut: The file retrieved from GridFS.
+            file: A binary stream over the file as stored, e.g. a GridOut.
 
         Raises:
             FileNotFound: If no file is found with the given ID.
         """
-        try:
-            file = self.fs.get(ObjectId(file_id))
-        except FileNotFound:
-            msg = f"No file found with id: {file_id}"
-            raise FileNotFound(msg)
-        return file
+        return self.storage.open(FILES_BUCKET, file_id)
+
+    def open_file(self, file_id):
+        """
+        Open a stored file for reading its original content, decompressing it on
+        the fly when it was stored compressed.
+        Args:
+            file_id (str): ObjectId of the file.
+        Returns:
+            tuple: The file's metadata, a seekable binary stream over its content
+                   and the content's size in bytes.
+        Raises:
+            FileNotFound: If no file is found with the given ID.
+        """
+        doc = mongo.db.files.find_one({"file_id": file_id})
+        if doc is None:
+            raise FileNotFound(f"No file found with id: {file_id}")
+
+        stored = self.get_file_by_id(file_id)
+        layout = self._get_layout(file_id)
+        if layout is None:
+            size = stored.seek(0, io.SEEK_END)
+            stored.seek(0)
+            return doc, stored, size
+        codec, frame_size, ends = layout
+        return (
+            doc,
+            FrameReader(stored, codec, frame_size, ends, doc["size"]),
+            doc["size"],
+        )
+
+    def get_file_metadata(self, file_id):
+        """
+        Retrieve the metadata of a file.
+        Args:
+            file_id (str): ObjectId of the file, or ``latest`` for the most
+                recently uploaded one.
+        Returns:
+            dict: Metadata of the file.
+        Raises:
+            FileNotFound: If no file is found with the given ID.
+        """
+        if file_id == "latest":
+            return self.get_last_file_metadata()
+        doc = mongo.db.files.find_one({"file_id": file_id})
+        if doc is None:
+            raise FileNotFound(f"No file found with id: {file_id}")
+        return doc
+
+    def get_version(self):
+        """
+        Read the version of the stored files: the database's epoch, set when its
+        counter is created, and the upload generation, which changes whenever a
+        file is stored, finishes indexing or is dropped. Generations start over in
+        a dropped and repopulated database, but its epoch is new.
+        Returns:
+            tuple or None: ``(epoch, generation)``, or None before the first upload.
+        """
+        return counter_version(
+            mongo.db.counters.find_one(
+                {"_id": FILES_COUNTER_ID}, {"epoch": 1, "generation": 1}
+            )
+        )
 
     def get_last_file_metadata(self):
         """
-        Retrieve metadata for the most recently uploaded file.
+        Retrieve metadata for the most recently uploaded file. The answer is cached
+        per worker and reused until process() bumps the upload generation.
 
         Returns:
             dict: Metadata of the latest file.
+        Raises:
+            NoContentFound: If no file has been uploaded yet.
         """
-        return mongo.db.files.find().sort("_id", -1).limit(1)[0]
+        version = self.get_version()
+        doc = cached_latest_file(version)
+        if doc is not None:
+            return doc
+        doc = mongo.db.files.find_one(sort=[("_id", -1)])
+        return cache_latest_file(version, doc)
 
-    def get_file_lines(self, file):
+    def get_file_lines(self, file_id):
         """
         Retrieve lines from a file and store them with line numbers.
         Args:
-            file (GridOut): The file to read lines from.
+            file_id (str): ObjectId of the file to read lines from.
         Returns:
             list: A list of dictionaries with line numbers and text content.
         Raises:
             NoContentFound: If the file is empty or cannot be read.
         """
-        file_data = file.read().decode("utf-8")
+        with self.get_file_by_id(file_id) as file:
+            file_data = file.read()
+        with timed("decode"):
+            file_data = self._decompress(file_id, file_data)
+            return self._split_lines(file_data.decode("utf-8"), file_id)
+
+    def scan_file_lines(self, file_id):
+        """
+        Retrieve every line of a file, reading it through a memory map when the
+        storage engine or the local mirror keeps it on disk.
+        Args:
+            file_id (str): ObjectId of the file to read lines from.
+        Returns:
+            list: A list of dictionaries with line numbers and text content.
+        Raises:
+            NoContentFound: If the file is empty or cannot be read.
+        """
+        with self.storage.view(FILES_BUCKET, file_id) as view:
+            if view is not None:
+                with timed("decode"):
+                    file_data = self._decompress(file_id, view)
+                    return self._split_lines(str(file_data, "utf-8"), file_id)
+        return self.get_file_lines(file_id)
+
+    def _split_lines(self, file_data, file_id):
         if not file_data:
             raise NoContentFound(
-                f"File with id {str(file._id)} is empty or could not be read."
+                f"File with id {str(file_id)} is empty or could not be read."
             )
         lines = [
             {"line": i, "text": line} for i, line in enumerate(file_data.splitlines())
         ]
         return lines
 
-    def get_random_line(self):
+    def _get_layout(self, file_id):
         """
-        Retrieve a random line from the most recent file.
+        Look up how a file's content is stored. The answer is cached per worker.
+        Args:
+            file_id (str): ObjectId of the file.
         Returns:
-            dict: A dictionary containing the line text, line number, filename,
-                  and most frequent letter.
+            tuple or None: The codec, uncompressed frame size and compressed frame
+            end offsets of a compressed file, or None for a file stored as is.
         """
-        last_doc = self.get_last_file_metadata()
-        file = self.get_file_by_id(last_doc["file_id"])
-        file_lines = self.get_file_lines(file)
-        line = random.choice(file_lines)
-        line.update(
-            {
-                "file_name": last_doc["filename"],
-                "most_frequent_letter": self.get_most_frequent_letter(line["text"]),
-            }
-        )
-        return line
+        layout = cached_layout(file_id)
+        if layout is None:
+            doc = mongo.db.files.find_one({"file_id": file_id}, LAYOUT_FIELDS)
+            layout = cache_layout(file_id, doc)
+        return layout or None
 
-    def get_longest_lines(self, number):
+    def _iter_content(self, file_id, pieces):
+        layout = self._get_layout(file_id)
+        if layout is None:
+            return pieces
+        codec, _, frames = layout
+        return iter_decompressed(codec, frames, pieces)
+
+    def _decompress(self, file_id, data):
+        if self._get_layout(file_id) is None:
+            return data
+        return b"".join(self._iter_content(file_id, [data]))
+
+    def get_line(self, file_id, line_number):
         """
-        Retrieve the longest lines from all stored files.
+        Read a single line using the line-offset index built at upload time.
+        Only the index entries and the bytes of the requested line are fetched.
         Args:
-            number (int): Number of longest lines to retrieve.
+            file_id (str): ObjectId of the file to read from.
+            line_number (int): Zero-based number of the line to read.
         Returns:
-            list: A list of the longest lines across all files.
+            str: The text of the line.
         """
-        lines = []
-        for file in mongo.db.fs.files.find():
-            lines += self.get_file_lines(file["_id"])
-        lines.sort(key=len, reverse=True)
-        return lines[:number]
+        return self.get_lines(file_id, [line_number])[line_number]
 
-    def get_random_line_backward(self):
+    def get_lines(self, file_id, line_numbers, errors="strict"):
         """
-        Retrieve a random line from a random file and return it reversed.
+        Read several lines of a file using its line-offset index.
+        All index entries are fetched with one range read and all line bytes with
+        another, so GridFS chunks shared by several lines are only transferred once.
+        Args:
+            file_id (str): ObjectId of the file to read from.
+            line_numbers (iterable): Zero-based numbers of the lines to read.
+            errors (str): How to handle bytes that are not valid UTF-8.
         Returns:
-            str: A reversed string of the randomly selected line.
+            dict: The text of each requested line, keyed by line number.
         """
-        files_count = mongo.db.files.estimated_document_count()
-        idx = random.randint(0, files_count - 1)
-        file = self.fs.find().skip(idx).next()
-        lines = self.get_file_lines(file)
-        line = random.choice(lines)
-        text = line["text"]
-        return text[::-1]
+        numbers = sorted(set(line_numbers))
+        entries = self.storage.read_ranges(
+            OFFSETS_BUCKET, file_id, offset_ranges(numbers)
+        )
+        raws = self._read_content_ranges(file_id, line_bounds(entries))
+        return decode_lines(numbers, raws, errors)
 
-    def get_longest_lines_single_file(self, number):
+    def iter_line_window(self, doc, start, count):
         """
-        Retrieve the longest lines from the most recent file.
+        Read a contiguous window of lines. Lines are read LINE_WINDOW_BATCH at a
+        time, each batch with one read of its line-offset index entries and one
+        of the bytes its lines span, so memory stays bounded for any window.
+        Files not indexed yet are read up to the end of the window, split on line
+        feeds like the line-offset index so their lines keep the same numbers.
+        Args:
+            doc (dict): Metadata of the file to read from.
+            start (int): Zero-based number of the first line.
+            count (int): Maximum number of lines to read.
+        Yields:
+            dict: The line number and text of each line in the window.
+        """
+        file_id = doc["file_id"]
+        line_count = doc.get("line_count")
+        if line_count is None:
+            for number, text in itertools.islice(
+                self._iter_lines(file_id), start, start + count
+            ):
+                yield {"line": number, "text": text}
+            return
+
+        for first, last in window_batches(start, count, line_count):
+            yield from self._read_window(file_id, first, last)
+
+    def _read_window(self, file_id, first, last):
+        (entries,) = self.storage.read_ranges(
+            OFFSETS_BUCKET, file_id, [window_range(first, last)]
+        )
+        offsets = unpack_offsets(entries)
+        (data,) = self._read_content_ranges(file_id, [(offsets[0], offsets[-1])])
+        return decode_window(first, offsets, data)
+
+    def _read_content_ranges(self, file_id, ranges):
+        """
+        Read byte ranges of a file's original content. Ranges of a compressed file
+        are served from the frames they span: only those frames are read and
+        decompressed, and decompressed frames are kept in the worker cache.
+        Args:
+            file_id (str): ObjectId of the file.
+            ranges (list): ``(start, end)`` byte ranges of the original content.
+        Returns:
+            list: The bytes of each range, in the order requested.
+        Raises:
+            FileNotFound: If a needed chunk does not exist.
+        """
+        layout = self._get_layout(file_id)
+        if layout is None:
+            return self.storage.read_ranges(FILES_BUCKET, file_id, ranges)
+
+        codec, size, ends = layout
+        frames, missing = cached_frames(file_id, ranges, size)
+        if missing:
+            compressed = self.storage.read_ranges(
+                FILES_BUCKET, file_id, [frame_bounds(ends, n) for n in missing]
+            )
+            decompress_frames(file_id, codec, frames, missing, compressed)
+        return slice_blocks(frames, ranges, size)
+
+    def get_random_line(self):
+        """
+        Retrieve a random line from the most recent file.
+        Returns:
+            dict: A dictionary containing the line text, line number, filename,
+                  and most frequent letter.
+        Raises:
+            NoContentFound: If the latest file has no lines.
+        """
+        return self.get_random_lines(1)[0]
+
+    def get_random_lines(self, count, replace=True):
+        """
+        Retrieve several random lines from the most recent file with a single
+        metadata lookup and batched reads.
+        Args:
+            count (int): Number of lines to sample.
+            replace (bool): Whether the same line may be sampled more than once.
+                Without replacement at most one sample per line is returned.
+        Returns:
+            list: Dictionaries containing the line text, line number, filename,
+                  and most frequent letter.
+        Raises:
+            NoContentFound: If the latest file has no lines.
+        """
+        last_doc = self.get_last_file_metadata()
+        lines = self._pick_random_lines(last_doc, count, replace)
+        return self._describe_lines(lines)
+
+    def get_random_corpus_line(self):
+        """
+        Retrieve a line chosen uniformly over every line of every file.
+        Returns:
+            dict: A dictionary containing the line text, line number, filename,
+                  and most frequent letter.
+        Raises:
+            NoContentFound: If no lines have been uploaded yet.
+        """
+        return self.get_random_corpus_lines(1)[0]
+
+    def get_random_corpus_lines(self, count, replace=True):
+        """
+        Retrieve lines chosen uniformly over every line of every file.
+        Global line numbers are drawn from the running line total and resolved to
+        their files through the indexed ``line_start`` prefix sums, so only the
+        owning files' lines are read. Until a file is indexed, such as while every
+        upload waits for the ingest workers, lines are picked from random files
+        instead, which are scanned in full.
+        Args:
+            count (int): Number of lines to sample.
+            replace (bool): Whether the same line may be sampled more than once.
+        Returns:
+            list: Dictionaries containing the line text, line number, filename,
+                  and most frequent letter.
+        Raises:
+            NoContentFound: If no lines have been uploaded yet.
+        """
+        counter = mongo.db.counters.find_one({"_id": FILES_COUNTER_ID})
+        if not counter or not counter.get("lines"):
+            lines = self._pick_from_files(self._sample_files(count), replace)
+            return self._describe_lines(lines)
+
+        lines = []
+        draw = CorpusDraw(counter["lines"], count, replace)
+        for positions in draw.rounds():
+            doc = None
+            for position in positions:
+                if not holds(doc, position):
+                    doc = mongo.db.files.find_one(
+                        owner_query(position), sort=OWNER_SORT
+                    )
+                draw.assign(position, doc)
+            for doc, numbers in draw.picks():
+                lines += self._read_lines(doc, numbers)
+        return self._describe_lines(draw.finish(lines))
+
+    def _pick_random_lines(self, doc, count, replace):
+        """
+        Pick random lines of a file, reading only those lines when it is indexed.
+        Args:
+            doc (dict): Metadata of the file to pick from.
+            count (int): Number of lines to pick.
+            replace (bool): Whether the same line may be picked more than once.
+        Returns:
+            list: Dictionaries with the line number, text and filename.
+        Raises:
+            NoContentFound: If the file has no lines.
+        """
+        line_count = doc.get("line_count")
+        if line_count is None:
+            return self._scan_random_lines(doc, count, replace)
+        if not line_count:
+            raise NoContentFound(f"File with id {doc['file_id']} is empty.")
+
+        numbers = sample(range(line_count), count, replace)
+        return self._read_lines(doc, numbers)
+
+    def _scan_random_lines(self, doc, count, replace):
+        """
+        Pick random lines of a file that is not indexed yet, reading it twice:
+        once to count its lines and once to keep the picked ones. Lines are
+        split on line feeds like the line-offset index, so they keep their
+        numbers once it is built.
+        """
+        file_id = doc["file_id"]
+        line_count = sum(1 for _ in self._iter_lines(file_id))
+        if not line_count:
+            raise NoContentFound(f"File with id {file_id} is empty.")
+
+        numbers = sample(range(line_count), count, replace)
+        wanted, texts = set(numbers), {}
+        for number, text in self._iter_lines(file_id):
+            if len(texts) == len(wanted):
+                break
+            if number in wanted:
+                texts[number] = text
+        return [
+            {"line": number, "text": texts[number], "file_name": doc["filename"]}
+            for number in numbers
+        ]
+
+    def _read_lines(self, doc, numbers):
+        texts = self.get_lines(doc["file_id"], numbers)
+        lines = [
+            {"line": number, "text": texts[number], "file_name": doc["filename"]}
+            for number in numbers
+        ]
+        if "letters" in doc:
+            letters = self.get_line_letters(doc, numbers)
+            for line in lines:
+                line["most_frequent_letter"] = letters[line["line"]]
+        return lines
+
+    def get_line_letters(self, doc, line_numbers):
+        """
+        Look up the most frequent letter of lines, as recorded when the file was
+        indexed. Each line's letter is a fixed-size code in the file's letters
+        index, read like the line-offset index.
+        Args:
+            doc (dict): Metadata of an indexed file, including its ``letters``.
+            line_numbers (iterable): Zero-based numbers of the lines.
+        Returns:
+            dict: The most frequent letter of each line, or None for lines
+                  without letters, keyed by line number.
+        """
+        numbers = sorted(set(line_numbers))
+        entries = self.storage.read_ranges(
+            LETTERS_BUCKET, doc["file_id"], letter_ranges(doc, numbers)
+        )
+        return decode_letters(doc, numbers, entries)
+
+    def get_letter_stats(self, doc):
+        """
+        Retrieve the letter frequencies of a file: the count of each letter, the
+        number of lines each letter is the most frequent of, and the number of
+        lines without letters. They are computed when the file is indexed; files
+        indexed before that are scanned instead.
+        Args:
+            doc (dict): Metadata of the file.
+        Returns:
+            dict: The file's id and letter frequencies.
+        """
+        stats = mongo.db.letter_stats.find_one({"_id": doc["file_id"]}, {"_id": 0})
+        if stats is None:
+            indexer = LetterIndexer()
+            for _, text in self._iter_lines(doc["file_id"]):
+                indexer.add(text)
+            stats = indexer.stats()
+        return dict(file_id=doc["file_id"], **stats)
+
+    def get_random_file_metadata(self):
+        """
+        Pick the metadata of a random file with a single indexed lookup on the
+        sequence number assigned at upload, or with a $sample while no file has
+        one yet.
+        Returns:
+            dict: Metadata of the chosen file.
+        Raises:
+            NoContentFound: If no file has been uploaded yet.
+        """
+        counter = mongo.db.counters.find_one({"_id": FILES_COUNTER_ID})
+        if not counter or not counter.get("seq"):
+            return self._sample_files(1)[0]
+
+        for _ in range(RANDOM_FILE_ATTEMPTS):
+            doc = mongo.db.files.find_one({"seq": random.randint(1, counter["seq"])})
+            if doc:
+                return doc
+
+        # The drawn numbers belong to uploads still being registered.
+        return self._sample_files(1)[0]
+
+    def _sample_files(self, count):
+        """
+        Draw random files with a $sample over every stored file, for when the
+        sequence numbers cannot be used, e.g. while every upload is pending.
+        Args:
+            count (int): Number of files to draw, possibly the same more than once.
+        Returns:
+            list: Metadata of each drawn file.
+        Raises:
+            NoContentFound: If no file has been uploaded yet.
+        """
+        docs = list(mongo.db.files.aggregate([{"$sample": {"size": count}}]))
+        return spread_sample(docs, count)
+
+    def get_longest_lines(self, number):
+        """
+        Retrieve the longest lines from all stored files.
+        Args:
+            number (int): Number of longest lines to retrieve.
+        Returns:
+            list: A list of the longest lines across all files.
+        """
+        return list(self.iter_longest_lines(number))
+
+    def iter_longest_lines(self, number):
+        """
+        Yield the longest lines from all stored files, longest first.
+        The corpus-wide top-K list maintained by process() answers any request up
+        to LONGEST_LINES_TOP_K lines, merged with the lines of files not indexed
+        yet, which it leaves out. For larger requests, when every file is indexed,
+        that list is still yielded first, before the remaining lines are selected,
+        so the response can start straight away.
+        Args:
+            number (int): Number of longest lines to retrieve.
+        Yields:
+            dict: The line number, text and file_id of each line.
+        """
+        top = self._get_top_lines(CORPUS_LONGEST_LINES_ID, min(number, self.top_k))
+        indexed = not mongo.db.files.find_one(UNINDEXED, {"_id": 1})
+        if number <= self.top_k:
+            if not indexed:
+                top = heapq.merge(
+                    top,
+                    self._select_longest_lines(number, UNINDEXED),
+                    key=lambda line: (
+                        -len(line["text"]),
+                        line["file_id"],
+                        line["line"],
+                    ),
+                )
+            yield from itertools.islice(top, number)
+            return
+
+        sent = set()
+        if indexed:
+            yield from top
+            sent = {(line["file_id"], line["line"]) for line in top}
+
+        remaining = number - len(sent)
+        for line in self._select_longest_lines(number, {}):
+            if not remaining:
+                break
+            if (line["file_id"], line["line"]) not in sent:
+                remaining -= 1
+                yield line
+
+    def _select_longest_lines(self, number, query):
+        """
+        Select the longest lines of the files matching a query with a heap bounded
+        to ``number`` entries, so memory depends on the result size only. Each
+        file's stored top-K list is used first. A file is then only scanned if it
+        holds more lines than its list and the list's shortest line could still
+        make the selection, or if it is not indexed yet.
+        Args:
+            number (int): Number of longest lines to select.
+            query (dict): Filter on the files' metadata.
+        Returns:
+            list: The selected lines, longest first, then by file_id and line.
+        """
+        heap = []
+
+        def push(file_id, line, text):
+            entry = (len(text), -int(file_id, 16), -line, file_id, text)
+            if len(heap) < number:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+
+        partial = []
+        cursor = mongo.db.files.find(query, {"file_id": 1, "line_count": 1})
+        for batch in iter(
+            lambda: list(itertools.islice(cursor, LONGEST_LINES_BATCH)), []
+        ):
+            stored = {
+                doc["_id"]: doc["lines"]
+                for doc in mongo.db.longest_lines.find(
+                    {"_id": {"$in": [doc["file_id"] for doc in batch]}}
+                )
+            }
+            for doc in batch:
+                lines = stored.get(doc["file_id"])
+                if lines is None or "line_count" not in doc:
+                    partial.append((doc["file_id"], None))
+                    continue
+                for line in lines:
+                    push(doc["file_id"], line["line"], line["text"])
+                if doc["line_count"] > len(lines):
+                    partial.append((doc["file_id"], lines[-1]["length"]))
+
+        for file_id, shortest in partial:
+            if shortest is not None and len(heap) == number and heap[0][0] > shortest:
+                continue
+            listed = set()
+            if shortest is not None:
+                doc = mongo.db.longest_lines.find_one({"_id": file_id})
+                listed = {line["line"] for line in doc["lines"]}
+            for line, text in self._iter_lines(file_id):
+                if line not in listed:
+                    push(file_id, line, text)
+
+        return [
+            {"line": -line, "text": text, "file_id": file_id}
+            for _, _, line, file_id, text in sorted(heap, reverse=True)
+        ]
+
+    def _iter_lines(self, file_id):
+        """
+        Read every line of a file piece by piece, numbered like the line-offset
+        index, without holding the whole file in memory. Files the storage engine
+        or the local mirror keeps on disk are read through a memory map.
+        Args:
+            file_id (str): ObjectId of the file.
+        Yields:
+            tuple: The number and text of each line.
+        """
+        with self.storage.view(FILES_BUCKET, file_id) as view:
+            if view is not None:
+                pieces = (
+                    bytes(view[start : start + READ_SIZE])
+                    for start in range(0, len(view), READ_SIZE)
+                )
+                yield from split_pieces(self._iter_content(file_id, pieces))
+                return
+        yield from split_pieces(
+            self._iter_content(file_id, self.storage.iter(FILES_BUCKET, file_id))
+        )
+
+    def iter_search(self, query, limit):
+        """
+        Find the lines containing a text, across the files in the trigram index.
+        The postings of the query's trigrams are read file by file and
+        intersected, and only the candidate lines left are read back to check
+        they hold the text, so the cost follows the number of matches rather than
+        the size of the corpus. Files not in the index, such as those waiting for
+        the ingest workers or stored with SEARCH_INDEX_ENABLED off, are then
+        scanned in full.
+        Args:
+            query (str): Text to look for, at least three bytes long in UTF-8.
+            limit (int): Maximum number of lines to return.
+        Returns:
+            iterator: The file_id, line number and text of each matching line, in
+                      upload order and then line order.
+        Raises:
+            ValueError: If the query is too short to be looked up.
+        """
+        grams = trigrams(query.encode("utf-8"))
+        if not grams:
+            raise ValueError("q must be at least 3 bytes long in UTF-8")
+        return self._search(query, grams, limit)
+
+    def _search(self, query, grams, limit):
+        if not limit:
+            return
+        for file_id, docs in self._iter_postings(grams):
+            for numbers in verify_batches(intersect_postings(docs, grams)):
+                texts = self.get_lines(file_id, numbers, errors="replace")
+                for match in matching_lines(file_id, numbers, texts, query):
+                    yield match
+                    limit -= 1
+                    if not limit:
+                        return
+
+        # Also every file when SEARCH_INDEX_ENABLED is off.
+        for doc in mongo.db.files.find(UNSEARCHABLE, {"file_id": 1}).sort("_id", 1):
+            for match in self._scan_for(doc["file_id"], query, limit):
+                yield match
+                limit -= 1
+            if not limit:
+                return
+
+    def _iter_postings(self, grams):
+        """
+        Read the postings of a query's trigrams file by file, only in the files
+        holding them all. These are found from the rarest trigram, so the
+        postings of common trigrams are never read across the whole corpus.
+        Args:
+            grams (set): The query's trigrams.
+        Yields:
+            tuple: The file_id and its postings for the trigrams, by file_id.
+        """
+        counts = {
+            gram: mongo.db.trigrams.count_documents(
+                {"gram": gram}, limit=GRAM_COUNT_LIMIT
+            )
+            for gram in grams
+        }
+        file_ids = None
+        for gram in rarest_first(counts):
+            file_ids = mongo.db.trigrams.distinct("file_id", gram_query(gram, file_ids))
+            if not file_ids:
+                return
+        for query in postings_queries(grams, sorted(file_ids)):
+            cursor = mongo.db.trigrams.find(*query).sort("file_id", 1)
+            yield from itertools.groupby(cursor, key=lambda doc: doc["file_id"])
+
+    def _scan_for(self, file_id, query, limit):
+        """
+        Scan a file that is not in the trigram index for the lines holding a text.
+        Args:
+            file_id (str): ObjectId of the file.
+            query (str): Text to look for.
+            limit (int): Maximum number of lines to return.
+        Returns:
+            list: The file_id, line number and text of each matching line.
+        """
+        matches = (
+            {"file_id": file_id, "line": number, "text": text}
+            for number, text in self._iter_lines(file_id)
+            if query in text
+        )
+        return list(itertools.islice(matches, limit))
+
+    def get_random_line_backward(self):
+        """
+        Retrieve a random line from a random file and return it reversed.
+        Returns:
+            str: A reversed string of the randomly selected line.
+        """
+        return self.get_random_lines_backward(1)[0]
+
+    def get_random_lines_backward(self, count, replace=True):
+        """
+        Retrieve several reversed lines, each from a randomly chosen file. All
+        files are fetched with one query and each file's lines with batched reads.
+        Args:
+            count (int): Number of lines to sample.
+            replace (bool): Whether the same line of a file may be sampled more
+                than once.
+        Returns:
+            list: The reversed text of each sampled line.
+        Raises:
+            NoContentFound: If none of the chosen files has lines.
+        """
+        lines = self._pick_from_files(self._draw_random_files(count), replace)
+        return [line["text"][::-1] for line in lines]
+
+    def _pick_from_files(self, drawn, replace):
+        """
+        Pick one random line of each drawn file, reading each file once.
+        Args:
+            drawn (list): Metadata of each drawn file, possibly repeated.
+            replace (bool): Whether the same line of a file may be picked more
+                than once.
+        Returns:
+            list: The picked lines, shuffled.
+        Raises:
+            NoContentFound: If none of the drawn files has lines.
+        """
+        results = []
+        for doc, count in count_draws(drawn):
+            try:
+                results.append(self._pick_random_lines(doc, count, replace))
+            except NoContentFound as err:
+                results.append(err)
+        return merge_picks(results)
+
+    def _draw_random_files(self, count):
+        counter = mongo.db.counters.find_one({"_id": FILES_COUNTER_ID})
+        if not counter or not counter.get("seq"):
+            return self._sample_files(count)
+
+        seqs = random_seqs(counter["seq"], count)
+        docs = {
+            doc["seq"]: doc
+            for doc in mongo.db.files.find({"seq": {"$in": list(set(seqs))}})
+        }
+        return [docs.get(seq) or self.get_random_file_metadata() for seq in seqs]
+
+    def get_longest_lines_single_file(self, number):
+        """
+        Retrieve the longest lines from the most recent file.
         Args:
             number (int): Number of longest lines to retrieve.
         Returns:
             list: A list of the longest lines in the latest file.
         """
-        file = mongo.db.fs.files.find().sort("uploadDate", -1).limit(1)[0]
-        lines = self.get_file_lines(file["_id"])
-        lines.sort(key=len, reverse=True)
-        return lines[:number]
+        return list(self.iter_longest_lines_single_file(number))
+
+    def iter_longest_lines_single_file(self, number):
+        """
+        Yield the longest lines from the most recent file, longest first.
+        Args:
+            number (int): Number of longest lines to retrieve.
+        Yields:
+            dict: The line number and text of each line.
+        """
+        last_doc = self.get_last_file_metadata()
+        if number <= self.top_k and "line_count" in last_doc:
+            yield from self._get_top_lines(last_doc["file_id"], number)
+            return
+
+        for line in self._select_longest_lines(number, {"_id": last_doc["_id"]}):
+            yield {"line": line["line"], "text": line["text"]}
+
+    def _get_top_lines(self, key, number):
+        doc = mongo.db.longest_lines.find_one(
+            {"_id": key}, {"lines": {"$slice": number}}
+        )
+        return top_lines(doc)
+
+    def _register_sequences(self, entries):
+        """
+        Give newly stored files the next dense sequence numbers, which is what
+        get_random_file_metadata draws from, and the number of lines stored before
+        each, which is what get_random_corpus_line bisects on. A batch takes one
+        contiguous range from a single atomic counter update, handed out only once
+        the uploads are known not to be duplicates, so the numbers stay gapless.
+        The same update bumps the generation that invalidates cached "latest file"
+        lookups and cached responses, so it must come after everything else about
+        the new files is stored.
+        Args:
+            entries (list): ``(doc_id, line_count)`` of each new file's metadata
+                document, in upload order.
+        """
+        total = sum(line_count for _, line_count in entries)
+        counter = mongo.db.counters.find_one_and_update(
+            {"_id": FILES_COUNTER_ID},
+            {
+                "$inc": {"seq": len(entries), "lines": total, "generation": 1},
+                "$setOnInsert": {"epoch": ObjectId()},
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        seq = counter["seq"] - len(entries)
+        line_start = counter["lines"] - total
+        requests = []
+        for doc_id, line_count in entries:
+            seq += 1
+            requests.append(
+                UpdateOne(
+                    {"_id": doc_id}, {"$set": {"seq": seq, "line_start": line_start}}
+                )
+            )
+            line_start += line_count
+        mongo.db.files.bulk_write(requests, ordered=False)
+
+    def _merge_longest_lines(self, longest):
+        """
+        Store the top-K longest lines of new files and fold them into the
+        corpus-wide list. The merge runs server side as a bounded, sorted $push,
+        so concurrent uploads never overwrite each other.
+        Args:
+            longest (dict): Each new file's longest lines, longest first, keyed
+                by the file's ObjectId.
+        """
+        mongo.db.longest_lines.insert_many(
+            [{"_id": file_id, "lines": lines} for file_id, lines in longest.items()]
+        )
+        mongo.db.longest_lines.update_one(
+            {"_id": CORPUS_LONGEST_LINES_ID},
+            {
+                "$push": {
+                    "lines": {
+                        "$each": [
+                            dict(line, file_id=file_id)
+                            for file_id, lines in longest.items()
+                            for line in lines
+                        ],
+                        "$sort": {"length": -1, "file_id": 1, "line": 1},
+                        "$slice": self.top_k,
+                    }
+                }
+            },
+            upsert=True,
+        )
+
+    def _hash_stream(self, stream):
+        md5 = hashlib.md5()
+        for chunk in iter(lambda: stream.read(self.chunk_size), b""):
+            md5.update(chunk)
+        return md5.hexdigest()
+
+    def _store(self, filename, stream):
+        """
+        Stream a file into storage in UPLOAD_CHUNK_SIZE pieces while its hash, its
+        line-offset index and its longest lines are computed in the same pass, so
+        memory does not grow with the file size.
+        Args:
+            filename (str): Name to store the file under.
+            stream (file): Binary stream of the file's content.
+        Returns:
+            tuple: The file's metadata, its longest lines and its storage layout,
+                   which includes the layout of its letters index.
+        """
+        md5 = hashlib.md5()
+        file_id = str(ObjectId())
+        indexer = self._new_line_indexer(file_id)
+        stored = self.storage.create(FILES_BUCKET, file_id, filename=filename)
+        offsets = self.storage.create(OFFSETS_BUCKET, file_id)
+        frames = self._new_frame_writer(stored)
+        write = frames.feed if frames else stored.write
+
+        try:
+            for chunk in iter(lambda: stream.read(self.chunk_size), b""):
+                md5.update(chunk)
+                indexer.feed(chunk)
+                write(chunk)
+                offsets.write(indexer.pop_offsets())
+            indexer.close()
+            offsets.write(indexer.pop_offsets())
+            if frames:
+                frames.close()
+        except BaseException:
+            stored.abort()
+            offsets.abort()
+            # Postings already flushed would lead searches to a missing file.
+            mongo.db.trigrams.delete_many({"file_id": file_id})
+            raise
+        stored.close()
+        offsets.close()
+        try:
+            self._close_trigrams(indexer)
+            self._store_letters(file_id, indexer.letters)
+        except BaseException:
+            self._discard(file_id)
+            raise
+
+        metadata = {
+            "filename": filename,
+            "hash": md5.hexdigest(),
+            "file_id": file_id,
+            "line_count": indexer.line_count,
+        }
+        layout = dict(frames.layout() if frames else {})
+        layout["letters"] = indexer.letters.layout()
+        if self.search_index:
+            layout["trigrams"] = True
+        return metadata, indexer.longest(), layout
+
+    def _new_line_indexer(self, file_id):
+        """
+        Build the indexer of a file's lines, which also records their letters and,
+        when SEARCH_INDEX_ENABLED is set, writes their postings to the trigram
+        index.
+        Args:
+            file_id (str): ObjectId of the file.
+        Returns:
+            LineIndexer: The indexer, to pass to _close_trigrams once fed.
+        """
+        trigrams = None
+        if self.search_index:
+            trigrams = TrigramIndexer(
+                lambda postings: self._store_trigrams(file_id, postings)
+            )
+        return LineIndexer(top_k=self.top_k, letters=True, trigrams=trigrams)
+
+    def _close_trigrams(self, indexer):
+        if indexer.trigrams is not None:
+            indexer.trigrams.close()
+
+    def _store_trigrams(self, file_id, postings):
+        """
+        Save postings of a file in the trigram index.
+        Args:
+            file_id (str): ObjectId of the file.
+            postings (list): ``(trigram, packed line numbers)`` pairs.
+        """
+        mongo.db.trigrams.insert_many(
+            [
+                {"gram": gram, "file_id": file_id, "lines": lines}
+                for gram, lines in postings
+            ],
+            ordered=False,
+        )
+
+    def _store_letters(self, file_id, letters):
+        """
+        Save the per-line letter codes and letter frequencies of a file.
+        Args:
+            file_id (str): ObjectId of the file.
+            letters (LetterIndexer): The indexer the file's lines were fed to.
+        """
+        self.storage.delete(LETTERS_BUCKET, file_id)
+        self.storage.put(LETTERS_BUCKET, file_id, letters.codes.tobytes())
+        mongo.db.letter_stats.replace_one(
+            {"_id": file_id}, letters.stats(), upsert=True
+        )
+
+    def _store_blob(self, filename, stream):
+        """
+        Stream a file into storage, hashing it on the way, without indexing it.
+        Args:
+            filename (str): Name to store the file under.
+            stream (file): Binary stream of the file's content.
+        Returns:
+            tuple: The file's metadata, without line_count, and its storage layout.
+        """
+        md5 = hashlib.md5()
+        file_id = str(ObjectId())
+        stored = self.storage.create(FILES_BUCKET, file_id, filename=filename)
+        frames = self._new_frame_writer(stored)
+        write = frames.feed if frames else stored.write
+        try:
+            for chunk in iter(lambda: stream.read(self.chunk_size), b""):
+                md5.update(chunk)
+                write(chunk)
+            if frames:
+                frames.close()
+        except BaseException:
+            stored.abort()
+            raise
+        stored.close()
+
+        metadata = {
+            "filename": filename,
+            "hash": md5.hexdigest(),
+            "file_id": file_id,
+        }
+        return metadata, frames.layout() if frames else {}
+
+    def _new_frame_writer(self, stored):
+        """
+        Compress what is written to a new stored file when STORAGE_COMPRESSION is
+        set. The returned writer's layout() is saved with the file's metadata.
+        Args:
+            stored: The writer of the new file.
+        Returns:
+            FrameWriter or None: None when files are stored uncompressed.
+        """
+        if self.codec is None:
+            return None
+        return FrameWriter(self.codec, self.frame_size, stored.write)
+
+    def _discard(self, file_id):
+        for bucket in (FILES_BUCKET, OFFSETS_BUCKET, LETTERS_BUCKET):
+            self.storage.delete(bucket, file_id)
+        mongo.db.letter_stats.delete_one({"_id": file_id})
+        mongo.db.trigrams.delete_many({"file_id": file_id})
 
     def process(self, file):
         """
         Process a file by calculating its hash and saving it if it does not already exist.
+        The upload is stored and indexed in a single streaming pass. Duplicates are
+        rejected by the unique index on ``hash`` when the metadata is inserted,
+        which also covers concurrent uploads, and their stored chunks are discarded.
         Args:
             file (FileStorage): The file to be processed and stored.
         Returns:
-            dict: Metadata of the stored file, including filename, hash, and file_id.
+            dict: Metadata of the stored file, including filename, hash, file_id
+                  and line_count.
         Raises:
             FileAlreadyExistsException: If a file with the same hash already exists.
         """
+        metadata, longest, layout = self._store(file.filename, file.stream)
+
+        try:
+            result = mongo.db.files.insert_one(dict(metadata, **layout))
+        except DuplicateKeyError:
+            self._discard(metadata["file_id"])
+            raise FileAlreadyExistsException()
+        self._merge_longest_lines({metadata["file_id"]: longest})
+        self._register_sequences([(result.inserted_id, metadata["line_count"])])
+
+        return metadata
+
+    def process_batch(self, members):
+        """
+        Process many files at once. Members are hashed in a thread pool and checked
+        against the stored hashes with a single query; only new, distinct members
+        are then stored and indexed, again in parallel. Their metadata is written
+        with one unordered insert_many, so a member uploaded concurrently by
+        another request is reported as a duplicate without failing the rest.
+        Args:
+            members (list): ``(filename, open)`` pairs, where ``open()`` returns a
+                binary stream over the member's content, rewound to its start.
+        Returns:
+            list: The status of each member, in order: its filename, hash and
+                  either ``created`` with its file_id and line_count, or
+                  ``duplicate``.
+        """
+        results = []
+        with ThreadPoolExecutor(self.batch_workers) as pool:
+            hashes = list(
+                pool.map(lambda member: self._hash_stream(member[1]()), members)
+            )
+            existing = {
+                doc["hash"]
+                for doc in mongo.db.files.find(
+                    {"hash": {"$in": list(set(hashes))}}, {"hash": 1}
+                )
+            }
+
+            new = {}
+            for index, ((filename, _), digest) in enumerate(zip(members, hashes)):
+                results.append({"filename": filename, "hash": digest})
+                if digest in existing or digest in new:
+                    results[index]["status"] = "duplicate"
+                else:
+                    new[digest] = index
+
+            stored = dict(
+                zip(
+                    new.values(),
+                    pool.map(
+                        lambda index: self._store(
+                            members[index][0], members[index][1]()
+                        ),
+                        new.values(),
+                    ),
+                )
+            )
+
+        if not stored:
+            return results
+
+        docs = [
+            dict(metadata, _id=ObjectId(), **layout)
+            for metadata, _, layout in stored.values()
+        ]
+        rejected = set()
+        try:
+            mongo.db.files.insert_many(docs, ordered=False)
+        except BulkWriteError as err:
+            for error in err.details["writeErrors"]:
+                if error["code"] != DUPLICATE_KEY_ERROR:
+                    raise
+                rejected.add(error["index"])
+
+        created, longest = [], {}
+        for position, (index, (metadata, lines, _)) in enumerate(stored.items()):
+            if position in rejected:
+                self._discard(metadata["file_id"])
+                results[index]["status"] = "duplicate"
+                continue
+            results[index] = dict(metadata, status="created")
+            created.append((docs[position]["_id"], metadata["line_count"]))
+            longest[metadata["file_id"]] = lines
 
-        file_content = file.read()
-        file_hash = self.calculate_hash(file_content)
+        if created:
+            self._merge_longest_lines(longest)
+            self._register_sequences(created)
+        return results
 
-        if mongo.db.files.find_one({"hash": file_hash}):
+    def process_async(self, file):
+        """
+        Store a file and queue its indexing for the background workers. Until a
+        worker has indexed it the file is marked pending: it has no line_count, so
+        reads and searches of it scan the whole file, and it is left out of the
+        corpus-wide sampling while other files are indexed. The upload generation is bumped right
+        away so it becomes the latest file.
+        Args:
+            file (FileStorage): The file to be stored.
+        Returns:
+            dict: Metadata of the stored file and the id of its indexing job.
+        Raises:
+            FileAlreadyExistsException: If a file with the same hash already exists.
+        """
+        metadata, layout = self._store_blob(file.filename, file.stream)
+        job_id = self._queue_indexing(metadata, layout)
+        if job_id is None:
             raise FileAlreadyExistsException()
+        return dict(metadata, job_id=str(job_id))
+
+    def process_batch_async(self, members):
+        """
+        Store many files at once and queue the indexing of each, like
+        process_async. Members are stored in a thread pool; duplicates, of stored
+        files or of other members, are rejected by the unique index on ``hash``.
+        Args:
+            members (list): ``(filename, open)`` pairs, where ``open()`` returns a
+                binary stream over the member's content, rewound to its start.
+        Returns:
+            list: The status of each member, in order: its filename, hash and
+                  either ``pending`` with its file_id and job_id, or
+                  ``duplicate``.
+        """
+        with ThreadPoolExecutor(self.batch_workers) as pool:
+            stored = list(
+                pool.map(
+                    lambda member: self._store_blob(member[0], member[1]()), members
+                )
+            )
 
-        file_id = self.fs.put(BytesIO(file_content), filename=file.filename)
+        results = []
+        for metadata, layout in stored:
+            job_id = self._queue_indexing(metadata, layout)
+            if job_id is None:
+                results.append(
+                    {
+                        "filename": metadata["filename"],
+                        "hash": metadata["hash"],
+                        "status": "duplicate",
+                    }
+                )
+            else:
+                results.append(dict(metadata, job_id=str(job_id), status="pending"))
+        return results
 
-        metadata = {
-            "filename": file.filename,
-            "hash": file_hash,
-            "file_id": str(file_id),
-        }
+    def _queue_indexing(self, metadata, layout):
+        """
+        Save the metadata of a stored file as pending and queue its indexing. The
+        upload generation is bumped right away so it becomes the latest file.
+        Args:
+            metadata (dict): Metadata of the file, as given by _store_blob.
+            layout (dict): Its storage layout.
+        Returns:
+            ObjectId or None: The id of the indexing job, or None if the file is
+                a duplicate, whose stored content is then discarded.
+        """
+        try:
+            mongo.db.files.insert_one(dict(metadata, status=PENDING, **layout))
+        except DuplicateKeyError:
+            self._discard(metadata["file_id"])
+            return None
+        mongo.db.counters.update_one(
+            {"_id": FILES_COUNTER_ID},
+            {"$inc": {"generation": 1}, "$setOnInsert": {"epoch": ObjectId()}},
+            upsert=True,
+        )
+        return ingest_queue.enqueue(metadata["file_id"])
 
-        mongo.db.files.insert_one(metadata.copy())
+    def index_file(self, file_id):
+        """
+        Build the line-offset index, longest lines, letters index and search
+        postings of a file stored by process_async, or uploaded before those
+        indexes existed, and register it like a synchronous upload. Each step is
+        skipped when already done, so a job interrupted half way can be retried.
+        line_count is set last, which is what marks the file as indexed, and the
+        upload generation bumped so cached lookups and responses see it.
+        Args:
+            file_id (str): ObjectId of the file to index.
+        Returns:
+            int: Number of bytes indexed, 0 if the file was already indexed.
+        Raises:
+            FileNotFound: If the file or its metadata do not exist.
+        """
+        doc = mongo.db.files.find_one({"file_id": file_id})
+        if doc is None:
+            raise FileNotFound(f"No file found with id: {file_id}")
+        if (
+            "line_count" in doc
+            and "letters" in doc
+            and ("trigrams" in doc or not self.search_index)
+        ):
+            return 0
 
-        return metadata
+        # Postings left by an interrupted attempt would be duplicated.
+        mongo.db.trigrams.delete_many({"file_id": file_id})
+        indexer = self._new_line_indexer(file_id)
+        if "line_count" in doc:
+            # Only the letters or search index is missing; the offsets are left
+            # in place.
+            for chunk in self._iter_content(
+                file_id, self.storage.iter(FILES_BUCKET, file_id)
+            ):
+                indexer.feed(chunk)
+                indexer.pop_offsets()
+            indexer.close()
+            self._close_trigrams(indexer)
+            self._store_letters(file_id, indexer.letters)
+            mongo.db.files.update_one(
+                {"_id": doc["_id"]},
+                {"$set": self._index_fields(indexer)},
+            )
+            mongo.db.counters.update_one(
+                {"_id": FILES_COUNTER_ID}, {"$inc": {"generation": 1}}
+            )
+            return indexer.size
+
+        self.storage.delete(OFFSETS_BUCKET, file_id)
+        offsets = self.storage.create(OFFSETS_BUCKET, file_id)
+        try:
+            for chunk in self._iter_content(
+                file_id, self.storage.iter(FILES_BUCKET, file_id)
+            ):
+                indexer.feed(chunk)
+                offsets.write(indexer.pop_offsets())
+            indexer.close()
+            offsets.write(indexer.pop_offsets())
+        except BaseException:
+            offsets.abort()
+            mongo.db.trigrams.delete_many({"file_id": file_id})
+            raise
+        offsets.close()
+        self._close_trigrams(indexer)
+        self._store_letters(file_id, indexer.letters)
+
+        if "seq" not in doc:
+            self._register_sequences([(doc["_id"], indexer.line_count)])
+        if not mongo.db.longest_lines.find_one({"_id": file_id}, {"_id": 1}):
+            self._merge_longest_lines({file_id: indexer.longest()})
+        mongo.db.files.update_one(
+            {"_id": doc["_id"]},
+            {
+                "$set": dict(
+                    self._index_fields(indexer), line_count=indexer.line_count
+                ),
+                "$unset": {"status": ""},
+            },
+        )
+        mongo.db.counters.update_one(
+            {"_id": FILES_COUNTER_ID}, {"$inc": {"generation": 1}}
+        )
+        return indexer.size
+
+    def _index_fields(self, indexer):
+        fields = {"letters": indexer.letters.layout()}
+        if self.search_index:
+            fields["trigrams"] = True
+        return fields
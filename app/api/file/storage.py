@@ -0,0 +1,488 @@
+import asyncio
+import hashlib
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+
+import gridfs
+from bson.objectid import ObjectId
+
+from app.db import mongo
+from app.api.file.cache import file_cache
+from app.api.file.exceptions import FileNotFound
+from app.api.file.mirror import file_mirror
+
+READ_SIZE = 1024 * 1024
+CHUNK_FETCH_BATCH = 16
+
+
+def blocks_spanned(ranges, size):
+    """
+    List the fixed-size blocks, such as GridFS chunks or compression frames,
+    that byte ranges span.
+    Args:
+        ranges (list): ``(start, end)`` byte ranges.
+        size (int): Size of a block in bytes.
+    Returns:
+        list: The block numbers, in ascending order.
+    """
+    return sorted(
+        {
+            n
+            for start, end in ranges
+            for n in range(start // size, (end - 1) // size + 1)
+        }
+    )
+
+
+def slice_blocks(blocks, ranges, size):
+    """
+    Cut byte ranges out of the blocks they span.
+    Args:
+        blocks (dict): The bytes of every spanned block, keyed by block number.
+        ranges (list): ``(start, end)`` byte ranges.
+        size (int): Size of a block in bytes.
+    Returns:
+        list: The bytes of each range, in the order requested.
+    """
+    result = []
+    for start, end in ranges:
+        first = start // size
+        data = b"".join(blocks[n] for n in range(first, (end - 1) // size + 1))
+        result.append(data[start - first * size : end - first * size])
+    return result
+
+
+class StorageBackend:
+    """
+    Interface of the engines holding the bytes of stored files and of their
+    indexes, while MongoDB keeps their metadata. Blobs are addressed by the name
+    of a bucket, such as the files or their line offsets, and the ObjectId of
+    the file they belong to.
+    """
+
+    name = None
+
+    def create(self, bucket, file_id, **metadata):
+        """
+        Start writing a blob. The returned writer has ``write(data)``, and
+        ``close()`` or ``abort()`` to finish; the blob is only readable once
+        closed.
+        Args:
+            bucket (str): Name of the bucket.
+            file_id (str): ObjectId of the file the blob belongs to.
+            metadata: Extra fields engines may store with the blob.
+        """
+        raise NotImplementedError
+
+    def put(self, bucket, file_id, data):
+        """
+        Store a blob in one call.
+        """
+        writer = self.create(bucket, file_id)
+        writer.write(data)
+        writer.close()
+
+    def open(self, bucket, file_id):
+        """
+        Open a blob for reading.
+        Returns:
+            file: A seekable binary stream over the blob.
+        Raises:
+            FileNotFound: If the blob does not exist.
+        """
+        raise NotImplementedError
+
+    def iter(self, bucket, file_id):
+        """
+        Read a blob piece by piece.
+        Yields:
+            bytes: The next piece of the blob.
+        Raises:
+            FileNotFound: If the blob does not exist.
+        """
+        with self.open(bucket, file_id) as stream:
+            yield from iter(lambda: stream.read(READ_SIZE), b"")
+
+    def read_ranges(self, bucket, file_id, ranges):
+        """
+        Read byte ranges of a blob.
+        Args:
+            ranges (list): ``(start, end)`` byte ranges to read.
+        Returns:
+            list: The bytes of each range, in the order requested.
+        Raises:
+            FileNotFound: If the blob does not exist.
+        """
+        raise NotImplementedError
+
+    @contextmanager
+    def view(self, bucket, file_id):
+        """
+        Map a blob in memory, when the engine keeps it on local disk.
+        Yields:
+            memoryview or None: A read-only view of the blob's bytes, or None.
+        """
+        yield None
+
+    def stat(self, bucket, file_id):
+        """
+        Returns:
+            int: The size of a blob in bytes.
+        Raises:
+            FileNotFound: If the blob does not exist.
+        """
+        raise NotImplementedError
+
+    def sizes(self, bucket):
+        """
+        Returns:
+            dict: The size of every blob of a bucket, keyed by file ObjectId.
+        """
+        raise NotImplementedError
+
+    def delete(self, bucket, file_id):
+        """
+        Delete a blob. Deleting a blob that does not exist is not an error.
+        """
+        raise NotImplementedError
+
+
+class GridFSStorage(StorageBackend):
+    """
+    Store blobs in GridFS, one GridFS bucket per storage bucket. Range reads
+    fetch only the chunks they need, reusing those held in the worker cache, and
+    hot blobs are read through the local mirror when FILE_MIRROR_DIR is set.
+    """
+
+    name = "gridfs"
+
+    def __init__(self, db):
+        self.db = db
+        self._buckets = {}
+
+    def _bucket(self, bucket):
+        if bucket not in self._buckets:
+            self._buckets[bucket] = gridfs.GridFS(self.db, collection=bucket)
+        return self._buckets[bucket]
+
+    def create(self, bucket, file_id, **metadata):
+        return self._bucket(bucket).new_file(_id=ObjectId(file_id), **metadata)
+
+    def put(self, bucket, file_id, data):
+        self._bucket(bucket).put(data, _id=ObjectId(file_id))
+
+    def open(self, bucket, file_id):
+        try:
+            return self._bucket(bucket).get(ObjectId(file_id))
+        except gridfs.errors.NoFile:
+            raise FileNotFound(f"No file found with id: {file_id}")
+
+    def iter(self, bucket, file_id):
+        # GridOut iterates over its chunks, fetched in batches.
+        return iter(self.open(bucket, file_id))
+
+    @contextmanager
+    def view(self, bucket, file_id):
+        if not file_mirror.enabled:
+            yield None
+            return
+        with file_mirror.open(
+            bucket, file_id, lambda: self.iter(bucket, file_id)
+        ) as view:
+            yield view
+
+    def read_ranges(self, bucket, file_id, ranges):
+        """
+        Read byte ranges of a GridFS file. Files copied to the local mirror are
+        sliced from their memory map. Otherwise the ranges are read straight from
+        the GridFS chunks: chunks held in the worker cache are reused, and every
+        other chunk needed by the ranges is fetched with a single query and cached.
+        """
+        with self.view(bucket, file_id) as view:
+            if view is not None:
+                return [view[start:end].tobytes() for start, end in ranges]
+
+        size = gridfs.DEFAULT_CHUNK_SIZE
+        needed = blocks_spanned(ranges, size)
+
+        chunks, missing = {}, []
+        for n in needed:
+            data = file_cache.get((bucket, file_id, n))
+            if data is None:
+                missing.append(n)
+            else:
+                chunks[n] = data
+        if missing:
+            cursor = self.db[bucket].chunks.find(
+                {"files_id": ObjectId(file_id), "n": {"$in": missing}},
+                {"n": 1, "data": 1},
+            )
+            for doc in cursor:
+                chunks[doc["n"]] = bytes(doc["data"])
+                file_cache.put((bucket, file_id, doc["n"]), chunks[doc["n"]])
+        if len(chunks) < len(needed):
+            raise FileNotFound(f"No file found with id: {file_id}")
+        return slice_blocks(chunks, ranges, size)
+
+    def stat(self, bucket, file_id):
+        doc = self.db[bucket].files.find_one({"_id": ObjectId(file_id)}, {"length": 1})
+        if doc is None:
+            raise FileNotFound(f"No file found with id: {file_id}")
+        return doc["length"]
+
+    def sizes(self, bucket):
+        return {
+            str(doc["_id"]): doc["length"]
+            for doc in self.db[bucket].files.find({}, {"length": 1})
+        }
+
+    def delete(self, bucket, file_id):
+        self._bucket(bucket).delete(ObjectId(file_id))
+
+
+class LocalStorage(StorageBackend):
+    """
+    Store blobs as files in a local directory, addressed by their content.
+
+    Each blob is written to ``objects/<sha256>`` and hard-linked to
+    ``refs/<bucket>/<file_id>``, which is what reads open, so identical blobs
+    share one copy and a blob's last reference removes it. Writes go to a
+    temporary file first, so readers never see a partial blob. Range reads use
+    ``os.pread`` and streams are real files, which WSGI servers send with
+    ``sendfile``.
+    """
+
+    name = "local"
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _ref_path(self, bucket, file_id):
+        return os.path.join(self.directory, "refs", bucket, file_id[-2:], file_id)
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, "objects", digest[:2], digest)
+
+    def create(self, bucket, file_id, **metadata):
+        return LocalWriter(self, self._ref_path(bucket, file_id))
+
+    def open(self, bucket, file_id):
+        try:
+            return open(self._ref_path(bucket, file_id), "rb")
+        except FileNotFoundError:
+            raise FileNotFound(f"No file found with id: {file_id}")
+
+    @contextmanager
+    def view(self, bucket, file_id):
+        with self.open(bucket, file_id) as file:
+            if not os.fstat(file.fileno()).st_size:
+                yield memoryview(b"")
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    yield view
+                finally:
+                    view.release()
+
+    def read_ranges(self, bucket, file_id, ranges):
+        with self.open(bucket, file_id) as file:
+            fd = file.fileno()
+            return [os.pread(fd, end - start, start) for start, end in ranges]
+
+    def stat(self, bucket, file_id):
+        try:
+            return os.stat(self._ref_path(bucket, file_id)).st_size
+        except FileNotFoundError:
+            raise FileNotFound(f"No file found with id: {file_id}")
+
+    def sizes(self, bucket):
+        sizes = {}
+        root = os.path.join(self.directory, "refs", bucket)
+        for shard in os.scandir(root) if os.path.isdir(root) else ():
+            for entry in os.scandir(shard.path):
+                sizes[entry.name] = entry.stat().st_size
+        return sizes
+
+    def delete(self, bucket, file_id):
+        path = self._ref_path(bucket, file_id)
+        try:
+            links = os.stat(path).st_nlink
+        except FileNotFoundError:
+            return
+        if links == 2:
+            # Only the object is left once this reference is gone. It is found
+            # by hashing the content, which shared blobs never need.
+            with open(path, "rb") as file:
+                digest = hashlib.file_digest(file, "sha256").hexdigest()
+            _unlink(self._object_path(digest))
+        _unlink(path)
+
+    def _link(self, temporary, digest, path):
+        obj = self._object_path(digest)
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        while True:
+            try:
+                os.link(temporary, obj)
+            except FileExistsError:
+                pass
+            # The reference replaces any previous blob atomically.
+            staged = f"{temporary}.ref"
+            try:
+                os.link(obj, staged)
+            except FileNotFoundError:
+                # The existing object was deleted concurrently; store ours.
+                continue
+            os.replace(staged, path)
+            return
+
+
+class LocalWriter:
+    """
+    Write a blob of a LocalStorage to a temporary file, hashing it on the way,
+    and link it into place when closed.
+    """
+
+    def __init__(self, storage, path):
+        self.storage = storage
+        self.path = path
+        self._sha256 = hashlib.sha256()
+        directory = os.path.join(storage.directory, "tmp")
+        os.makedirs(directory, exist_ok=True)
+        self._file = tempfile.NamedTemporaryFile(dir=directory, delete=False)
+
+    def write(self, data):
+        self._sha256.update(data)
+        self._file.write(data)
+
+    def close(self):
+        try:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self.storage._link(self._file.name, self._sha256.hexdigest(), self.path)
+        finally:
+            _unlink(self._file.name)
+
+    def abort(self):
+        self._file.close()
+        _unlink(self._file.name)
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class AsyncGridFSStorage:
+    """
+    Read blobs stored by GridFSStorage through a non-blocking MongoDB client.
+    Chunks held in the worker cache are reused like in the synchronous engine,
+    and the missing ones are fetched with concurrent queries of up to
+    CHUNK_FETCH_BATCH chunks each.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    async def read_ranges(self, bucket, file_id, ranges):
+        """
+        Read byte ranges of a blob.
+        Args:
+            bucket (str): Name of the bucket.
+            file_id (str): ObjectId of the file the blob belongs to.
+            ranges (list): ``(start, end)`` byte ranges to read.
+        Returns:
+            list: The bytes of each range, in the order requested.
+        Raises:
+            FileNotFound: If the blob does not exist.
+        """
+        size = gridfs.DEFAULT_CHUNK_SIZE
+        needed = blocks_spanned(ranges, size)
+
+        chunks, missing = {}, []
+        for n in needed:
+            data = file_cache.get((bucket, file_id, n))
+            if data is None:
+                missing.append(n)
+            else:
+                chunks[n] = data
+        fetched = await asyncio.gather(
+            *(
+                self._fetch_chunks(bucket, file_id, missing[i : i + CHUNK_FETCH_BATCH])
+                for i in range(0, len(missing), CHUNK_FETCH_BATCH)
+            )
+        )
+        for batch in fetched:
+            chunks.update(batch)
+        if len(chunks) < len(needed):
+            raise FileNotFound(f"No file found with id: {file_id}")
+        return slice_blocks(chunks, ranges, size)
+
+    async def _fetch_chunks(self, bucket, file_id, numbers):
+        chunks = {}
+        cursor = self.db[bucket].chunks.find(
+            {"files_id": ObjectId(file_id), "n": {"$in": numbers}},
+            {"n": 1, "data": 1},
+        )
+        async for doc in cursor:
+            chunks[doc["n"]] = bytes(doc["data"])
+            file_cache.put((bucket, file_id, doc["n"]), chunks[doc["n"]])
+        return chunks
+
+
+class AsyncLocalStorage:
+    """
+    Read blobs of a LocalStorage from worker threads, as local files have no
+    non-blocking API.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def read_ranges(self, bucket, file_id, ranges):
+        return await asyncio.to_thread(
+            self.storage.read_ranges, bucket, file_id, ranges
+        )
+
+
+def get_storage(name, directory=None):
+    """
+    Build the storage engine files are kept in.
+    Args:
+        name (str): ``gridfs``, or ``local`` for a local directory.
+        directory (str): Root directory of the local engine.
+    Returns:
+        StorageBackend: The engine.
+    Raises:
+        ValueError: If the engine is unknown, or is local without a directory.
+    """
+    if name == "gridfs":
+        return GridFSStorage(mongo.db)
+    if name == "local":
+        if not directory:
+            raise ValueError("STORAGE_DIR must be set to use local storage")
+        return LocalStorage(directory)
+    raise ValueError(f"Unknown storage backend: {name}")
+
+
+def get_async_storage(name, directory, db):
+    """
+    Build the non-blocking reader of the storage engine files are kept in.
+    Args:
+        name (str): ``gridfs``, or ``local`` for a local directory.
+        directory (str): Root directory of the local engine.
+        db: The database of a non-blocking MongoDB client.
+    Returns:
+        AsyncGridFSStorage or AsyncLocalStorage: The reader.
+    Raises:
+        ValueError: If the engine is unknown, or is local without a directory.
+    """
+    if name == "gridfs":
+        return AsyncGridFSStorage(db)
+    return AsyncLocalStorage(get_storage(name, directory))
@@ -1,15 +1,83 @@
-import xml.etree.ElementTree as ET
-
 from http import HTTPStatus
 
-from flask import make_response, request, jsonify
+from bson.objectid import ObjectId
+from flask import Response, current_app, make_response, request, jsonify
 from flask_restx import Resource, Namespace
+from werkzeug.wsgi import wrap_file
 
+from app.api.file.archive import read_archive
+from app.api.file.cache import file_cache
+from app.api.file.jobs import ingest_queue
+from app.api.file.response_cache import cached
+from app.api.file.serializers import (
+    JSON_MIMETYPE,
+    MSGPACK_MIMETYPE,
+    NDJSON_MIMETYPE,
+    TEXT_MIMETYPE,
+    XML_MIMETYPE,
+    line_body,
+    lines_body,
+    ndjson_response,
+    negotiate,
+    render,
+)
 from app.api.file.service import TextFileService
-from app.api.file.exceptions import FileAlreadyExistsException, NoFileFoundException
+from app.api.file.exceptions import (
+    FileAlreadyExistsException,
+    FileNotFound,
+    InvalidArchiveException,
+    NoContentFound,
+    NoFileFoundException,
+)
+from app.api.metrics.instrumentation import timed
 
 ns = Namespace("file", "Files Management")
 
+MAX_SAMPLE_COUNT = 10000
+DOWNLOAD_BUFFER_SIZE = 256 * 1024
+MAX_LINE_WINDOW = 10_000_000
+MAX_SEARCH_LIMIT = 10_000
+LINE_WINDOW_STREAM_THRESHOLD = 1000
+LINE_MIMETYPES = [TEXT_MIMETYPE, JSON_MIMETYPE, XML_MIMETYPE, MSGPACK_MIMETYPE]
+
+
+def parse_sample_count(args=None):
+    """
+    Read the optional ``count`` query parameter of the random line endpoints.
+    Args:
+        args (Mapping): Query parameters to read instead of the current request's.
+    Returns:
+        int or None: The number of lines to sample, or None for a single line.
+    Raises:
+        ValueError: If count is not an integer between 1 and MAX_SAMPLE_COUNT.
+    """
+    count = (request.args if args is None else args).get("count")
+    if count is None:
+        return None
+    if not count.isdigit() or not 1 <= int(count) <= MAX_SAMPLE_COUNT:
+        raise ValueError(f"count must be an integer from 1 to {MAX_SAMPLE_COUNT}")
+    return int(count)
+
+
+def parse_non_negative(name, default, maximum=None, args=None):
+    """
+    Read an optional non-negative integer query parameter.
+    Args:
+        args (Mapping): Query parameters to read instead of the current request's.
+    Returns:
+        int: The parameter's value, or default when it is absent.
+    Raises:
+        ValueError: If the value is not an integer from 0 to maximum.
+    """
+    value = (request.args if args is None else args).get(name)
+    if value is None:
+        return default
+    if not value.isdigit():
+        raise ValueError(f"{name} must be a non-negative integer")
+    if maximum is not None and int(value) > maximum:
+        raise ValueError(f"{name} must be an integer from 0 to {maximum}")
+    return int(value)
+
 
 @ns.route("/upload")
 class FileUploadView(Resource):
@@ -19,26 +87,91 @@ class FileUploadView(Resource):
 
     @ns.doc("upload_file")
     @ns.response(201, "File uploaded successfully.")
+    @ns.response(202, "File stored; indexing was queued.")
     @ns.response(400, "File already exists or no file found in request.")
     def post(self):
         """
         Upload a file to be stored in GridFS.
 
         This endpoint allows users to upload files that will be processed and stored in GridFS.
+        With INGEST_MODE=async the file is indexed in the background and the id of the job is returned.
         """
         if "file" not in request.files:
             return make_response(
                 jsonify({"error": str(NoFileFoundException())}), HTTPStatus.BAD_REQUEST
             )
 
+        asynchronous = current_app.config.get("INGEST_MODE") == "async"
         try:
             service = TextFileService()
             file = request.files["file"]
-            resp = service.process(file)
+            if asynchronous:
+                resp = service.process_async(file)
+            else:
+                resp = service.process(file)
         except FileAlreadyExistsException as err:
             return make_response(jsonify({"error": str(err)}), HTTPStatus.BAD_REQUEST)
 
-        return make_response(jsonify(resp), HTTPStatus.CREATED)
+        status = HTTPStatus.ACCEPTED if asynchronous else HTTPStatus.CREATED
+        with timed("serialize"):
+            return render(resp, status)
+
+
+@ns.route("/upload/batch")
+class FileBatchUploadView(Resource):
+    """
+    Resource for uploading many files, or an archive of them, in one request.
+    """
+
+    @ns.doc("upload_files")
+    @ns.param("files", "Files to upload, as repeated multipart parts", _in="formData")
+    @ns.param("archive", "A tar or zip archive of files to upload", _in="formData")
+    @ns.response(200, "Files processed; see the status of each member.")
+    @ns.response(202, "Files stored; their indexing was queued.")
+    @ns.response(400, "No files found in request or invalid archive.")
+    def post(self):
+        """
+        Upload several files to be stored in GridFS.
+
+        Either repeated ``files`` parts or a single ``archive`` part (tar, tar.gz or zip)
+        are accepted. The response lists each member as created or duplicate.
+        With INGEST_MODE=async members are listed as pending, with the id of their job.
+        """
+        files = request.files.getlist("files")
+        if "archive" in request.files:
+            archive = request.files["archive"]
+            try:
+                members = read_archive(
+                    archive.stream, current_app.config["UPLOAD_CHUNK_SIZE"]
+                )
+            except InvalidArchiveException as err:
+                return make_response(
+                    jsonify({"error": str(err)}), HTTPStatus.BAD_REQUEST
+                )
+        else:
+            members = [(file.filename, self._rewind(file.stream)) for file in files]
+
+        if not members:
+            return make_response(
+                jsonify({"error": str(NoFileFoundException())}), HTTPStatus.BAD_REQUEST
+            )
+
+        service = TextFileService()
+        if current_app.config.get("INGEST_MODE") == "async":
+            results = service.process_batch_async(members)
+            status = HTTPStatus.ACCEPTED
+        else:
+            results = service.process_batch(members)
+            status = HTTPStatus.OK
+        with timed("serialize"):
+            return render({"files": results}, status)
+
+    def _rewind(self, stream):
+        def open_member():
+            stream.seek(0)
+            return stream
+
+        return open_member
 
 
 @ns.route("/line/random")
@@ -48,33 +181,61 @@ class RandomLineView(Resource):
     """
 
     @ns.doc("get_random_line")
-    @ns.produces(["text/plain", "application/json", "application/xml"])
+    @ns.produces(LINE_MIMETYPES)
+    @ns.param("scope", "latest (default) for the latest file, all for every line")
+    @ns.param("count", f"Number of lines to sample, up to {MAX_SAMPLE_COUNT}")
+    @ns.param("replace", "Whether a line may be sampled more than once (default true)")
     @ns.response(200, "Random line retrieved successfully.")
+    @ns.response(400, "Unknown scope or invalid count.")
     def get(self):
         """
         Get a random line from the latest file.
 
-        This endpoint returns a random line from the latest uploaded file in text, JSON, or XML format.
+        This endpoint returns a random line from the latest uploaded file in text, JSON, XML or
+        MessagePack format, negotiated from the Accept header.
+        With scope=all the line is drawn uniformly over every line of every file.
+        With count=N a list of N sampled lines is returned in a single response.
         """
+        scope = request.args.get("scope", "latest")
+        if scope not in ("latest", "all"):
+            return make_response(
+                jsonify({"error": f"Unknown scope: {scope}"}), HTTPStatus.BAD_REQUEST
+            )
+        try:
+            count = parse_sample_count()
+        except ValueError as err:
+            return make_response(jsonify({"error": str(err)}), HTTPStatus.BAD_REQUEST)
 
         service = TextFileService()
-        line_info = service.get_random_line()
-        response_type = request.headers.get("Accept", "text/plain")
+        mimetype = negotiate(LINE_MIMETYPES, TEXT_MIMETYPE)
+        # application/* as the preferred type asks for the line with its metadata.
+        detailed = request.accept_mimetypes.best == "application/*"
+
+        if count is not None:
+            replace = request.args.get("replace", "true").lower() == "true"
+            if scope == "all":
+                lines = service.get_random_corpus_lines(count, replace)
+            else:
+                lines = service.get_random_lines(count, replace)
+            with timed("serialize"):
+                return self._lines_response(lines, mimetype, detailed)
+
+        if scope == "all":
+            line_info = service.get_random_corpus_line()
+        else:
+            line_info = service.get_random_line()
+        with timed("serialize"):
+            return self._line_response(line_info, mimetype, detailed)
 
-        if response_type == "application/*":
-            return make_response(jsonify(line_info), HTTPStatus.OK)
-        if response_type == "application/json":
-            return jsonify({"text": line_info["text"]})
-        elif response_type == "application/xml":
-            line = f"<line><text>{line_info['text']}</text></line>"
-            response = make_response(line, HTTPStatus.OK)
-            response.mimetype = "application/xml"
-            return response
+    def _line_response(self, line_info, mimetype, detailed):
+        if detailed:
+            return render(line_info)
+        return Response(line_body(line_info, mimetype), mimetype=mimetype)
 
-        response = make_response(line_info["text"], HTTPStatus.OK)
-        response.headers["Content-Type"] = "text/plain"
-        response.mimetype = "text/plain"
-        return response
+    def _lines_response(self, lines, mimetype, detailed):
+        if detailed:
+            return render(lines)
+        return Response(lines_body(lines, mimetype), mimetype=mimetype)
 
 
 @ns.route("/line/random-backward")
@@ -84,11 +245,26 @@ class RandomLineBackwardView(Resource):
     """
 
     @ns.doc("get_random_line_backward")
+    @ns.param("count", f"Number of lines to sample, up to {MAX_SAMPLE_COUNT}")
+    @ns.param("replace", "Whether a line may be sampled more than once (default true)")
     @ns.response(200, "Random line retrieved and reversed successfully.")
+    @ns.response(400, "Invalid count.")
     def get(self):
+        try:
+            count = parse_sample_count()
+        except ValueError as err:
+            return make_response(jsonify({"error": str(err)}), HTTPStatus.BAD_REQUEST)
+
         service = TextFileService()
+        if count is not None:
+            replace = request.args.get("replace", "true").lower() == "true"
+            lines = service.get_random_lines_backward(count, replace)
+            with timed("serialize"):
+                return render({"lines": lines})
+
         line = service.get_random_line_backward()
-        return make_response(jsonify({"line": line}), HTTPStatus.OK)
+        with timed("serialize"):
+            return render({"line": line})
 
 
 @ns.route("/longest")
@@ -98,15 +274,229 @@ class FileLineLongestView(Resource):
     """
 
     @ns.doc("get_longest_lines")
+    @ns.produces(["application/json", NDJSON_MIMETYPE])
+    @ns.param("number", "Number of longest lines to return (default 100)")
+    @ns.param("single", "true to only read the latest file")
+    @ns.param("stream", "true to stream the lines as NDJSON")
     @ns.response(200, "Longest lines retrieved successfully.")
+    @ns.response(304, "The client's copy, identified by If-None-Match, is current.")
+    @ns.response(400, "Invalid number.")
+    @cached
     def get(self):
-        number = int(request.args.get("number", 100))
+        """
+        Get the longest lines of all files, or of the latest file.
+
+        With stream=true or Accept: application/x-ndjson, lines are streamed as
+        one JSON object per line while they are selected.
+        """
+        try:
+            number = parse_non_negative("number", 100)
+        except ValueError as err:
+            return make_response(jsonify({"error": str(err)}), HTTPStatus.BAD_REQUEST)
+
         service = TextFileService()
         single = request.args.get("single", "false").lower() == "true"
 
+        streamed = request.args.get("stream", "false").lower() == "true"
+        if streamed or request.accept_mimetypes.best == NDJSON_MIMETYPE:
+            if single:
+                return ndjson_response(service.iter_longest_lines_single_file(number))
+            return ndjson_response(service.iter_longest_lines(number))
+
         if single:
             lines = service.get_longest_lines_single_file(number)
         else:
             lines = service.get_longest_lines(number)
 
-        return jsonify(lines)
+        with timed("serialize"):
+            return render(lines)
+
+
+@ns.route("/jobs/<string:job_id>")
+class FileJobView(Resource):
+    """
+    Resource for following the background indexing of an upload.
+    """
+
+    @ns.doc("get_file_job")
+    @ns.response(200, "Job retrieved successfully.")
+    @ns.response(404, "No job found with the given id.")
+    def get(self, job_id):
+        job = ingest_queue.get(job_id)
+        if job is None:
+            return make_response(
+                jsonify({"error": f"No job found with id: {job_id}"}),
+                HTTPStatus.NOT_FOUND,
+            )
+
+        job["job_id"] = str(job.pop("_id"))
+        job.pop("worker", None)
+        return render(job)
+
+
+@ns.route("/cache")
+class FileCacheView(Resource):
+    """
+    Resource for inspecting the file cache of the worker serving the request.
+    """
+
+    @ns.doc("get_file_cache_stats")
+    @ns.response(200, "Cache counters retrieved successfully.")
+    def get(self):
+        return render(file_cache.stats())
+
+
+@ns.route("/search")
+class FileSearchView(Resource):
+    """
+    Resource for finding the lines containing a text across all files.
+    """
+
+    @ns.doc("search_lines")
+    @ns.produces([NDJSON_MIMETYPE])
+    @ns.param("q", "Text to look for, at least 3 bytes long in UTF-8")
+    @ns.param(
+        "limit",
+        f"Maximum number of lines to return (default 100, up to {MAX_SEARCH_LIMIT})",
+    )
+    @ns.response(200, "Matching lines streamed successfully.")
+    @ns.response(304, "The client's copy, identified by If-None-Match, is current.")
+    @ns.response(400, "Missing or invalid q or limit.")
+    @cached
+    def get(self):
+        """
+        Search the lines of all files for a text.
+
+        Lines are looked up in the trigram index built at upload, and streamed as one
+        JSON object per line, with the file_id, line number and text of each match,
+        in upload order and then line order. Matching is case-sensitive.
+        """
+        try:
+            limit = parse_non_negative("limit", 100, MAX_SEARCH_LIMIT)
+            matches = TextFileService().iter_search(request.args.get("q", ""), limit)
+        except ValueError as err:
+            return make_response(jsonify({"error": str(err)}), HTTPStatus.BAD_REQUEST)
+
+        return ndjson_response(matches)
+
+
+@ns.route("/<string:file_id>")
+class FileDownloadView(Resource):
+    """
+    Resource for downloading a stored file.
+    """
+
+    @ns.doc("download_file")
+    @ns.produces(["text/plain"])
+    @ns.response(200, "File content.")
+    @ns.response(206, "The requested range of the file content.")
+    @ns.response(304, "The client's copy, identified by If-None-Match, is current.")
+    @ns.response(404, "No file found with the given id.")
+    @ns.response(416, "The requested range is not satisfiable.")
+    def get(self, file_id):
+        """
+        Download a stored file.
+
+        The content is streamed from storage without buffering the whole file; files kept by the
+        local storage engine are handed to the server, which can send them with sendfile. Range requests are
+        supported, and the file's MD5 hash is its ETag, so If-None-Match and If-Range work too.
+        """
+        try:
+            if not ObjectId.is_valid(file_id):
+                raise FileNotFound(f"No file found with id: {file_id}")
+            doc, stream, size = TextFileService().open_file(file_id)
+        except FileNotFound as err:
+            return make_response(jsonify({"error": str(err)}), HTTPStatus.NOT_FOUND)
+
+        response = Response(
+            wrap_file(request.environ, stream, DOWNLOAD_BUFFER_SIZE),
+            mimetype="text/plain",
+            direct_passthrough=True,
+        )
+        response.content_length = size
+        response.set_etag(doc["hash"])
+        response.headers.set(
+            "Content-Disposition", "attachment", filename=doc["filename"]
+        )
+        return response.make_conditional(
+            request.environ, accept_ranges=True, complete_length=size
+        )
+
+
+@ns.route("/<string:file_id>/lines")
+class FileLinesView(Resource):
+    """
+    Resource for reading a contiguous window of lines of a file.
+    """
+
+    @ns.doc("get_file_lines")
+    @ns.produces(["application/json", NDJSON_MIMETYPE])
+    @ns.param("file_id", "ObjectId of the file, or latest for the latest file")
+    @ns.param("start", "Zero-based number of the first line (default 0)")
+    @ns.param(
+        "count", f"Number of lines to read (default 100, up to {MAX_LINE_WINDOW})"
+    )
+    @ns.response(200, "Lines retrieved successfully.")
+    @ns.response(304, "The client's copy, identified by If-None-Match, is current.")
+    @ns.response(400, "Invalid start or count.")
+    @ns.response(404, "No file found with the given id, or no file uploaded yet.")
+    @cached
+    def get(self, file_id):
+        """
+        Get a window of lines of a file.
+
+        Only the part of the file holding the lines is read. Windows of more than
+        LINE_WINDOW_STREAM_THRESHOLD lines, or any window requested with Accept: application/x-ndjson,
+        are streamed as one JSON object per line.
+        """
+        try:
+            start = parse_non_negative("start", 0)
+            count = parse_non_negative("count", 100, MAX_LINE_WINDOW)
+        except ValueError as err:
+            return make_response(jsonify({"error": str(err)}), HTTPStatus.BAD_REQUEST)
+
+        service = TextFileService()
+        try:
+            doc = service.get_file_metadata(file_id)
+        except (FileNotFound, NoContentFound) as err:
+            return make_response(jsonify({"error": str(err)}), HTTPStatus.NOT_FOUND)
+
+        lines = service.iter_line_window(doc, start, count)
+        streamed = request.accept_mimetypes.best == NDJSON_MIMETYPE
+        if streamed or count > LINE_WINDOW_STREAM_THRESHOLD:
+            return ndjson_response(lines)
+
+        window = {"file_id": doc["file_id"], "start": start, "lines": list(lines)}
+        with timed("serialize"):
+            return render(window)
+
+
+@ns.route("/<string:file_id>/letters")
+class FileLettersView(Resource):
+    """
+    Resource for the letter frequencies of a file.
+    """
+
+    @ns.doc("get_file_letters")
+    @ns.param("file_id", "ObjectId of the file, or latest for the latest file")
+    @ns.response(200, "Letter frequencies retrieved successfully.")
+    @ns.response(304, "The client's copy, identified by If-None-Match, is current.")
+    @ns.response(404, "No file found with the given id, or no file uploaded yet.")
+    @cached
+    def get(self, file_id):
+        """
+        Get the letter frequencies of a file.
+
+        Returns the count of each letter in the file, the number of lines each letter is
+        the most frequent of, and the number of lines without letters. They are computed
+        when the file is indexed, so the text is not read again.
+        """
+        service = TextFileService()
+        try:
+            doc = service.get_file_metadata(file_id)
+        except (FileNotFound, NoContentFound) as err:
+            return make_response(jsonify({"error": str(err)}), HTTPStatus.NOT_FOUND)
+
+        stats = service.get_letter_stats(doc)
+        with timed("serialize"):
+            return render(stats)
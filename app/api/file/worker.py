@@ -0,0 +1,52 @@
+import logging
+import os
+import socket
+import time
+
+from flask import current_app
+
+from app.api.file.jobs import ingest_queue
+from app.api.file.service import TextFileService
+
+logger = logging.getLogger(__name__)
+
+
+def work(burst=False):
+    """
+    Index queued uploads until stopped. Must run inside an application context.
+    Args:
+        burst (bool): Return once the queue is empty instead of polling it.
+    """
+    config = current_app.config
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    service = TextFileService()
+
+    while True:
+        job = ingest_queue.claim(worker, config["INGEST_JOB_TIMEOUT"])
+        if job is None:
+            if burst:
+                return
+            time.sleep(config["INGEST_POLL_INTERVAL"])
+            continue
+
+        try:
+            service.index_file(job["file_id"])
+        except Exception as err:
+            logger.exception("Indexing of file %s failed", job["file_id"])
+            ingest_queue.fail(
+                job, f"{type(err).__name__}: {err}", config["INGEST_MAX_ATTEMPTS"]
+            )
+        else:
+            ingest_queue.complete(job["_id"])
+
+
+def run(deploy_env, burst=False):
+    """
+    Entry point of a worker process. Each process builds its own app, and so its
+    own MongoDB client, since clients must not be shared across processes.
+    """
+    from app import create_app
+
+    app = create_app(deploy_env)
+    with app.app_context():
+        work(burst)
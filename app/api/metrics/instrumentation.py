@@ -0,0 +1,149 @@
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request
+from prometheus_client import Counter, Histogram
+from pymongo import monitoring
+
+from app.api.file.cache import file_cache
+
+PHASES = ("mongo", "gridfs", "decode", "serialize")
+
+REQUEST_SECONDS = Histogram(
+    "filemanager_request_seconds",
+    "Total time spent handling a file endpoint request.",
+    ["endpoint", "method", "status"],
+)
+PHASE_SECONDS = Histogram(
+    "filemanager_request_phase_seconds",
+    "Time spent in each phase of a file endpoint request.",
+    ["endpoint", "phase"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+GRIDFS_BYTES = Histogram(
+    "filemanager_gridfs_bytes_read",
+    "Bytes read from GridFS while handling a file endpoint request.",
+    ["endpoint"],
+    buckets=(0, 1024, 16384, 262144, 1048576, 16777216, 268435456),
+)
+CACHE_REQUESTS = Counter(
+    "filemanager_cache_requests_total",
+    "File endpoint requests by how they were served by the worker cache.",
+    ["endpoint", "result"],
+)
+RESPONSE_CACHE_REQUESTS = Counter(
+    "filemanager_response_cache_requests_total",
+    "Cacheable file endpoint requests by how the response cache answered them.",
+    ["endpoint", "result"],
+)
+
+
+@contextmanager
+def timed(phase):
+    """
+    Add the time spent in the block to a phase of the current request.
+    Outside of a request, e.g. in CLI commands, nothing is recorded.
+    Args:
+        phase (str): One of PHASES.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _is_tracking():
+            g.request_phases[phase] += time.perf_counter() - start
+
+
+class CommandTimer(monitoring.CommandListener):
+    """
+    Attribute the duration of every MongoDB command to the request that issued
+    it. Reads of GridFS chunk collections count as the ``gridfs`` phase, along
+    with the bytes they returned; everything else is ``mongo``.
+    """
+
+    def started(self, event):
+        if _is_tracking():
+            if event.command_name == "getMore":
+                collection = event.command.get("collection")
+            else:
+                collection = event.command.get(event.command_name)
+            g.mongo_commands[event.request_id] = collection
+
+    def succeeded(self, event):
+        self._finish(event, event.reply)
+
+    def failed(self, event):
+        self._finish(event, None)
+
+    def _finish(self, event, reply):
+        if not _is_tracking():
+            return
+
+        collection = g.mongo_commands.pop(event.request_id, None)
+        if not (isinstance(collection, str) and collection.endswith(".chunks")):
+            g.request_phases["mongo"] += event.duration_micros / 1e6
+            return
+
+        g.request_phases["gridfs"] += event.duration_micros / 1e6
+        cursor = (reply or {}).get("cursor", {})
+        for doc in cursor.get("firstBatch", cursor.get("nextBatch", [])):
+            g.gridfs_bytes += len(doc.get("data", b""))
+
+
+command_timer = CommandTimer()
+
+
+def init_app(app):
+    """
+    Instrument every request to the file endpoints of the given app. The
+    command_timer listener must also be passed to the MongoDB client.
+    """
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+
+def _is_tracking():
+    return has_request_context() and "request_phases" in g
+
+
+def _is_instrumented():
+    return request.blueprint == "api" and request.url_rule is not None
+
+
+def _start_request():
+    if not _is_instrumented():
+        return
+    g.request_started = time.perf_counter()
+    g.request_phases = dict.fromkeys(PHASES, 0.0)
+    g.gridfs_bytes = 0
+    g.mongo_commands = {}
+    g.cache_counts = (file_cache.hits, file_cache.misses)
+
+
+def _finish_request(response):
+    if "request_phases" not in g:
+        return response
+
+    endpoint = request.url_rule.rule
+    elapsed = time.perf_counter() - g.request_started
+    REQUEST_SECONDS.labels(endpoint, request.method, response.status_code).observe(
+        elapsed
+    )
+    for phase, seconds in g.request_phases.items():
+        PHASE_SECONDS.labels(endpoint, phase).observe(seconds)
+    GRIDFS_BYTES.labels(endpoint).observe(g.gridfs_bytes)
+
+    hits = file_cache.hits - g.cache_counts[0]
+    misses = file_cache.misses - g.cache_counts[1]
+    cache_result = "miss" if misses else "hit" if hits else "none"
+    CACHE_REQUESTS.labels(endpoint, cache_result).inc()
+
+    if current_app.config.get("SERVER_TIMING_ENABLED"):
+        timings = [
+            f"{phase};dur={seconds * 1000:.2f}"
+            for phase, seconds in g.request_phases.items()
+        ]
+        timings.append(f"total;dur={elapsed * 1000:.2f}")
+        timings.append(f'cache;desc="{cache_result}"')
+        response.headers["Server-Timing"] = ", ".join(timings)
+    return response
@@ -0,0 +1,269 @@
+import cProfile
+import hmac
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+from werkzeug.wsgi import ClosingIterator
+
+PROFILED_PATH_PREFIX = "/api/v1/"
+PROFILE_HEADER = "HTTP_X_PROFILE"
+PROFILE_TOKEN_HEADER = "HTTP_X_PROFILE_TOKEN"
+
+
+class CProfileRecorder:
+    """
+    Deterministic profile of every function call made by the request's thread,
+    written in the pstats format.
+    """
+
+    suffix = ".pstats"
+    # Since Python 3.12 cProfile hooks into the whole interpreter, so a worker
+    # only traces one request at a time.
+    tracing = threading.Lock()
+
+    def __init__(self, interval):
+        if not self.tracing.acquire(blocking=False):
+            raise RuntimeError("Another request is being traced")
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.create_stats()
+        self.tracing.release()
+
+    def write(self, path):
+        self.profile.dump_stats(path)
+
+
+class StackSampler:
+    """
+    Statistical profile of the request's thread, whose stack is sampled every
+    ``interval`` seconds by a background thread through sys._current_frames().
+    The stacks are written in the collapsed format read by flamegraph.pl and
+    speedscope: one ``root;...;leaf count`` line per distinct stack.
+
+    A CPU-bound request only releases the GIL every sys.getswitchinterval(), so
+    the effective rate is at most that.
+    """
+
+    suffix = ".folded"
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self._target = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._target = threading.get_ident()
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def write(self, path):
+        with open(path, "w") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+
+RECORDERS = {"cprofile": CProfileRecorder, "sample": StackSampler}
+
+
+class RequestProfiler:
+    """
+    Opt-in profiling of API requests in production. When PROFILING_ENABLED is
+    set, a request is profiled with probability PROFILE_SAMPLE_RATE, or when it
+    carries an X-Profile header, whose value may name the mode. The header is
+    only honoured when PROFILE_TOKEN is set and the request sends it back in
+    X-Profile-Token, so clients cannot turn on cProfile at will. Profiles
+    are written to PROFILE_DIR, one file per request, and the oldest are removed
+    beyond PROFILE_MAX_FILES; the name of a request's profile is returned in its
+    X-Profile-Name response header.
+
+    The ``sample`` mode (PROFILE_MODE's default) samples stacks every
+    PROFILE_INTERVAL seconds and costs little; ``cprofile`` traces every call,
+    which is exact but slows the request down.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.directory = None
+        self.mode = "sample"
+        self.sample_rate = 0.0
+        self.interval = 0.005
+        self.max_files = 0
+        self.token = None
+
+    def init_app(self, app):
+        self.enabled = app.config["PROFILING_ENABLED"]
+        self.directory = app.config["PROFILE_DIR"]
+        self.mode = app.config["PROFILE_MODE"]
+        self.sample_rate = app.config["PROFILE_SAMPLE_RATE"]
+        self.interval = app.config["PROFILE_INTERVAL"]
+        self.max_files = app.config["PROFILE_MAX_FILES"]
+        self.token = app.config["PROFILE_TOKEN"]
+        if self.mode not in RECORDERS:
+            raise ValueError(f"Unknown profile mode: {self.mode}")
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+            app.wsgi_app = ProfilingMiddleware(app.wsgi_app, self)
+
+    def choose(self, environ):
+        """
+        Decide whether to profile a request.
+        Args:
+            environ (dict): WSGI environment of the request.
+        Returns:
+            str or None: The profile mode, or None to leave the request alone.
+        """
+        if not environ.get("PATH_INFO", "").startswith(PROFILED_PATH_PREFIX):
+            return None
+        requested = environ.get(PROFILE_HEADER)
+        if requested is not None and self.token and self.authorized(environ):
+            return requested if requested in RECORDERS else self.mode
+        if self.sample_rate and random.random() < self.sample_rate:
+            return self.mode
+        return None
+
+    def authorized(self, environ):
+        """
+        Check the X-Profile-Token header of a request against PROFILE_TOKEN.
+        Any request is authorized when no token is set.
+        """
+        if not self.token:
+            return True
+        token = environ.get(PROFILE_TOKEN_HEADER, "")
+        return hmac.compare_digest(token.encode(), self.token.encode())
+
+    def recorder(self, mode):
+        """
+        Create the recorder of a profile, sampling stacks instead when another
+        request of the worker is already traced by cProfile.
+        """
+        try:
+            return RECORDERS[mode](self.interval)
+        except RuntimeError:
+            return StackSampler(self.interval)
+
+    def name(self, environ, recorder):
+        """
+        Name the profile of a request after its time, method and path. The
+        worker's pid and a random suffix keep names unique across workers.
+        """
+        stamp = time.strftime("%Y%m%dT%H%M%S")
+        unique = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        method = environ.get("REQUEST_METHOD", "GET")
+        path = re.sub(r"[^A-Za-z0-9]+", "_", environ.get("PATH_INFO", "")).strip("_")
+        return f"{stamp}-{unique}-{method}-{path[:80]}{recorder.suffix}"
+
+    def save(self, recorder, name):
+        """
+        Write a finished profile and remove the oldest beyond PROFILE_MAX_FILES.
+        The profile is written to a temporary name and renamed into place, so it
+        is never listed half written.
+        """
+        fd, temporary = tempfile.mkstemp(dir=self.directory, prefix=".")
+        os.close(fd)
+        try:
+            recorder.write(temporary)
+            os.replace(temporary, os.path.join(self.directory, name))
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+        profiles = self.list()
+        for profile in profiles[self.max_files :]:
+            try:
+                os.unlink(os.path.join(self.directory, profile["name"]))
+            except FileNotFoundError:
+                pass
+
+    def list(self):
+        """
+        List the stored profiles.
+        Returns:
+            list: The name, size and creation time of each profile, newest first.
+        """
+        profiles = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            profiles.append((stat.st_mtime, entry.name, stat.st_size))
+
+        return [
+            {
+                "name": name,
+                "size": size,
+                "created": datetime.fromtimestamp(mtime, timezone.utc).isoformat(),
+            }
+            for mtime, name, size in sorted(profiles, reverse=True)
+        ]
+
+
+class ProfilingMiddleware:
+    """
+    WSGI middleware running the chosen requests under a profiler until their
+    response has been sent, so streamed bodies are profiled too.
+    """
+
+    def __init__(self, wsgi_app, profiler):
+        self.wsgi_app = wsgi_app
+        self.profiler = profiler
+
+    def __call__(self, environ, start_response):
+        mode = self.profiler.choose(environ)
+        if mode is None:
+            return self.wsgi_app(environ, start_response)
+
+        recorder = self.profiler.recorder(mode)
+        name = self.profiler.name(environ, recorder)
+
+        def start_profiled_response(status, headers, exc_info=None):
+            headers.append(("X-Profile-Name", name))
+            return start_response(status, headers, exc_info)
+
+        def finish():
+            recorder.stop()
+            self.profiler.save(recorder, name)
+
+        try:
+            recorder.start()
+            response = self.wsgi_app(environ, start_profiled_response)
+        except BaseException:
+            finish()
+            raise
+        return ClosingIterator(response, finish)
+
+
+request_profiler = RequestProfiler()
@@ -0,0 +1,36 @@
+from http import HTTPStatus
+
+from flask import Blueprint, jsonify, make_response, request, send_from_directory
+
+from app.api.profiling.profiler import request_profiler
+
+profiling_bp = Blueprint("profiling", __name__)
+
+
+@profiling_bp.before_request
+def authorize():
+    """
+    Require the X-Profile-Token header when PROFILE_TOKEN is set. The blueprint
+    is only registered when PROFILING_ENABLED is set.
+    """
+    if not request_profiler.authorized(request.environ):
+        return make_response(
+            jsonify({"error": "Invalid profile token"}), HTTPStatus.FORBIDDEN
+        )
+
+
+@profiling_bp.route("/profiles")
+def list_profiles():
+    """
+    List the request profiles stored in PROFILE_DIR, newest first.
+    """
+    return jsonify({"profiles": request_profiler.list()})
+
+
+@profiling_bp.route("/profiles/<string:name>")
+def get_profile(name):
+    """
+    Download a request profile, to load in pstats, snakeviz, flamegraph.pl or
+    speedscope.
+    """
+    return send_from_directory(request_profiler.directory, name, as_attachment=True)
@@ -0,0 +1,49 @@
+import contextlib
+import os
+from http import HTTPStatus
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+from app import create_app
+from app.db import async_mongo
+from app.api.file.async_view import respond, routes
+from app.api.file.serializers import JSON_MIMETYPE, dumps_json
+
+WSGI_THREADS = int(os.environ.get("ASGI_WSGI_THREADS", 10))
+
+
+async def server_error(request, exc):
+    # The same body flask-restx answers unhandled errors with.
+    body = dumps_json({"message": HTTPStatus.INTERNAL_SERVER_ERROR.phrase})
+    return respond(body, JSON_MIMETYPE, HTTPStatus.INTERNAL_SERVER_ERROR)
+
+
+def create_asgi_app(deploy_env: str = os.getenv("FLASK_ENV", "Development")):
+    """
+    Build the ASGI app, which serves the read endpoints of the file namespace
+    with AsyncTextFileService on a non-blocking MongoDB client. Every other
+    request, such as uploads, the docs, health checks and metrics, is handed to
+    the Flask app, run in a pool of WSGI_THREADS threads.
+    """
+    flask_app = create_app(deploy_env)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        async_mongo.init_app(flask_app)
+        try:
+            yield
+        finally:
+            await async_mongo.close()
+
+    app = Starlette(
+        routes=[
+            *routes,
+            Mount("/", app=WSGIMiddleware(flask_app, workers=WSGI_THREADS)),
+        ],
+        exception_handlers={Exception: server_error},
+        lifespan=lifespan,
+    )
+    app.state.flask_app = flask_app
+    return app
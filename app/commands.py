@@ -1,6 +1,15 @@
+import multiprocessing
+import os
+import time
+
 import click
+from bson.objectid import ObjectId
 from flask.cli import with_appcontext
-from app.db import mongo
+from pymongo.errors import OperationFailure
+
+from app.api.file import maintenance, worker
+from app.api.file.service import DUPLICATE_KEY_ERROR
+from app.db import mongo, ensure_indexes as ensure_db_indexes
 
 
 @click.command(name="about")
@@ -16,3 +25,113 @@ def create_collection(collection_name):
     if collection_name not in mongo.db.list_collection_names():
         mongo.db.create_collection(collection_name)
         print(f"Collection '{collection_name}' criada no banco '{mongo.db.name}'.")
+
+
+@click.command(name="ensure-indexes")
+@click.option(
+    "--drop-duplicates",
+    is_flag=True,
+    help="Delete all but the oldest copy of files stored more than once.",
+)
+@with_appcontext
+def ensure_indexes(drop_duplicates):
+    if drop_duplicates:
+        print(f"Dropped {maintenance.drop_duplicate_files()} duplicate files.")
+    try:
+        ensure_db_indexes()
+    except OperationFailure as err:
+        if err.code != DUPLICATE_KEY_ERROR:
+            raise
+        duplicates = len(maintenance.find_duplicate_hashes())
+        if not duplicates:
+            raise
+        raise click.ClickException(
+            f"{duplicates} hashes are stored more than once; "
+            "rerun with --drop-duplicates to keep only the oldest copies."
+        )
+    print(f"Indexes ensured on '{mongo.db.name}'.")
+
+
+@click.command(name="reindex")
+@click.option(
+    "--workers",
+    default=os.cpu_count(),
+    show_default=True,
+    help="Worker processes indexing files in parallel.",
+)
+@click.option(
+    "--since",
+    default=None,
+    help="Only reindex files whose metadata _id is greater than this ObjectId. "
+    "Defaults to the checkpoint of the previous run.",
+)
+@click.option("--restart", is_flag=True, help="Ignore the saved checkpoint.")
+@click.option("--batch-size", default=500, show_default=True)
+@with_appcontext
+def reindex(workers, since, restart, batch_size):
+    if since:
+        since = ObjectId(since)
+    elif not restart:
+        since = maintenance.load_checkpoint()
+
+    total = mongo.db.files.count_documents(maintenance.reindex_query(since))
+    print(f"Reindexing {total} files with {workers} workers.")
+
+    done, failed, indexed = 0, 0, 0
+    checkpoint = since
+    started = time.monotonic()
+    deploy_env = os.getenv("FLASK_ENV", "Development")
+    with maintenance.index_pool(workers, deploy_env) as index:
+        for batch in maintenance.reindex_batches(since, batch_size):
+            results = index(file_id for _, file_id in batch)
+            for (doc_id, _), (file_id, size, error) in zip(batch, results):
+                done += 1
+                indexed += size
+                if error:
+                    failed += 1
+                    print(f"Failed to index {file_id}: {error}")
+                elif not failed:
+                    # The checkpoint stops before the first failure, so a
+                    # resumed run retries the files that failed.
+                    checkpoint = doc_id
+            if checkpoint is not None:
+                maintenance.save_checkpoint(checkpoint)
+
+            elapsed = time.monotonic() - started
+            print(
+                f"{done}/{total} files, {failed} failed, "
+                f"{indexed / 2**20 / elapsed:.1f} MiB/s, checkpoint {checkpoint}"
+            )
+    print(f"Reindexed {done - failed} files.")
+
+
+@click.command(name="verify-indexes")
+@with_appcontext
+def verify_indexes():
+    problems = maintenance.verify_indexes()
+    for problem in problems:
+        print(problem)
+    if problems:
+        raise SystemExit(1)
+    print(f"All files on '{mongo.db.name}' are indexed.")
+
+
+@click.command(name="ingest-worker")
+@click.option("--processes", default=1, show_default=True, help="Worker processes.")
+@click.option("--burst", is_flag=True, help="Exit once the job queue is empty.")
+@with_appcontext
+def ingest_worker(processes, burst):
+    if processes == 1:
+        worker.work(burst)
+        return
+
+    deploy_env = os.getenv("FLASK_ENV", "Development")
+    context = multiprocessing.get_context("spawn")
+    pool = [
+        context.Process(target=worker.run, args=(deploy_env, burst))
+        for _ in range(processes)
+    ]
+    for process in pool:
+        process.start()
+    for process in pool:
+        process.join()
@@ -2,18 +2,60 @@ from flask import current_app
 
 from flask_pymongo import PyMongo
 from gridfs import GridFS
+from pymongo import AsyncMongoClient
 
 
 mongo = PyMongo()
 fs = None
 
 
+class AsyncMongo:
+    """
+    Non-blocking MongoDB client of the ASGI app. It is opened when the app
+    starts serving and closed when it stops, as the client belongs to the
+    event loop it was first used on.
+    """
+
+    def __init__(self):
+        self.cx = None
+        self.db = None
+
+    def init_app(self, app):
+        self.cx = AsyncMongoClient(app.config["MONGO_URI"])
+        self.db = self.cx.get_default_database()
+
+    async def close(self):
+        if self.cx is not None:
+            await self.cx.close()
+        self.cx = self.db = None
+
+
+async_mongo = AsyncMongo()
+
+
 def init_db(app):
     # global fs
     mongo.init_app(app)
     # fs = GridFS(mongo.db)
 
 
+def ensure_indexes():
+    """
+    Create the indexes the file service relies on. Existing indexes are left
+    untouched, so this is safe to run on every startup.
+    """
+    mongo.db.files.create_index("hash", unique=True)
+    mongo.db.files.create_index(
+        "seq", unique=True, partialFilterExpression={"seq": {"$exists": True}}
+    )
+    mongo.db.files.create_index(
+        "line_start", partialFilterExpression={"line_count": {"$gt": 0}}
+    )
+    mongo.db.jobs.create_index([("status", 1), ("started_at", 1)])
+    mongo.db.trigrams.create_index([("gram", 1), ("file_id", 1)])
+    mongo.db.trigrams.create_index("file_id")
+
+
 # client = MongoClient(current_app.config.get("MONGO_URI"))
 # db = client["filemanager"]
 # fs = GridFS(db)
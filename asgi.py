@@ -0,0 +1,3 @@
+from app.asgi import create_asgi_app
+
+application = create_asgi_app()
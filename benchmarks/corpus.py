@@ -0,0 +1,73 @@
+import random
+
+ASCII_ALPHABET = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789     .,"
+UNICODE_ALPHABET = "áéíóúçãõßøåæœλμπσωжщыяあいうえお中文字😀🚀"
+
+
+def parse_distribution(spec):
+    """
+    Build a line-length sampler from a ``name:arg:arg`` spec.
+    Supported specs are ``uniform:MIN:MAX``, ``normal:MEAN:STDDEV`` and
+    ``lognormal:MU:SIGMA``; lengths are clamped at zero.
+    Args:
+        spec (str): The distribution spec.
+    Returns:
+        callable: Draws a line length from a ``random.Random``.
+    """
+    name, *args = spec.split(":")
+    args = [float(arg) for arg in args]
+    if name == "uniform":
+        return lambda rng: rng.randint(int(args[0]), int(args[1]))
+    if name == "normal":
+        return lambda rng: max(int(rng.gauss(args[0], args[1])), 0)
+    if name == "lognormal":
+        return lambda rng: int(rng.lognormvariate(args[0], args[1]))
+    raise ValueError(f"Unknown line length distribution: {spec}")
+
+
+def generate_file(rng, size, line_length, unicode_ratio):
+    """
+    Generate the content of one synthetic text file.
+    Args:
+        rng (random.Random): Source of randomness, seeded by the caller.
+        size (int): Approximate size of the file in bytes.
+        line_length (callable): Line-length sampler from parse_distribution.
+        unicode_ratio (float): Share of characters drawn from non-ASCII scripts.
+    Returns:
+        bytes: The UTF-8 encoded file content.
+    """
+    lines = []
+    written = 0
+    while written < size:
+        chars = [
+            (
+                rng.choice(UNICODE_ALPHABET)
+                if rng.random() < unicode_ratio
+                else rng.choice(ASCII_ALPHABET)
+            )
+            for _ in range(line_length(rng))
+        ]
+        line = ("".join(chars) + "\n").encode("utf-8")
+        lines.append(line)
+        written += len(line)
+    return b"".join(lines)
+
+
+def generate_corpus(seed, files, size, distribution, unicode_ratio):
+    """
+    Generate a reproducible corpus of synthetic text files.
+    Args:
+        seed (int): Seed for the random generator.
+        files (int): Number of files.
+        size (int): Approximate size of each file in bytes.
+        distribution (str): Line-length distribution spec.
+        unicode_ratio (float): Share of non-ASCII characters.
+    Yields:
+        tuple: The file name and content of each file.
+    """
+    rng = random.Random(seed)
+    line_length = parse_distribution(distribution)
+    for number in range(files):
+        yield f"corpus-{number:05d}.txt", generate_file(
+            rng, size, line_length, unicode_ratio
+        )
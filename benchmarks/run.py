@@ -0,0 +1,232 @@
+"""
+Benchmark the upload and line retrieval endpoints against synthetic corpora.
+
+    python -m benchmarks.run --scale 10x64KiB --scale 20x1MiB --output baseline.json
+    python -m benchmarks.run --compare baseline.json
+
+Requests go through the Flask test client, so routing, the service and the
+serialization are all measured. Without --mongo-uri an in-process mongomock
+database stands in for MongoDB; with it, the runs use (and drop) the
+``filemanager_benchmark`` database of that server.
+"""
+
+import io
+import json
+import platform
+import re
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+import click
+
+from benchmarks.corpus import generate_corpus
+
+BENCHMARK_DATABASE = "filemanager_benchmark"
+SIZE_UNITS = {"": 1, "B": 1, "KiB": 1024, "MiB": 1024**2, "GiB": 1024**3}
+ENDPOINTS = (
+    ("get_random_line", "/api/v1/file/line/random", {"Accept": "application/*"}),
+    ("get_random_line_backward", "/api/v1/file/line/random-backward", {}),
+    ("get_longest_lines", "/api/v1/file/longest?number=100", {}),
+    (
+        "get_longest_lines_single_file",
+        "/api/v1/file/longest?number=100&single=true",
+        {},
+    ),
+)
+
+
+def parse_scale(value):
+    """
+    Parse a ``FILESxSIZE`` scale point such as ``50x1MiB``.
+    Returns:
+        tuple: The number of files and the size of each file in bytes.
+    """
+    match = re.fullmatch(r"(\d+)x(\d+)(B|KiB|MiB|GiB)?", value)
+    if not match:
+        raise click.BadParameter(f"Expected FILESxSIZE, e.g. 50x1MiB, got {value}")
+    files, size, unit = match.groups()
+    return int(files), int(size) * SIZE_UNITS[unit or ""]
+
+
+def summarize(latencies, total_bytes=None):
+    """
+    Summarize the latencies of one operation.
+    Args:
+        latencies (list): Latency of every call, in seconds.
+        total_bytes (int): Bytes processed by all calls, if relevant.
+    Returns:
+        dict: Call count, throughput and p50/p99 latencies in milliseconds.
+    """
+    elapsed = sum(latencies)
+    result = {
+        "calls": len(latencies),
+        "ops_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": (
+            statistics.quantiles(latencies, n=100)[98] * 1000
+            if len(latencies) > 1
+            else latencies[0] * 1000
+        ),
+    }
+    if total_bytes is not None:
+        result["mb_per_sec"] = total_bytes / 1024**2 / elapsed if elapsed else 0.0
+    return result
+
+
+def build_app(mongo_uri):
+    from app import create_app
+    from app.api.file.cache import file_cache
+    from app.db import mongo
+
+    app = create_app("Testing")
+    if mongo_uri:
+        from pymongo import MongoClient
+
+        from app.api.metrics.instrumentation import command_timer
+
+        mongo.cx = MongoClient(mongo_uri, event_listeners=[command_timer])
+    else:
+        import mongomock
+        import mongomock.gridfs
+
+        mongomock.gridfs.enable_gridfs_integration()
+        mongo.cx = mongomock.MongoClient()
+    mongo.db = mongo.cx[BENCHMARK_DATABASE]
+    return app, mongo, file_cache
+
+
+def run_scale(app, mongo, file_cache, files, size, options):
+    from app.api.file.response_cache import response_cache
+    from app.db import ensure_indexes
+
+    mongo.cx.drop_database(BENCHMARK_DATABASE)
+    file_cache.clear()
+    response_cache.clear()
+    ensure_indexes()
+    client = app.test_client()
+
+    upload_latencies = []
+    total_bytes = 0
+    corpus = generate_corpus(
+        options["seed"], files, size, options["distribution"], options["unicode_ratio"]
+    )
+    for name, content in corpus:
+        start = time.perf_counter()
+        response = client.post(
+            "/api/v1/file/upload", data={"file": (io.BytesIO(content), name)}
+        )
+        upload_latencies.append(time.perf_counter() - start)
+        if response.status_code != 201:
+            raise click.ClickException(f"Upload of {name} failed: {response.json}")
+        total_bytes += len(content)
+
+    results = {"process": summarize(upload_latencies, total_bytes)}
+    for operation, url, headers in ENDPOINTS:
+        latencies = []
+        for _ in range(options["requests"]):
+            start = time.perf_counter()
+            response = client.get(url, headers=headers)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise click.ClickException(f"{operation} failed: {response.data!r}")
+        results[operation] = summarize(latencies)
+    return results
+
+
+def compare(baseline, current, tolerance):
+    """
+    Print the latency change of every operation measured in both runs.
+    Returns:
+        bool: Whether any p50 latency regressed by more than ``tolerance``.
+    """
+    regressed = False
+    for scale, operations in current["results"].items():
+        for operation, result in operations.items():
+            previous = baseline["results"].get(scale, {}).get(operation)
+            if not previous:
+                continue
+            ratio = result["p50_ms"] / previous["p50_ms"]
+            flag = "REGRESSION" if ratio > 1 + tolerance else ""
+            regressed = regressed or bool(flag)
+            click.echo(
+                f"{scale:>12} {operation:<30} p50 {previous['p50_ms']:9.2f} -> "
+                f"{result['p50_ms']:9.2f} ms ({ratio:5.2f}x) "
+                f"p99 {previous['p99_ms']:9.2f} -> {result['p99_ms']:9.2f} ms {flag}"
+            )
+    return regressed
+
+
+@click.command()
+@click.option(
+    "--scale",
+    "scales",
+    multiple=True,
+    default=("10x64KiB", "20x1MiB"),
+    show_default=True,
+    help="Scale point as FILESxSIZE; repeat for several.",
+)
+@click.option("--requests", default=200, show_default=True, help="Calls per endpoint.")
+@click.option(
+    "--distribution",
+    default="lognormal:3.5:0.8",
+    show_default=True,
+    help="Line length distribution: uniform:MIN:MAX, normal:MEAN:SD or lognormal:MU:SIGMA.",
+)
+@click.option(
+    "--unicode-ratio",
+    default=0.1,
+    show_default=True,
+    help="Share of non-ASCII characters in the generated text.",
+)
+@click.option("--seed", default=0, show_default=True)
+@click.option("--mongo-uri", default=None, help="Benchmark a real mongod instead.")
+@click.option("--output", type=click.Path(dir_okay=False), help="Write results here.")
+@click.option(
+    "--compare",
+    "baseline_path",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Baseline JSON to compare the results against.",
+)
+@click.option(
+    "--tolerance",
+    default=0.2,
+    show_default=True,
+    help="Allowed p50 slowdown before a comparison fails.",
+)
+def main(scales, mongo_uri, output, baseline_path, tolerance, **options):
+    app, mongo, file_cache = build_app(mongo_uri)
+
+    results = {}
+    for scale in scales:
+        files, size = parse_scale(scale)
+        click.echo(f"Running {scale} ({files} files of {size} bytes)...")
+        results[scale] = run_scale(app, mongo, file_cache, files, size, options)
+        for operation, result in results[scale].items():
+            click.echo(
+                f"  {operation:<30} {result['ops_per_sec']:10.1f} ops/s "
+                f"p50 {result['p50_ms']:8.2f} ms p99 {result['p99_ms']:8.2f} ms"
+            )
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "backend": "mongod" if mongo_uri else "mongomock",
+        "options": dict(options, scales=list(scales)),
+        "results": results,
+    }
+    if output:
+        with open(output, "w") as file:
+            json.dump(report, file, indent=2)
+        click.echo(f"Results written to {output}")
+
+    if baseline_path:
+        with open(baseline_path) as file:
+            baseline = json.load(file)
+        if compare(baseline, report, tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
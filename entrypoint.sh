@@ -7,4 +7,11 @@ done
 
 echo "Database started"
 
-uwsgi --http-socket 0.0.0.0:5000 --wsgi-file wsgi.py --callable application --processes 4
\ No newline at end of file
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}"
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+if [ "$SERVER_MODE" = "asgi" ]; then
+  uvicorn asgi:application --host 0.0.0.0 --port 5000 --workers 4
+else
+  uwsgi --http-socket 0.0.0.0:5000 --wsgi-file wsgi.py --callable application --processes 4
+fi
\ No newline at end of file
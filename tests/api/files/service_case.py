@@ -0,0 +1,42 @@
+import io
+import unittest
+
+import mongomock
+import mongomock.gridfs
+from flask import Flask
+from werkzeug.datastructures import FileStorage
+
+from app.api.file.cache import file_cache
+from app.api.file.service import TextFileService
+from app.db import ensure_indexes, mongo
+
+mongomock.gridfs.enable_gridfs_integration()
+
+
+class ServiceTestCase(unittest.TestCase):
+    """
+    Run the file service against an in-memory MongoDB, fresh for every test.
+    """
+
+    config = {}
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config.from_object("app.config.TestingConfig")
+        self.app.config.update(self.config)
+        context = self.app.app_context()
+        context.push()
+        self.addCleanup(context.pop)
+
+        client = mongomock.MongoClient()
+        previous = mongo.cx, mongo.db
+        mongo.cx, mongo.db = client, client.filemanager
+        self.addCleanup(setattr, mongo, "cx", previous[0])
+        self.addCleanup(setattr, mongo, "db", previous[1])
+
+        ensure_indexes()
+        file_cache.init_app(self.app)
+        self.service = TextFileService()
+
+    def upload(self, content, filename="file.txt"):
+        return self.service.process(FileStorage(io.BytesIO(content), filename=filename))
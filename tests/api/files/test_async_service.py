@@ -0,0 +1,194 @@
+import asyncio
+import io
+import unittest
+
+from werkzeug.datastructures import FileStorage
+
+from app.api.file.async_service import AsyncTextFileService
+from app.api.file.exceptions import NoContentFound
+from app.db import async_mongo, mongo
+from tests.api.files.service_case import ServiceTestCase
+
+
+class AsyncCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self.cursor = self.cursor.sort(*args, **kwargs)
+        return self
+
+    async def to_list(self, length=None):
+        return list(self.cursor)
+
+    async def __aiter__(self):
+        for doc in self.cursor:
+            yield doc
+
+
+class AsyncCollection:
+    """
+    Serve a mongomock collection through the awaitable API of AsyncMongoClient.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return AsyncCollection(self.collection[name])
+
+    async def find_one(self, *args, **kwargs):
+        return self.collection.find_one(*args, **kwargs)
+
+    async def count_documents(self, *args, **kwargs):
+        return self.collection.count_documents(*args, **kwargs)
+
+    async def distinct(self, *args, **kwargs):
+        return self.collection.distinct(*args, **kwargs)
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self.collection.find(*args, **kwargs))
+
+    async def aggregate(self, *args, **kwargs):
+        return AsyncCursor(self.collection.aggregate(*args, **kwargs))
+
+
+class AsyncDatabase:
+    def __init__(self, db):
+        self.db = db
+
+    def __getattr__(self, name):
+        return AsyncCollection(self.db[name])
+
+    __getitem__ = __getattr__
+
+
+class AsyncServiceTestCase(ServiceTestCase):
+    """
+    Run AsyncTextFileService against the in-memory MongoDB of ServiceTestCase,
+    so its answers can be compared with those of TextFileService.
+    """
+
+    def setUp(self):
+        super().setUp()
+        previous = async_mongo.db
+        async_mongo.db = AsyncDatabase(mongo.db)
+        self.addCleanup(setattr, async_mongo, "db", previous)
+        self.async_service = AsyncTextFileService(self.app)
+
+    def run_async(self, awaitable):
+        return asyncio.run(awaitable)
+
+    def collect(self, items):
+        async def collect():
+            return [item async for item in items]
+
+        return asyncio.run(collect())
+
+
+class TestAsyncReads(AsyncServiceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.first = self.upload(b"first line\nab\n", "first.txt")
+        self.last = self.upload(
+            b"".join(b"line %d\n" % n for n in range(30)), "last.txt"
+        )
+
+    def test_reads_latest_file(self):
+        doc = self.run_async(self.async_service.get_last_file_metadata())
+
+        self.assertEqual(doc["filename"], "last.txt")
+        self.assertEqual(
+            self.run_async(self.async_service.get_version()),
+            self.service.get_version(),
+        )
+
+    def test_reads_lines_like_the_sync_service(self):
+        file_id = self.last["file_id"]
+
+        self.assertEqual(
+            self.run_async(self.async_service.get_lines(file_id, [29, 0, 7])),
+            self.service.get_lines(file_id, [29, 0, 7]),
+        )
+        doc = mongo.db.files.find_one({"file_id": file_id})
+        self.assertEqual(
+            self.collect(self.async_service.iter_line_window(doc, 25, 10)),
+            list(self.service.iter_line_window(doc, 25, 10)),
+        )
+        self.assertEqual(
+            self.run_async(self.async_service.get_letter_stats(doc)),
+            self.service.get_letter_stats(doc),
+        )
+
+    def test_draws_random_lines(self):
+        texts = {"line %d" % n for n in range(30)}
+
+        lines = self.run_async(self.async_service.get_random_lines(5))
+        self.assertTrue({line["text"] for line in lines} <= texts)
+        self.assertTrue(all("most_frequent_letter" in line for line in lines))
+
+        backward = self.run_async(self.async_service.get_random_lines_backward(5))
+        self.assertTrue(
+            {line[::-1] for line in backward} <= texts | {"first line", "ab"}
+        )
+
+    def test_draws_each_corpus_line_once_without_replacement(self):
+        lines = self.run_async(
+            self.async_service.get_random_corpus_lines(40, replace=False)
+        )
+
+        self.assertEqual(
+            sorted((line["file_name"], line["line"]) for line in lines),
+            [("first.txt", 0), ("first.txt", 1)]
+            + sorted(("last.txt", n) for n in range(30)),
+        )
+
+    def test_selects_longest_lines_like_the_sync_service(self):
+        self.assertEqual(
+            self.run_async(self.async_service.get_longest_lines(3)),
+            self.service.get_longest_lines(3),
+        )
+        self.assertEqual(
+            self.run_async(self.async_service.get_longest_lines_single_file(3)),
+            self.service.get_longest_lines_single_file(3),
+        )
+
+    def test_searches_like_the_sync_service(self):
+        self.assertEqual(
+            self.collect(self.async_service.iter_search("line 1", 5)),
+            list(self.service.iter_search("line 1", 5)),
+        )
+
+
+class TestAsyncPendingReads(AsyncServiceTestCase):
+    def test_reports_no_content_without_files(self):
+        with self.assertRaises(NoContentFound):
+            self.run_async(self.async_service.get_last_file_metadata())
+        with self.assertRaises(NoContentFound):
+            self.run_async(self.async_service.get_random_file_metadata())
+
+    def test_reads_pending_files_through_the_sync_service(self):
+        file_id = self.service.process_async(
+            FileStorage(io.BytesIO(b"abc\nlonger line\n"), filename="a.txt")
+        )["file_id"]
+        doc = mongo.db.files.find_one({"file_id": file_id})
+
+        self.assertEqual(
+            self.collect(self.async_service.iter_line_window(doc, 1, 5)),
+            [{"line": 1, "text": "longer line"}],
+        )
+        self.assertEqual(
+            [
+                line["text"]
+                for line in self.run_async(self.async_service.get_longest_lines(2))
+            ],
+            ["longer line", "abc"],
+        )
+        self.assertEqual(
+            self.collect(self.async_service.iter_search("abc", 5)),
+            [{"file_id": file_id, "line": 0, "text": "abc"}],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
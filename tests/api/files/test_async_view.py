@@ -0,0 +1,244 @@
+import importlib.util
+import json
+import unittest
+from http import HTTPStatus
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from flask import Flask
+
+from app.api.file.exceptions import FileNotFound, NoContentFound
+from app.api.file.response_cache import response_cache
+
+ASGI_AVAILABLE = all(
+    importlib.util.find_spec(name) for name in ("starlette", "httpx", "a2wsgi")
+)
+
+if ASGI_AVAILABLE:
+    from starlette.applications import Starlette
+    from starlette.testclient import TestClient
+
+    from app.api.file.async_view import routes
+
+
+async def iterate(items):
+    for item in items:
+        yield item
+
+
+@unittest.skipUnless(ASGI_AVAILABLE, "the asgi extra is not installed")
+class TestAsyncFileViews(unittest.TestCase):
+    def setUp(self):
+        app = Starlette(routes=routes)
+        app.state.flask_app = Flask(__name__)
+        self.client = TestClient(app)
+        patcher = patch("app.api.file.async_view.AsyncTextFileService")
+        self.service = patcher.start().return_value = AsyncMock()
+        self.addCleanup(patcher.stop)
+
+    def test_random_line_text(self):
+        self.service.get_random_line.return_value = {"line": 0, "text": "hello"}
+
+        response = self.client.get(
+            "/api/v1/file/line/random", headers={"Accept": "text/plain"}
+        )
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.text, "hello")
+        self.assertEqual(response.headers["content-type"], "text/plain; charset=utf-8")
+
+    def test_random_line_corpus_count(self):
+        self.service.get_random_corpus_lines.return_value = [{"line": 0, "text": "a"}]
+
+        response = self.client.get(
+            "/api/v1/file/line/random?scope=all&count=1&replace=false",
+            headers={"Accept": "application/*"},
+        )
+
+        self.assertEqual(response.json(), [{"line": 0, "text": "a"}])
+        self.service.get_random_corpus_lines.assert_awaited_once_with(1, False)
+
+    def test_random_line_unknown_scope(self):
+        response = self.client.get("/api/v1/file/line/random?scope=some")
+
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(response.json(), {"error": "Unknown scope: some"})
+
+    def test_random_line_backward(self):
+        self.service.get_random_line_backward.return_value = "olleh"
+
+        response = self.client.get("/api/v1/file/line/random-backward")
+
+        self.assertEqual(response.json(), {"line": "olleh"})
+
+    def test_longest_lines_stream(self):
+        lines = [{"line": 3, "text": "bb"}, {"line": 1, "text": "a"}]
+        self.service.iter_longest_lines = MagicMock(return_value=iterate(lines))
+
+        response = self.client.get("/api/v1/file/longest?number=2&stream=true")
+
+        self.assertEqual(response.headers["content-type"], "application/x-ndjson")
+        self.assertEqual(
+            [json.loads(line) for line in response.text.splitlines()], lines
+        )
+        self.service.iter_longest_lines.assert_called_once_with(2)
+
+    def test_longest_lines_single_file(self):
+        lines = [{"line": 3, "text": "bb"}]
+        self.service.iter_longest_lines_single_file = MagicMock(
+            return_value=iterate(lines)
+        )
+
+        response = self.client.get("/api/v1/file/longest?number=1&single=true")
+
+        self.assertEqual(response.json(), lines)
+        self.service.iter_longest_lines_single_file.assert_called_once_with(1)
+
+    def test_longest_lines_invalid_number(self):
+        response = self.client.get("/api/v1/file/longest?number=-1")
+
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_search(self):
+        match = {"file_id": "1", "line": 0, "text": "hello"}
+        self.service.iter_search = lambda query, limit: iterate([match])
+
+        response = self.client.get("/api/v1/file/search?q=hel")
+
+        self.assertEqual(json.loads(response.text), match)
+
+    def test_search_short_query(self):
+        def iter_search(query, limit):
+            raise ValueError("q must be at least 3 bytes long in UTF-8")
+
+        self.service.iter_search = iter_search
+
+        response = self.client.get("/api/v1/file/search?q=he")
+
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_file_lines(self):
+        self.service.get_file_metadata.return_value = {"file_id": "1"}
+        self.service.iter_line_window = lambda doc, start, count: iterate(
+            [{"line": 5, "text": "x"}]
+        )
+
+        response = self.client.get("/api/v1/file/1/lines?start=5&count=1")
+
+        self.assertEqual(
+            response.json(),
+            {"file_id": "1", "start": 5, "lines": [{"line": 5, "text": "x"}]},
+        )
+
+    def test_file_lines_not_found(self):
+        self.service.get_file_metadata.side_effect = FileNotFound("No file found")
+
+        response = self.client.get("/api/v1/file/1/lines")
+
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertEqual(response.json(), {"error": "No file found"})
+
+    def test_file_lines_of_latest_without_files(self):
+        self.service.get_file_metadata.side_effect = NoContentFound("No files")
+
+        response = self.client.get("/api/v1/file/latest/lines")
+
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertEqual(response.json(), {"error": "No files"})
+
+    def test_file_letters(self):
+        self.service.get_file_metadata.return_value = {"file_id": "1"}
+        self.service.get_letter_stats.return_value = {"letters": {"a": 1}}
+
+        response = self.client.get("/api/v1/file/1/letters")
+
+        self.assertEqual(response.json(), {"letters": {"a": 1}})
+
+    def test_file_letters_of_latest_without_files(self):
+        self.service.get_file_metadata.side_effect = NoContentFound("No files")
+
+        response = self.client.get("/api/v1/file/latest/letters")
+
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertEqual(response.json(), {"error": "No files"})
+
+
+@unittest.skipUnless(ASGI_AVAILABLE, "the asgi extra is not installed")
+class TestAsyncCachedViews(unittest.TestCase):
+    def setUp(self):
+        app = Starlette(routes=routes)
+        app.state.flask_app = Flask(__name__)
+        app.state.flask_app.config.update(
+            RESPONSE_CACHE_ENABLED=True,
+            RESPONSE_CACHE_MAX_AGE=0,
+            RESPONSE_CACHE_MAX_BYTES=1024,
+            RESPONSE_CACHE_DIR=None,
+            RESPONSE_CACHE_DIR_MAX_BYTES=1024,
+        )
+        response_cache.init_app(app.state.flask_app)
+        self.client = TestClient(app)
+        patcher = patch("app.api.file.async_view.AsyncTextFileService")
+        self.service = patcher.start().return_value = AsyncMock()
+        self.addCleanup(patcher.stop)
+        self.service.get_version.return_value = ("epoch", 1)
+        self.service.get_file_metadata.return_value = {"file_id": "1"}
+        self.service.get_letter_stats.return_value = {"letters": {"a": 1}}
+
+    def test_serves_repeated_requests_from_the_cache(self):
+        first = self.client.get("/api/v1/file/1/letters")
+        second = self.client.get("/api/v1/file/1/letters")
+
+        self.assertEqual(second.json(), {"letters": {"a": 1}})
+        self.assertEqual(second.headers["ETag"], first.headers["ETag"])
+        self.assertEqual(second.headers["Cache-Control"], "no-cache")
+        self.assertEqual(second.headers["Vary"], "Accept")
+        self.service.get_letter_stats.assert_awaited_once()
+
+    def test_tags_responses_like_the_sync_app(self):
+        response = self.client.get(
+            "/api/v1/file/1/letters?b=2&a=1", headers={"Accept": "application/json"}
+        )
+
+        key = response_cache.key(
+            ("epoch", 1),
+            "/api/v1/file/1/letters",
+            [("b", "2"), ("a", "1")],
+            "application/json",
+        )
+        self.assertEqual(response.headers["ETag"], f'"{key}"')
+
+    def test_not_modified(self):
+        etag = self.client.get("/api/v1/file/1/letters").headers["ETag"]
+
+        response = self.client.get(
+            "/api/v1/file/1/letters", headers={"If-None-Match": etag}
+        )
+
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(response.headers["ETag"], etag)
+        self.service.get_letter_stats.assert_awaited_once()
+
+    def test_streamed_responses_are_revalidated_but_not_stored(self):
+        match = {"file_id": "1", "line": 0, "text": "hello"}
+        self.service.iter_search = MagicMock(
+            side_effect=lambda query, limit: iterate([match])
+        )
+
+        first = self.client.get("/api/v1/file/search?q=hel")
+        second = self.client.get("/api/v1/file/search?q=hel")
+
+        self.assertEqual(json.loads(second.text), match)
+        self.assertEqual(second.headers["ETag"], first.headers["ETag"])
+        self.assertEqual(self.service.iter_search.call_count, 2)
+
+    def test_errors_are_not_cached(self):
+        self.service.get_file_metadata.side_effect = FileNotFound("No file found")
+
+        response = self.client.get("/api/v1/file/1/letters")
+
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertNotIn("ETag", response.headers)
+        self.assertEqual(response_cache.memory.stats()["entries"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from app.api.file.cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_evicts_least_recently_used_when_over_budget(self):
+        cache = LRUCache(max_bytes=6)
+        cache.put("a", b"aaa")
+        cache.put("b", b"bbb")
+        cache.get("a")
+        cache.put("c", b"ccc")
+
+        self.assertEqual(cache.get("a"), b"aaa")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), b"ccc")
+        self.assertEqual(cache.size, 6)
+
+    def test_counts_hits_misses_and_evictions(self):
+        cache = LRUCache(max_bytes=4)
+        cache.put("a", b"aaa")
+        cache.get("a")
+        cache.get("b")
+        cache.put("b", b"bbb")
+
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["entries"], 1)
+
+    def test_skips_values_larger_than_budget(self):
+        cache = LRUCache(max_bytes=2)
+        cache.put("a", b"aaa")
+
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.size, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+from unittest.mock import patch
+
+from app.api.file import compression
+from app.api.file.compression import (
+    FrameWriter,
+    GzipCodec,
+    frame_bounds,
+    get_codec,
+    iter_decompressed,
+    unpack_frames,
+)
+
+
+class TestFrameWriter(unittest.TestCase):
+    def compress(self, data, frame_size, pieces=3):
+        stored = bytearray()
+        writer = FrameWriter(GzipCodec(), frame_size, stored.extend)
+        step = max(1, len(data) // pieces)
+        for start in range(0, len(data), step):
+            writer.feed(data[start : start + step])
+        writer.close()
+        return bytes(stored), unpack_frames(writer.layout()["frames"])
+
+    def test_frames_hold_fixed_uncompressed_sizes(self):
+        data = bytes(range(256)) * 10
+        stored, ends = self.compress(data, 1000)
+
+        self.assertEqual(len(ends), 3)
+        self.assertEqual(ends[-1], len(stored))
+        codec = GzipCodec()
+        for n in range(len(ends)):
+            start, end = frame_bounds(ends, n)
+            frame = codec.decompress(stored[start:end])
+            self.assertEqual(frame, data[n * 1000 : (n + 1) * 1000])
+
+    def test_iter_decompressed_accepts_any_piece_sizes(self):
+        data = b"line of text\n" * 500
+        stored, ends = self.compress(data, 512)
+        pieces = [stored[i : i + 7] for i in range(0, len(stored), 7)]
+
+        self.assertEqual(b"".join(iter_decompressed(GzipCodec(), ends, pieces)), data)
+
+    def test_empty_content_has_no_frames(self):
+        stored, ends = self.compress(b"", 512)
+
+        self.assertEqual(stored, b"")
+        self.assertEqual(len(ends), 0)
+
+
+class TestGetCodec(unittest.TestCase):
+    def test_none_disables_compression(self):
+        self.assertIsNone(get_codec("none"))
+        self.assertIsNone(get_codec(None))
+
+    @patch.object(compression, "zstandard", None)
+    def test_zstd_falls_back_to_gzip_for_writing_only(self):
+        self.assertEqual(get_codec("zstd").name, "gzip")
+        with self.assertRaises(ValueError):
+            get_codec("zstd", fallback=False)
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            get_codec("lz4")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+from app.api.file.indexes import LineIndexer, decode_line
+
+
+class TestLineIndexer(unittest.TestCase):
+    def build(self, chunks, top_k=0):
+        indexer = LineIndexer(top_k=top_k)
+        for chunk in chunks:
+            indexer.feed(chunk)
+        indexer.close()
+        return indexer
+
+    def test_offsets_match_line_starts(self):
+        indexer = self.build([b"first\nsec", b"ond\n\nlast"])
+
+        self.assertEqual(list(indexer.offsets), [0, 6, 13, 14, 18])
+        self.assertEqual(indexer.line_count, 4)
+
+    def test_trailing_newline_does_not_add_a_line(self):
+        indexer = self.build([b"one\ntwo\n"])
+
+        self.assertEqual(list(indexer.offsets), [0, 4, 8])
+        self.assertEqual(indexer.line_count, 2)
+
+    def test_empty_file_has_no_lines(self):
+        indexer = self.build([b""])
+
+        self.assertEqual(list(indexer.offsets), [0])
+        self.assertEqual(indexer.line_count, 0)
+
+    def test_longest_lines_are_bounded_and_ordered(self):
+        indexer = self.build([b"aa\nbbbb\nc\ndd", b"dddd\nee\n"], top_k=3)
+
+        self.assertEqual(
+            indexer.longest(),
+            [
+                {"line": 3, "text": "dddddd", "length": 6},
+                {"line": 1, "text": "bbbb", "length": 4},
+                {"line": 0, "text": "aa", "length": 2},
+            ],
+        )
+
+    def test_longest_lines_count_characters(self):
+        indexer = self.build(["ééé\nabcd\n".encode("utf-8")], top_k=1)
+
+        self.assertEqual(indexer.longest()[0]["text"], "abcd")
+
+
+class TestDecodeLine(unittest.TestCase):
+    def test_strips_line_break(self):
+        self.assertEqual(decode_line(b"text\r\n"), "text")
+        self.assertEqual(decode_line(b"text"), "text")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+from app.api.file.indexes import LineIndexer
+from app.api.file.letters import LetterIndexer, most_frequent_letter
+
+
+class TestMostFrequentLetter(unittest.TestCase):
+    def test_counts_letters_case_insensitively(self):
+        self.assertEqual(most_frequent_letter("aB b, 1b"), "b")
+        self.assertEqual(most_frequent_letter(b"aB b, 1b"), "b")
+
+    def test_ties_go_to_the_first_letter(self):
+        self.assertEqual(most_frequent_letter("ba ab"), "b")
+
+    def test_counts_unicode_letters(self):
+        self.assertEqual(most_frequent_letter("Éé a"), "é")
+        self.assertEqual(most_frequent_letter("Éé a".encode()), "é")
+
+    def test_without_letters(self):
+        self.assertIsNone(most_frequent_letter("123 !"))
+        self.assertIsNone(most_frequent_letter(b""))
+
+
+class TestLetterIndexer(unittest.TestCase):
+    def test_codes_and_stats(self):
+        indexer = LetterIndexer()
+        for raw in [b"Hello", b"", "été".encode(), b"zzZ a", b"hi"]:
+            indexer.add(raw)
+
+        self.assertEqual(indexer.alphabet, ["l", "é", "z", "h"])
+        self.assertEqual(list(indexer.codes), [1, 0, 2, 3, 4])
+        self.assertEqual(
+            indexer.stats(),
+            {
+                "letters": {
+                    "z": 3,
+                    "l": 2,
+                    "h": 2,
+                    "é": 2,
+                    "e": 1,
+                    "o": 1,
+                    "a": 1,
+                    "i": 1,
+                    "t": 1,
+                },
+                "most_frequent": {"l": 1, "é": 1, "z": 1, "h": 1},
+                "lines_without_letters": 1,
+            },
+        )
+
+    def test_widens_codes_for_large_alphabets(self):
+        indexer = LetterIndexer()
+        letters = [chr(0x4E00 + n) for n in range(300)]
+        for letter in letters:
+            indexer.add(letter.encode())
+
+        self.assertEqual(indexer.codes.typecode, "H")
+        self.assertEqual(
+            [indexer.alphabet[code - 1] for code in indexer.codes], letters
+        )
+
+    def test_line_indexer_records_letters(self):
+        indexer = LineIndexer(letters=True)
+        indexer.feed(b"ab\r\nc")
+        indexer.feed(b"cc\n\n")
+        indexer.close()
+
+        self.assertEqual(indexer.letters.alphabet, ["a", "c"])
+        self.assertEqual(list(indexer.letters.codes), [1, 2, 0])
@@ -0,0 +1,109 @@
+import io
+import unittest
+
+from bson.objectid import ObjectId
+
+from app.api.file import maintenance
+from app.commands import reindex
+from app.db import ensure_indexes, mongo
+from tests.api.files.service_case import ServiceTestCase
+
+
+class TestDropDuplicateFiles(ServiceTestCase):
+    def setUp(self):
+        super().setUp()
+        # Only files uploaded before the unique index existed are duplicated.
+        mongo.db.files.drop_index("hash_1")
+        self.first = self.upload(b"a rather long line\nshort\n", "first.txt")
+        self.copy = self.upload(b"a rather long line\nshort\n", "copy.txt")
+        self.last = self.upload(b"last\n", "last.txt")
+
+    def test_drops_newer_copies(self):
+        self.assertEqual(maintenance.drop_duplicate_files(), 1)
+
+        self.assertEqual(
+            [doc["filename"] for doc in mongo.db.files.find().sort("_id", 1)],
+            ["first.txt", "last.txt"],
+        )
+        self.assertIsNone(
+            mongo.db.longest_lines.find_one({"_id": self.copy["file_id"]})
+        )
+
+    def test_renumbers_remaining_files(self):
+        maintenance.drop_duplicate_files()
+
+        docs = list(mongo.db.files.find().sort("_id", 1))
+        self.assertEqual([doc["seq"] for doc in docs], [1, 2])
+        self.assertEqual([doc["line_start"] for doc in docs], [0, 2])
+        counter = mongo.db.counters.find_one({"_id": "files"})
+        self.assertEqual((counter["seq"], counter["lines"]), (2, 3))
+
+    def test_rebuilds_corpus_longest_lines(self):
+        maintenance.drop_duplicate_files()
+
+        self.assertEqual(
+            [
+                (line["file_id"], line["text"])
+                for line in self.service.get_longest_lines(3)
+            ],
+            [
+                (self.first["file_id"], "a rather long line"),
+                (self.first["file_id"], "short"),
+                (self.last["file_id"], "last"),
+            ],
+        )
+
+    def test_leaves_consistent_indexes(self):
+        maintenance.drop_duplicate_files()
+        ensure_indexes()
+
+        self.assertEqual(maintenance.verify_indexes(), [])
+
+
+class TestReindex(ServiceTestCase):
+    def store_legacy(self, content):
+        metadata, layout = self.service._store_blob("legacy.txt", io.BytesIO(content))
+        return mongo.db.files.insert_one(dict(metadata, **layout)).inserted_id
+
+    def store_broken(self):
+        # Metadata whose content is missing cannot be indexed.
+        return mongo.db.files.insert_one(
+            {"filename": "broken.txt", "hash": "broken", "file_id": str(ObjectId())}
+        ).inserted_id
+
+    def reindex(self):
+        result = self.app.test_cli_runner().invoke(
+            reindex, ["--workers", "1", "--restart"]
+        )
+        self.assertEqual(result.exit_code, 0, result.output)
+
+    def test_saves_checkpoint_after_last_file(self):
+        self.store_legacy(b"one\n")
+        last = self.store_legacy(b"two\n")
+
+        self.reindex()
+
+        self.assertEqual(maintenance.load_checkpoint(), last)
+        self.assertEqual(mongo.db.files.count_documents(maintenance.reindex_query()), 0)
+
+    def test_keeps_checkpoint_before_failed_file(self):
+        first = self.store_legacy(b"one\n")
+        broken = self.store_broken()
+        self.store_legacy(b"two\n")
+
+        self.reindex()
+
+        self.assertEqual(maintenance.load_checkpoint(), first)
+        self.assertEqual(
+            [
+                doc["_id"]
+                for doc in mongo.db.files.find(
+                    maintenance.reindex_query(maintenance.load_checkpoint())
+                )
+            ],
+            [broken],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
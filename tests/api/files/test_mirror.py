@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from flask import Flask
+
+from app.api.file.mirror import FileMirror
+
+
+class TestFileMirror(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config.update(
+            FILE_MIRROR_DIR=self.directory.name,
+            FILE_MIRROR_MAX_BYTES=10,
+            FILE_MIRROR_MIN_READS=2,
+        )
+        self.mirror = FileMirror()
+        self.mirror.init_app(self.app)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self, file_id, content):
+        with self.mirror.open("fs", file_id, lambda: iter([content])) as view:
+            return None if view is None else view.tobytes()
+
+    def test_copies_file_once_it_is_hot(self):
+        self.assertIsNone(self.read("a", b"hello"))
+        self.assertEqual(self.read("a", b"hello"), b"hello")
+        self.assertEqual(os.listdir(self.directory.name), ["fs.a"])
+
+    def test_evicts_least_recently_read_copies(self):
+        for _ in range(2):
+            self.read("a", b"aaaaaa")
+        for _ in range(2):
+            self.read("b", b"bbbbbb")
+
+        self.assertEqual(os.listdir(self.directory.name), ["fs.b"])
+
+    def test_reads_copy_evicted_by_another_worker(self):
+        self.read("a", b"hello")
+        self.read("a", b"hello")
+
+        def open_then_evict(path, mode):
+            file = open(path, mode)
+            os.unlink(path)
+            return file
+
+        with patch("app.api.file.mirror.open", open_then_evict, create=True):
+            self.assertEqual(self.read("a", b"hello"), b"hello")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import os
+import tempfile
+import unittest
+from http import HTTPStatus
+from unittest.mock import patch
+
+from flask import Flask
+from flask_restx import Api
+
+from app.api.file.response_cache import ResponseCache, response_cache
+from app.api.file.view import ns
+
+
+def make_app(directory=None):
+    app = Flask(__name__)
+    app.config.update(
+        RESPONSE_CACHE_ENABLED=True,
+        RESPONSE_CACHE_MAX_AGE=0,
+        RESPONSE_CACHE_MAX_BYTES=1024,
+        RESPONSE_CACHE_DIR=directory,
+        RESPONSE_CACHE_DIR_MAX_BYTES=1024,
+    )
+    return app
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.cache = ResponseCache()
+        self.cache.init_app(make_app(self.directory.name))
+
+    def test_shares_entries_through_the_directory(self):
+        self.cache.put(1, "key", "application/json", b"[]")
+        other = ResponseCache()
+        other.init_app(make_app(self.directory.name))
+
+        self.assertEqual(other.get(1, "key"), ("application/json", b"[]"))
+        self.assertIsNone(other.get(1, "other"))
+
+    def test_drops_entries_of_older_generations(self):
+        self.cache.put(1, "old", "application/json", b"[]")
+        self.cache.put(2, "new", "application/json", b"[]")
+
+        self.assertEqual(os.listdir(self.directory.name), ["2.new"])
+
+    def test_keeps_the_directory_under_budget(self):
+        self.cache.put(1, "first", "application/json", b"x" * 600)
+        self.cache.put(1, "second", "application/json", b"x" * 600)
+
+        self.assertEqual(os.listdir(self.directory.name), ["1.second"])
+
+    def test_clear_drops_every_entry(self):
+        self.cache.put(1, "key", "application/json", b"[]")
+
+        self.cache.clear()
+
+        self.assertIsNone(self.cache.get(1, "key"))
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+
+class TestCachedView(unittest.TestCase):
+    def setUp(self):
+        self.app = make_app()
+        self.api = Api(self.app)
+        self.api.add_namespace(ns)
+        self.client = self.app.test_client()
+        response_cache.init_app(self.app)
+
+        patcher = patch("app.api.file.response_cache.TextFileService")
+        self.version = patcher.start().return_value.get_version
+        self.version.return_value = ("epoch", 1)
+        self.addCleanup(patcher.stop)
+
+    @patch("app.api.file.view.TextFileService")
+    def test_serves_repeated_requests_from_the_cache(self, MockTextFileService):
+        mock_service = MockTextFileService.return_value
+        mock_service.get_longest_lines.return_value = [{"line": 0, "text": "a"}]
+
+        first = self.client.get("/file/longest?number=1")
+        second = self.client.get("/file/longest?number=1")
+
+        self.assertEqual(second.json, [{"line": 0, "text": "a"}])
+        self.assertEqual(second.headers["ETag"], first.headers["ETag"])
+        self.assertEqual(second.headers["Cache-Control"], "no-cache")
+        mock_service.get_longest_lines.assert_called_once_with(1)
+
+    @patch("app.api.file.view.TextFileService")
+    def test_not_modified(self, MockTextFileService):
+        mock_service = MockTextFileService.return_value
+        mock_service.get_longest_lines.return_value = []
+        etag = self.client.get("/file/longest").headers["ETag"]
+        response_cache.memory.clear()
+
+        response = self.client.get("/file/longest", headers={"If-None-Match": etag})
+
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        mock_service.get_longest_lines.assert_called_once()
+
+    @patch("app.api.file.view.TextFileService")
+    def test_new_generation_misses(self, MockTextFileService):
+        mock_service = MockTextFileService.return_value
+        mock_service.get_longest_lines.return_value = []
+        etag = self.client.get("/file/longest").headers["ETag"]
+        self.version.return_value = ("epoch", 2)
+
+        response = self.client.get("/file/longest", headers={"If-None-Match": etag})
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertEqual(mock_service.get_longest_lines.call_count, 2)
+
+    @patch("app.api.file.view.TextFileService")
+    def test_new_epoch_misses(self, MockTextFileService):
+        mock_service = MockTextFileService.return_value
+        mock_service.get_longest_lines.return_value = []
+        etag = self.client.get("/file/longest").headers["ETag"]
+        self.version.return_value = ("reset", 1)
+
+        response = self.client.get("/file/longest", headers={"If-None-Match": etag})
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertEqual(mock_service.get_longest_lines.call_count, 2)
+
+    @patch("app.api.file.view.TextFileService")
+    def test_errors_are_not_cached(self, MockTextFileService):
+        response = self.client.get("/file/longest?number=-1")
+        self.client.get("/file/longest?number=-1")
+
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertNotIn("ETag", response.headers)
+        self.assertEqual(response_cache.memory.stats()["entries"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
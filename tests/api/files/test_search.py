@@ -0,0 +1,65 @@
+import unittest
+
+from app.api.file.indexes import LineIndexer
+from app.api.file.search import (
+    TrigramIndexer,
+    decode_postings,
+    encode_postings,
+    trigrams,
+)
+
+
+class TestPostings(unittest.TestCase):
+    def test_round_trip(self):
+        for lines in ([], [0], [3, 4, 200, 201, 70000, 2**32]):
+            self.assertEqual(decode_postings(encode_postings(lines)), lines)
+
+    def test_small_gaps_take_a_byte(self):
+        self.assertEqual(encode_postings([5, 6, 10]), bytes([5, 1, 4]))
+
+
+class TestTrigramIndexer(unittest.TestCase):
+    def test_trigrams(self):
+        self.assertEqual(trigrams(b"abab"), {b"aba", b"bab"})
+        self.assertEqual(trigrams(b"ab"), set())
+
+    def test_postings(self):
+        written = []
+        indexer = TrigramIndexer(written.extend)
+        for number, raw in enumerate([b"abcd", b"", b"xbcd", b"abc"]):
+            indexer.add(number, raw)
+        indexer.close()
+
+        postings = {gram: decode_postings(lines) for gram, lines in written}
+        self.assertEqual(
+            postings,
+            {b"abc": [0, 3], b"bcd": [0, 2], b"xbc": [2]},
+        )
+
+    def test_flushes_when_full(self):
+        written = []
+        indexer = TrigramIndexer(written.append, flush_postings=2)
+        indexer.add(0, b"abcd")
+        indexer.add(1, b"abc")
+        indexer.close()
+
+        self.assertEqual(len(written), 2)
+        self.assertEqual(
+            [(gram, decode_postings(lines)) for gram, lines in written[1]],
+            [(b"abc", [1])],
+        )
+
+    def test_line_indexer_feeds_trigrams(self):
+        written = []
+        indexer = LineIndexer(trigrams=TrigramIndexer(written.extend))
+        indexer.feed(b"one\ntw")
+        indexer.feed(b"o\n")
+        indexer.close()
+        indexer.trigrams.close()
+
+        postings = {gram: decode_postings(lines) for gram, lines in written}
+        self.assertEqual(postings, {b"one": [0], b"two": [1]})
+
+
+if __name__ == "__main__":
+    unittest.main()
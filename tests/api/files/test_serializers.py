@@ -0,0 +1,73 @@
+import json
+import unittest
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from flask import Flask
+
+from app.api.file import serializers
+from app.api.file.serializers import (
+    dumps_json,
+    escape_xml,
+    negotiate,
+    xml_lines,
+)
+
+
+class TestDumpsJson(unittest.TestCase):
+    def test_writes_utf8_and_http_dates(self):
+        data = {"text": "héllo", "at": datetime(2024, 1, 2, tzinfo=timezone.utc)}
+
+        dumped = json.loads(dumps_json(data))
+
+        self.assertEqual(dumped["text"], "héllo")
+        self.assertEqual(dumped["at"], "Tue, 02 Jan 2024 00:00:00 GMT")
+
+    @patch.object(serializers, "orjson", None)
+    def test_falls_back_to_json(self):
+        data = {"text": "héllo", "at": datetime(2024, 1, 2, tzinfo=timezone.utc)}
+
+        self.assertEqual(
+            dumps_json(data),
+            '{"text":"héllo","at":"Tue, 02 Jan 2024 00:00:00 GMT"}'.encode(),
+        )
+
+
+class TestXml(unittest.TestCase):
+    def test_escapes_markup_and_invalid_characters(self):
+        self.assertEqual(escape_xml("<a & b>\x00\tok"), "&lt;a &amp; b&gt;\ufffd\tok")
+
+    def test_renders_lines(self):
+        self.assertEqual(
+            xml_lines([{"text": "a"}, {"text": "<b>"}]),
+            "<lines><line><text>a</text></line>"
+            "<line><text>&lt;b&gt;</text></line></lines>",
+        )
+
+
+class TestNegotiate(unittest.TestCase):
+    offered = ["text/plain", "application/json", "application/msgpack"]
+
+    def negotiate(self, accept):
+        headers = {"Accept": accept} if accept else {}
+        with Flask(__name__).test_request_context(headers=headers):
+            return negotiate(self.offered, "text/plain")
+
+    def test_honours_q_values(self):
+        self.assertEqual(
+            self.negotiate("application/json, text/plain;q=0.5"), "application/json"
+        )
+        self.assertEqual(
+            self.negotiate("text/plain;q=0.1, application/*;q=0.9"), "application/json"
+        )
+
+    def test_defaults_without_match(self):
+        self.assertEqual(self.negotiate(None), "text/plain")
+        self.assertEqual(self.negotiate("image/png"), "text/plain")
+
+    @patch.object(serializers, "msgpack", None)
+    def test_skips_msgpack_when_missing(self):
+        self.assertEqual(
+            self.negotiate("application/msgpack, application/json;q=0.5"),
+            "application/json",
+        )
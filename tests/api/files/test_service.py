@@ -0,0 +1,377 @@
+import contextlib
+import functools
+import hashlib
+import io
+import random
+import unittest
+from collections import Counter
+from unittest.mock import patch
+
+from bson.objectid import ObjectId
+from werkzeug.datastructures import FileStorage
+
+from app.api.file.exceptions import FileAlreadyExistsException, NoContentFound
+from app.api.file.maintenance import reindex_query
+from app.api.file.search import TrigramIndexer
+from app.api.file.service import sample_unseen, split_pieces
+from app.db import ensure_indexes, mongo
+from tests.api.files.service_case import ServiceTestCase
+
+
+class TestLineReads(ServiceTestCase):
+    def test_reads_lines_through_offset_index(self):
+        file_id = self.upload(b"first\nsecond\nthird\nlast")["file_id"]
+
+        self.assertEqual(self.service.get_line(file_id, 0), "first")
+        self.assertEqual(self.service.get_line(file_id, 3), "last")
+        self.assertEqual(
+            self.service.get_lines(file_id, [3, 1, 0]),
+            {0: "first", 1: "second", 3: "last"},
+        )
+
+    def test_reads_last_line_ending_with_newline(self):
+        file_id = self.upload(b"first\nlast\n")["file_id"]
+
+        self.assertEqual(self.service.get_line(file_id, 1), "last")
+
+    def test_strips_crlf_line_breaks(self):
+        file_id = self.upload(b"first\r\nsecond\r\nlast\r\n")["file_id"]
+
+        self.assertEqual(
+            self.service.get_lines(file_id, [0, 1, 2]),
+            {0: "first", 1: "second", 2: "last"},
+        )
+
+
+class TestScannedLines(ServiceTestCase):
+    def test_joins_lines_spanning_pieces(self):
+        pieces = [b"ab", b"c", b"d\nef", b"\r\n", b"g"]
+
+        self.assertEqual(list(split_pieces(pieces)), [(0, "abcd"), (1, "ef"), (2, "g")])
+
+    def test_reads_mapped_copy(self):
+        file_id = self.upload(b"stored\n")["file_id"]
+
+        @contextlib.contextmanager
+        def view(bucket, file_id):
+            yield memoryview(b"mapped\ncopy")
+
+        with patch.object(self.service.storage, "view", view), patch.object(
+            self.service.storage, "iter", side_effect=AssertionError
+        ):
+            self.assertEqual(
+                list(self.service._iter_lines(file_id)), [(0, "mapped"), (1, "copy")]
+            )
+
+
+class TestLatestFile(ServiceTestCase):
+    def test_reports_no_content_without_files(self):
+        with self.assertRaises(NoContentFound):
+            self.service.get_last_file_metadata()
+
+    def test_follows_uploads(self):
+        self.upload(b"first\n", "first.txt")
+        self.assertEqual(self.service.get_last_file_metadata()["filename"], "first.txt")
+
+        self.upload(b"second\n", "second.txt")
+        self.assertEqual(
+            self.service.get_last_file_metadata()["filename"], "second.txt"
+        )
+
+    def test_starts_a_new_epoch_in_a_reset_database(self):
+        self.upload(b"first\n", "first.txt")
+        version = self.service.get_version()
+        self.service.get_last_file_metadata()
+
+        mongo.cx.drop_database(mongo.db.name)
+        ensure_indexes()
+        self.upload(b"other\n", "other.txt")
+
+        self.assertEqual(self.service.get_version()[1], version[1])
+        self.assertNotEqual(self.service.get_version(), version)
+        self.assertEqual(self.service.get_last_file_metadata()["filename"], "other.txt")
+
+
+class TestStreamedUpload(ServiceTestCase):
+    config = {"UPLOAD_CHUNK_SIZE": 4}
+
+    def test_hashes_and_stores_content_across_chunks(self):
+        content = b"a line spanning chunks\nanother\n"
+        metadata = self.upload(content)
+
+        self.assertEqual(metadata["hash"], hashlib.md5(content).hexdigest())
+        self.assertEqual(metadata["line_count"], 2)
+        with self.service.get_file_by_id(metadata["file_id"]) as stored:
+            self.assertEqual(stored.read(), content)
+
+    def test_discards_stored_chunks_of_duplicate(self):
+        self.upload(b"same content\n", "first.txt")
+
+        with self.assertRaises(FileAlreadyExistsException):
+            self.upload(b"same content\n", "second.txt")
+
+        self.assertEqual(mongo.db.files.count_documents({}), 1)
+        self.assertEqual(mongo.db.fs.files.count_documents({}), 1)
+
+
+class TestRandomDraws(ServiceTestCase):
+    def setUp(self):
+        super().setUp()
+        random.seed(0)
+        self.small = self.upload(b"small\n", "small.txt")
+        self.large = self.upload(
+            b"".join(b"large %d\n" % n for n in range(9)), "large.txt"
+        )
+
+    def test_assigns_sequences_and_line_starts_in_upload_order(self):
+        docs = list(mongo.db.files.find().sort("_id", 1))
+
+        self.assertEqual([doc["seq"] for doc in docs], [1, 2])
+        self.assertEqual([doc["line_start"] for doc in docs], [0, 1])
+        counter = mongo.db.counters.find_one({"_id": "files"})
+        self.assertEqual((counter["seq"], counter["lines"]), (2, 10))
+
+    def test_draws_files_uniformly(self):
+        names = Counter(
+            self.service.get_random_file_metadata()["filename"] for _ in range(200)
+        )
+
+        self.assertGreater(names["small.txt"], 60)
+        self.assertGreater(names["large.txt"], 60)
+
+    def test_draws_corpus_lines_weighted_by_line_count(self):
+        lines = self.service.get_random_corpus_lines(1000)
+
+        names = Counter(line["file_name"] for line in lines)
+        self.assertEqual(sum(names.values()), 1000)
+        self.assertLess(names["small.txt"], 200)
+        self.assertGreater(names["large.txt"], 800)
+
+    def test_draws_each_corpus_line_once_without_replacement(self):
+        lines = self.service.get_random_corpus_lines(20, replace=False)
+
+        self.assertEqual(
+            sorted((line["file_name"], line["line"]) for line in lines),
+            [("large.txt", n) for n in range(9)] + [("small.txt", 0)],
+        )
+
+    def test_redraws_missed_lines_without_replacement(self):
+        # Lines counted for uploads still being registered are missed.
+        mongo.db.counters.update_one({"_id": "files"}, {"$inc": {"lines": 10}})
+
+        for _ in range(20):
+            lines = self.service.get_random_corpus_lines(10, replace=False)
+            keys = [(line["file_name"], line["line"]) for line in lines]
+            self.assertEqual(len(keys), len(set(keys)))
+
+
+class TestSampleUnseen(unittest.TestCase):
+    def test_draws_distinct_unseen_numbers(self):
+        for seen in ({1, 2, 3}, set(range(15))):
+            drawn = sample_unseen(20, 4, seen)
+
+            self.assertEqual(len(set(drawn)), 4)
+            self.assertFalse(seen & set(drawn))
+            self.assertTrue(all(0 <= n < 20 for n in drawn))
+
+    def test_draws_at_most_the_unseen_numbers(self):
+        self.assertEqual(sorted(sample_unseen(5, 4, {0, 1, 2})), [3, 4])
+        self.assertEqual(sample_unseen(3, 4, {0, 1, 2}), [])
+
+
+class TestPendingFiles(ServiceTestCase):
+    def setUp(self):
+        super().setUp()
+        for name, content in (("a.txt", b"abc\nlonger line\n"), ("b.txt", b"xyz\n")):
+            self.service.process_async(FileStorage(io.BytesIO(content), filename=name))
+
+    def test_draws_pending_files(self):
+        self.assertIn(
+            self.service.get_random_file_metadata()["filename"], {"a.txt", "b.txt"}
+        )
+
+    def test_draws_lines_of_pending_files(self):
+        texts = {"abc", "longer line", "xyz"}
+
+        lines = self.service.get_random_corpus_lines(5)
+        self.assertEqual(len(lines), 5)
+        self.assertTrue({line["text"] for line in lines} <= texts)
+        self.assertTrue(
+            {line[::-1] for line in self.service.get_random_lines_backward(5)} <= texts
+        )
+
+    def test_finds_longest_lines_of_pending_files(self):
+        self.assertEqual(
+            [line["text"] for line in self.service.get_longest_lines(2)],
+            ["longer line", "abc"],
+        )
+
+    def test_draws_lines_of_pending_files_like_indexed_ones(self):
+        mongo.db.files.delete_many({})
+        self.service.process_async(
+            FileStorage(io.BytesIO(b"a\x0cb\nc\n"), filename="c.txt")
+        )
+
+        lines = self.service.get_random_lines(10, replace=False)
+
+        self.assertEqual(
+            sorted((line["line"], line["text"]) for line in lines),
+            [(0, "a\x0cb"), (1, "c")],
+        )
+
+    def test_reads_windows_of_pending_files_like_indexed_ones(self):
+        content = b"a\x0cb\nc\xe2\x80\xa8d\ne\n"
+        file_id = self.service.process_async(
+            FileStorage(io.BytesIO(content), filename="c.txt")
+        )["file_id"]
+
+        def window():
+            doc = mongo.db.files.find_one({"file_id": file_id})
+            return list(self.service.iter_line_window(doc, 1, 5))
+
+        pending = window()
+        self.service.index_file(file_id)
+
+        self.assertEqual(
+            pending, [{"line": 1, "text": "c\u2028d"}, {"line": 2, "text": "e"}]
+        )
+        self.assertEqual(window(), pending)
+
+    def test_searches_pending_files(self):
+        self.assertEqual(
+            [line["text"] for line in self.service.iter_search("xyz", 10)], ["xyz"]
+        )
+
+    def test_reports_no_content_without_files(self):
+        mongo.db.files.delete_many({})
+
+        with self.assertRaises(NoContentFound):
+            self.service.get_random_file_metadata()
+        with self.assertRaises(NoContentFound):
+            self.service.get_random_corpus_lines(1)
+
+
+class TestBatchUploadAsync(ServiceTestCase):
+    def test_queues_new_members(self):
+        self.upload(b"stored\n", "stored.txt")
+        members = [
+            (name, lambda content=content: io.BytesIO(content))
+            for name, content in (
+                ("a.txt", b"new\n"),
+                ("b.txt", b"stored\n"),
+                ("c.txt", b"new\n"),
+            )
+        ]
+
+        results = self.service.process_batch_async(members)
+
+        self.assertEqual(
+            [(result["filename"], result["status"]) for result in results],
+            [("a.txt", "pending"), ("b.txt", "duplicate"), ("c.txt", "duplicate")],
+        )
+        self.assertEqual(mongo.db.jobs.distinct("file_id"), [results[0]["file_id"]])
+        self.assertEqual(mongo.db.fs.files.count_documents({}), 2)
+        self.assertEqual(self.service.get_last_file_metadata()["filename"], "a.txt")
+
+
+class TestSearch(ServiceTestCase):
+    def search(self, query):
+        return [
+            (line["line"], line["text"]) for line in self.service.iter_search(query, 10)
+        ]
+
+    def test_replaces_invalid_utf8_in_matches(self):
+        self.upload(b"caf\xe9 hello\nhello\n")
+
+        self.assertEqual(self.search("hello"), [(0, "caf\ufffd hello"), (1, "hello")])
+
+    def test_reads_postings_of_files_holding_the_rarest_trigram(self):
+        for n in range(3):
+            self.upload(b"common %d\n" % n, f"common{n}.txt")
+        rare = self.upload(b"common rare\n", "rare.txt")["file_id"]
+
+        with patch.object(
+            mongo.db.trigrams, "find", wraps=mongo.db.trigrams.find
+        ) as find:
+            self.assertEqual(self.search("mon rare"), [(0, "common rare")])
+
+        # Postings are read with a projection, unlike the counts and lookups of
+        # the files holding each trigram.
+        self.assertEqual(
+            [args[0]["file_id"] for args, _ in find.call_args_list if len(args) > 1],
+            [{"$in": [rare]}],
+        )
+
+    def test_drops_postings_of_failed_upload(self):
+        class FailingStream(io.BytesIO):
+            def read(self, size=-1):
+                if self.tell():
+                    raise OSError("connection reset")
+                return super().read(size)
+
+        with patch(
+            "app.api.file.service.TrigramIndexer",
+            functools.partial(TrigramIndexer, flush_postings=1),
+        ):
+            with self.assertRaises(OSError):
+                self.service.process(
+                    FileStorage(FailingStream(b"hello\nworld\n"), filename="a.txt")
+                )
+
+        self.assertEqual(mongo.db.trigrams.count_documents({}), 0)
+        self.upload(b"hello\n")
+        self.assertEqual(self.search("hello"), [(0, "hello")])
+
+
+class TestSearchIndexDisabled(ServiceTestCase):
+    config = {"SEARCH_INDEX_ENABLED": False}
+
+    def test_skips_trigram_index(self):
+        file_id = self.upload(b"hello\n")["file_id"]
+
+        self.assertEqual(mongo.db.trigrams.count_documents({}), 0)
+        self.assertNotIn("trigrams", mongo.db.files.find_one())
+        self.assertEqual(self.service.index_file(file_id), 0)
+        self.assertEqual(mongo.db.files.count_documents(reindex_query()), 0)
+
+    def test_scans_files_to_search(self):
+        self.upload(b"hello\nworld\n")
+
+        self.assertEqual(
+            [line["text"] for line in self.service.iter_search("orl", 10)], ["world"]
+        )
+
+
+class TestLongestLines(ServiceTestCase):
+    config = {"LONGEST_LINES_TOP_K": 2}
+
+    def store_legacy(self, content, filename="legacy.txt"):
+        # Files uploaded before indexing existed only have their content stored.
+        metadata, layout = self.service._store_blob(filename, io.BytesIO(content))
+        mongo.db.files.insert_one(dict(metadata, **layout))
+        return metadata
+
+    def test_merges_unindexed_files_into_top_list(self):
+        indexed = self.upload(b"medium line\nshort\n")["file_id"]
+        legacy = self.store_legacy(b"the longest line of all\nx\n")["file_id"]
+
+        self.assertEqual(
+            self.service.get_longest_lines(2),
+            [
+                {"line": 0, "text": "the longest line of all", "file_id": legacy},
+                {"line": 0, "text": "medium line", "file_id": indexed},
+            ],
+        )
+
+    def test_selects_beyond_top_list_with_unindexed_files(self):
+        self.upload(b"medium line\nshort\n")
+        self.store_legacy(b"the longest line of all\nx\n")
+
+        self.assertEqual(
+            [line["text"] for line in self.service.get_longest_lines(3)],
+            ["the longest line of all", "medium line", "short"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
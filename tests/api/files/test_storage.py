@@ -0,0 +1,102 @@
+import os
+import tempfile
+import unittest
+
+from app.api.file.exceptions import FileNotFound
+from app.api.file.storage import (
+    LocalStorage,
+    blocks_spanned,
+    get_storage,
+    slice_blocks,
+)
+
+FILE_ID = "65a000000000000000000001"
+OTHER_ID = "65a000000000000000000002"
+
+
+class TestLocalStorage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = LocalStorage(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def objects(self):
+        root = os.path.join(self.directory.name, "objects")
+        return [
+            name
+            for shard in os.listdir(root)
+            for name in os.listdir(os.path.join(root, shard))
+        ]
+
+    def test_writes_and_reads_blobs(self):
+        writer = self.storage.create("fs", FILE_ID)
+        writer.write(b"hello ")
+        writer.write(b"world")
+        writer.close()
+
+        self.assertEqual(self.storage.stat("fs", FILE_ID), 11)
+        self.assertEqual(self.storage.sizes("fs"), {FILE_ID: 11})
+        self.assertEqual(
+            self.storage.read_ranges("fs", FILE_ID, [(6, 11), (0, 5)]),
+            [b"world", b"hello"],
+        )
+        self.assertEqual(b"".join(self.storage.iter("fs", FILE_ID)), b"hello world")
+        with self.storage.view("fs", FILE_ID) as view:
+            self.assertEqual(view[:5].tobytes(), b"hello")
+
+    def test_identical_blobs_share_an_object(self):
+        self.storage.put("fs", FILE_ID, b"same")
+        self.storage.put("line_offsets", OTHER_ID, b"same")
+        self.assertEqual(len(self.objects()), 1)
+
+        self.storage.delete("fs", FILE_ID)
+        self.assertEqual(len(self.objects()), 1)
+        self.assertEqual(
+            self.storage.read_ranges("line_offsets", OTHER_ID, [(0, 4)]), [b"same"]
+        )
+
+        self.storage.delete("line_offsets", OTHER_ID)
+        self.assertEqual(self.objects(), [])
+
+    def test_put_replaces_a_blob(self):
+        self.storage.put("fs", FILE_ID, b"old")
+        self.storage.put("fs", FILE_ID, b"new")
+
+        self.assertEqual(self.storage.read_ranges("fs", FILE_ID, [(0, 3)]), [b"new"])
+
+    def test_aborted_blob_is_not_stored(self):
+        writer = self.storage.create("fs", FILE_ID)
+        writer.write(b"partial")
+        writer.abort()
+
+        with self.assertRaises(FileNotFound):
+            self.storage.open("fs", FILE_ID)
+        self.assertEqual(os.listdir(os.path.join(self.directory.name, "tmp")), [])
+
+    def test_missing_blob(self):
+        with self.assertRaises(FileNotFound):
+            self.storage.stat("fs", FILE_ID)
+        self.storage.delete("fs", FILE_ID)
+
+
+class TestGetStorage(unittest.TestCase):
+    def test_local_needs_a_directory(self):
+        with self.assertRaises(ValueError):
+            get_storage("local")
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            get_storage("s3")
+
+
+class TestBlocks(unittest.TestCase):
+    def test_blocks_spanned(self):
+        self.assertEqual(blocks_spanned([(0, 4), (3, 9), (20, 21)], 4), [0, 1, 2, 5])
+
+    def test_slice_blocks(self):
+        data = b"abcdefghijklmnopqrstuv"
+        ranges = [(3, 9), (0, 4), (20, 21)]
+        blocks = {n: data[n * 4 : n * 4 + 4] for n in blocks_spanned(ranges, 4)}
+        self.assertEqual(slice_blocks(blocks, ranges, 4), [b"defghi", b"abcd", b"u"])
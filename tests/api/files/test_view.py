@@ -1,18 +1,32 @@
+import io
+import json
 import unittest
+import zipfile
 from http import HTTPStatus
 from unittest.mock import patch, MagicMock
 
 from flask import Flask
 from flask_restx import Api
 
+from app.api.file import serializers
+
 from app.api.file.view import (
     ns,
     FileUploadView,
+    FileBatchUploadView,
     RandomLineView,
     RandomLineBackwardView,
     FileLineLongestView,
+    FileJobView,
+    FileDownloadView,
+    FileLinesView,
+    FileSearchView,
+)
+from app.api.file.exceptions import (
+    FileAlreadyExistsException,
+    FileNotFound,
+    NoContentFound,
 )
-from app.api.file.exceptions import FileAlreadyExistsException
 
 
 class TestFileUploadView(unittest.TestCase):
@@ -33,6 +47,19 @@ class TestFileUploadView(unittest.TestCase):
         self.assertEqual(response.status_code, HTTPStatus.CREATED)
         self.assertEqual(response.json, {"message": "File processed"})
 
+    @patch("app.api.file.view.TextFileService")
+    def test_post_file_upload_async(self, MockTextFileService):
+        self.app.config["INGEST_MODE"] = "async"
+        mock_service = MockTextFileService.return_value
+        mock_service.process_async.return_value = {"job_id": "1"}
+
+        data = {"file": (MagicMock(), "test.txt")}
+        response = self.client.post("/file/upload", data=data)
+
+        self.assertEqual(response.status_code, HTTPStatus.ACCEPTED)
+        self.assertEqual(response.json, {"job_id": "1"})
+        mock_service.process.assert_not_called()
+
     @patch("app.api.file.view.TextFileService")
     def test_post_file_upload_no_file(self, MockTextFileService):
         response = self.client.post("/file/upload")
@@ -54,6 +81,91 @@ class TestFileUploadView(unittest.TestCase):
         self.assertIn("error", response.json)
 
 
+class TestFileBatchUploadView(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["UPLOAD_CHUNK_SIZE"] = 1024
+        self.api = Api(self.app)
+        self.api.add_namespace(ns)
+        self.client = self.app.test_client()
+
+    @patch("app.api.file.view.TextFileService")
+    def test_post_batch_upload_files(self, MockTextFileService):
+        mock_service = MockTextFileService.return_value
+        mock_service.process_batch.side_effect = lambda members: [
+            {"filename": name, "text": open_member().read().decode()}
+            for name, open_member in members
+        ]
+
+        data = {
+            "files": [(io.BytesIO(b"one\n"), "a.txt"), (io.BytesIO(b"two\n"), "b.txt")]
+        }
+        response = self.client.post("/file/upload/batch", data=data)
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            response.json["files"],
+            [
+                {"filename": "a.txt", "text": "one\n"},
+                {"filename": "b.txt", "text": "two\n"},
+            ],
+        )
+
+    @patch("app.api.file.view.TextFileService")
+    def test_post_batch_upload_archive(self, MockTextFileService):
+        mock_service = MockTextFileService.return_value
+        mock_service.process_batch.side_effect = lambda members: [
+            {"filename": name, "text": open_member().read().decode()}
+            for name, open_member in members
+        ]
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as zipped:
+            zipped.writestr("dir/", "")
+            zipped.writestr("dir/a.txt", "one\n")
+
+        archive.seek(0)
+        response = self.client.post(
+            "/file/upload/batch", data={"archive": (archive, "files.zip")}
+        )
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            response.json["files"], [{"filename": "a.txt", "text": "one\n"}]
+        )
+
+    @patch("app.api.file.view.TextFileService")
+    def test_post_batch_upload_async(self, MockTextFileService):
+        self.app.config["INGEST_MODE"] = "async"
+        mock_service = MockTextFileService.return_value
+        mock_service.process_batch_async.side_effect = lambda members: [
+            {"filename": name, "status": "pending"} for name, _ in members
+        ]
+
+        data = {"files": [(io.BytesIO(b"one\n"), "a.txt")]}
+        response = self.client.post("/file/upload/batch", data=data)
+
+        self.assertEqual(response.status_code, HTTPStatus.ACCEPTED)
+        self.assertEqual(
+            response.json["files"], [{"filename": "a.txt", "status": "pending"}]
+        )
+        mock_service.process_batch.assert_not_called()
+
+    @patch("app.api.file.view.TextFileService")
+    def test_post_batch_upload_invalid_archive(self, MockTextFileService):
+        data = {"archive": (io.BytesIO(b"not an archive"), "files.zip")}
+        response = self.client.post("/file/upload/batch", data=data)
+
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertIn("error", response.json)
+
+    @patch("app.api.file.view.TextFileService")
+    def test_post_batch_upload_no_file(self, MockTextFileService):
+        response = self.client.post("/file/upload/batch")
+
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertIn("error", response.json)
+
+
 class TestRandomLineView(unittest.TestCase):
     def setUp(self):
         self.app = Flask(__name__)
@@ -99,6 +211,101 @@ class TestRandomLineView(unittest.TestCase):
             response.data.decode(), "<line><text>Random line</text></line>"
         )
 
+    @patch("app.api.file.view.TextFileService")
+    def test_get_random_line_xml_is_escaped(self, MockTextFileService):
+        mock_service = MockTextFileService.return_value
+        mock_service.get_random_line.return_value = {"text": "a < b & </text>"}
+
+        response = self.client.get(
+            "/file/line/random", headers={"Accept": "application/xml"}
+        )
+
+        self.assertEqual(
+            response.data.decode(),
+            "<line><text>a &lt; b &amp; &lt;/text&gt;</text></line>",
+        )
+
+    @patch("app.api.file.view.TextFileService")
+    def test_get_random_line_negotiates_q_values(self, MockTextFileService):
+        mock_service = MockTextFileService.return_value
+        mock_service.get_random_line.return_value = {"text": "Random line"}
+
+        response = self.client.get(
+            "/file/line/random",
+            headers={"Accept": "application/json, text/plain;q=0.5"},
+        )
+        self.assertEqual(response.json, {"text": "Random line"})
+
+        response = self.client.get(
+            "/file/line/random",
+            headers={"Accept": "application/json;q=0.2, application/xml"},
+        )
+        self.assertEqual(response.mimetype, "application/xml")
+
+        response = self.client.get("/file/line/random", headers={"Accept": "*/*"})
+        self.assertEqual(response.mimetype, "text/plain")
+
+    @unittest.skipIf(serializers.msgpack is None, "msgpack is not installed")
+    @patch("app.api.file.view.TextFileService")
+    def test_get_random_line_msgpack(self, MockTextFileService):
+        mock_service = MockTextFileService.return_value
+        mock_service.get_random_line.return_value = {"text": "Random line"}
+
+        response = self.client.get(
+            "/file/line/random", headers={"Accept": "application/msgpack"}
+        )
+
+        self.assertEqual(response.mimetype, "application/msgpack")
+        self.assertEqual(
+            serializers.msgpack.unpackb(response.data), {"text": "Random line"}
+        )
+
+    @patch("app.api.file.view.TextFileService")
+    def test_get_random_line_all_scope(self, MockTextFileService):
+        mock_service = MockTextFileService.return_value
+        mock_service.get_random_corpus_line.return_value = {"text": "Corpus line"}
+
+        response = self.client.get(
+            "/file/line/random?scope=all", headers={"Accept": "text/plain"}
+        )
+
+        self.assertEqual(response.status_code, HTTPStatus.OK.value)
+        self.assertEqual(response.data.decode(), "Corpus line")
+        mock_service.get_random_line.assert_not_called()
+
+    @patch("app.api.file.view.TextFileService")
+    def test_get_random_line_unknown_scope(self, MockTextFileService):
+        response = self.client.get("/file/line/random?scope=nope")
+
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertIn("error", response.json)
+
+    @patch("app.api.file.view.TextFileService")
+    def test_get_random_lines_count(self, MockTextFileService):
+        mock_service = MockTextFileService.return_value
+        mock_service.get_random_lines.return_value = [
+            {"text": "First line"},
+            {"text": "Second line"},
+        ]
+
+        response = self.client.get(
+            "/file/line/random?count=2&replace=false",
+            headers={"Accept": "application/json"},
+        )
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            response.json, [{"text": "First line"}, {"text": "Second line"}]
+        )
+        mock_service.get_random_lines.assert_called_once_with(2, False)
+
+    @patch("app.api.file.view.TextFileService")
+    def test_get_random_lines_invalid_count(self, MockTextFileService):
+        response = self.client.get("/file/line/random?count=0")
+
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertIn("error", response.json)
+
 
 class TestRandomLineBackwardView(unittest.TestCase):
     def setUp(self):
@@ -117,6 +324,17 @@ class TestRandomLineBackwardView(unittest.TestCase):
         self.assertEqual(response.status_code, HTTPStatus.OK)
         self.assertEqual(response.json, {"line": "Random line backward"})
 
+    @patch("app.api.file.view.TextFileService")
+    def test_get_random_lines_backward_count(self, MockTextFileService):
+        mock_service = MockTextFileService.return_value
+        mock_service.get_random_lines_backward.return_value = ["eno", "owt"]
+
+        response = self.client.get("/file/line/random-backward?count=2")
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.json, {"lines": ["eno", "owt"]})
+        mock_service.get_random_lines_backward.assert_called_once_with(2, True)
+
 
 class TestFileLineLongestView(unittest.TestCase):
     def setUp(self):
@@ -150,6 +368,315 @@ class TestFileLineLongestView(unittest.TestCase):
         self.assertEqual(response.status_code, HTTPStatus.OK)
         self.assertEqual(response.json, ["Longest line single file"])
 
+    @patch("app.api.file.view.TextFileService")
+    def test_get_longest_lines_streamed(self, MockTextFileService):
+        mock_service = MockTextFileService.return_value
+        mock_service.iter_longest_lines.return_value = iter(
+            [
+                {"line": 3, "text": "long", "file_id": "a"},
+                {"line": 0, "text": "ab", "file_id": "b"},
+            ]
+        )
+
+        response = self.client.get("/file/longest?number=2&stream=true")
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertEqual(
+            [json.loads(line) for line in response.data.splitlines()],
+            [
+                {"line": 3, "text": "long", "file_id": "a"},
+                {"line": 0, "text": "ab", "file_id": "b"},
+            ],
+        )
+        mock_service.iter_longest_lines.assert_called_once_with(2)
+        mock_service.get_longest_lines.assert_not_called()
+
+    @patch("app.api.file.view.TextFileService")
+    def test_get_longest_lines_streamed_by_accept(self, MockTextFileService):
+        mock_service = MockTextFileService.return_value
+        mock_service.iter_longest_lines_single_file.return_value = iter(
+            [{"line": 1, "text": "long"}]
+        )
+
+        response = self.client.get(
+            "/file/longest?number=1&single=true",
+            headers={"Accept": "application/x-ndjson"},
+        )
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.data, b'{"line":1,"text":"long"}\n')
+
+    def test_get_longest_lines_invalid_number(self):
+        response = self.client.get("/file/longest?number=-1")
+
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+
+class TestFileJobView(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.api = Api(self.app)
+        self.api.add_namespace(ns)
+        self.client = self.app.test_client()
+
+    @patch("app.api.file.view.ingest_queue")
+    def test_get_job(self, mock_queue):
+        mock_queue.get.return_value = {
+            "_id": "abc",
+            "file_id": "123",
+            "status": "done",
+            "worker": "host:1",
+        }
+
+        response = self.client.get("/file/jobs/abc")
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            response.json, {"job_id": "abc", "file_id": "123", "status": "done"}
+        )
+
+    @patch("app.api.file.view.ingest_queue")
+    def test_get_unknown_job(self, mock_queue):
+        mock_queue.get.return_value = None
+
+        response = self.client.get("/file/jobs/abc")
+
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertIn("error", response.json)
+
+
+class TestFileDownloadView(unittest.TestCase):
+    FILE_ID = "0123456789abcdef01234567"
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.api = Api(self.app)
+        self.api.add_namespace(ns)
+        self.client = self.app.test_client()
+
+    def mock_file(self, MockTextFileService, content=b"first\nsecond\n"):
+        mock_service = MockTextFileService.return_value
+        doc = {"filename": "test.txt", "hash": "abc"}
+        mock_service.open_file.return_value = (doc, io.BytesIO(content), len(content))
+
+    @patch("app.api.file.view.TextFileService")
+    def test_download_file(self, MockTextFileService):
+        self.mock_file(MockTextFileService)
+
+        response = self.client.get(f"/file/{self.FILE_ID}")
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.data, b"first\nsecond\n")
+        self.assertEqual(response.headers["ETag"], '"abc"')
+        self.assertEqual(response.headers["Accept-Ranges"], "bytes")
+
+    @patch("app.api.file.view.TextFileService")
+    def test_download_file_range(self, MockTextFileService):
+        self.mock_file(MockTextFileService)
+
+        response = self.client.get(
+            f"/file/{self.FILE_ID}", headers={"Range": "bytes=6-11"}
+        )
+
+        self.assertEqual(response.status_code, HTTPStatus.PARTIAL_CONTENT)
+        self.assertEqual(response.data, b"second")
+        self.assertEqual(response.headers["Content-Range"], "bytes 6-11/13")
+
+    @patch("app.api.file.view.TextFileService")
+    def test_download_file_not_modified(self, MockTextFileService):
+        self.mock_file(MockTextFileService)
+
+        response = self.client.get(
+            f"/file/{self.FILE_ID}", headers={"If-None-Match": '"abc"'}
+        )
+
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(response.data, b"")
+
+    @patch("app.api.file.view.TextFileService")
+    def test_download_invalid_id(self, MockTextFileService):
+        response = self.client.get("/file/not-an-id")
+
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        MockTextFileService.return_value.open_file.assert_not_called()
+
+
+class TestFileLinesView(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.api = Api(self.app)
+        self.api.add_namespace(ns)
+        self.client = self.app.test_client()
+
+    def mock_lines(self, MockTextFileService, count):
+        mock_service = MockTextFileService.return_value
+        mock_service.get_file_metadata.return_value = {"file_id": "123"}
+        mock_service.iter_line_window.return_value = iter(
+            {"line": n, "text": f"line {n}"} for n in range(count)
+        )
+        return mock_service
+
+    @patch("app.api.file.view.TextFileService")
+    def test_get_lines_window(self, MockTextFileService):
+        mock_service = self.mock_lines(MockTextFileService, 2)
+
+        response = self.client.get("/file/latest/lines?start=5&count=2")
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.json["start"], 5)
+        self.assertEqual(len(response.json["lines"]), 2)
+        mock_service.get_file_metadata.assert_called_once_with("latest")
+        mock_service.iter_line_window.assert_called_once_with({"file_id": "123"}, 5, 2)
+
+    @patch("app.api.file.view.TextFileService")
+    def test_get_lines_large_window_is_streamed(self, MockTextFileService):
+        self.mock_lines(MockTextFileService, 3)
+
+        response = self.client.get("/file/123/lines?count=5000")
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertEqual(
+            [json.loads(line)["line"] for line in response.data.splitlines()],
+            [0, 1, 2],
+        )
+
+    @patch("app.api.file.view.TextFileService")
+    def test_get_lines_invalid_start(self, MockTextFileService):
+        response = self.client.get("/file/123/lines?start=-1")
+
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertIn("error", response.json)
+
+    @patch("app.api.file.view.TextFileService")
+    def test_get_lines_unknown_file(self, MockTextFileService):
+        mock_service = MockTextFileService.return_value
+        mock_service.get_file_metadata.side_effect = FileNotFound("No file")
+
+        response = self.client.get("/file/123/lines")
+
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    @patch("app.api.file.view.TextFileService")
+    def test_get_lines_of_latest_without_files(self, MockTextFileService):
+        mock_service = MockTextFileService.return_value
+        mock_service.get_file_metadata.side_effect = NoContentFound(
+            "No files have been uploaded yet."
+        )
+
+        response = self.client.get("/file/latest/lines")
+
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertEqual(response.json, {"error": "No files have been uploaded yet."})
+
+
+class TestFileCacheView(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.api = Api(self.app)
+        self.api.add_namespace(ns)
+        self.client = self.app.test_client()
+
+    @patch("app.api.file.view.file_cache")
+    def test_get_cache_stats(self, mock_cache):
+        mock_cache.stats.return_value = {"hits": 3, "misses": 1, "evictions": 0}
+
+        response = self.client.get("/file/cache")
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.json, {"hits": 3, "misses": 1, "evictions": 0})
+
+
+class TestFileLettersView(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.api = Api(self.app)
+        self.api.add_namespace(ns)
+        self.client = self.app.test_client()
+
+    @patch("app.api.file.view.TextFileService")
+    def test_get_letters(self, MockTextFileService):
+        mock_service = MockTextFileService.return_value
+        mock_service.get_file_metadata.return_value = {"file_id": "123"}
+        stats = {
+            "file_id": "123",
+            "letters": {"a": 3, "b": 1},
+            "most_frequent": {"a": 2},
+            "lines_without_letters": 1,
+        }
+        mock_service.get_letter_stats.return_value = stats
+
+        response = self.client.get("/file/latest/letters")
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.json, stats)
+        mock_service.get_letter_stats.assert_called_once_with({"file_id": "123"})
+
+    @patch("app.api.file.view.TextFileService")
+    def test_get_letters_unknown_file(self, MockTextFileService):
+        mock_service = MockTextFileService.return_value
+        mock_service.get_file_metadata.side_effect = FileNotFound("No file")
+
+        response = self.client.get("/file/123/letters")
+
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    @patch("app.api.file.view.TextFileService")
+    def test_get_letters_of_latest_without_files(self, MockTextFileService):
+        mock_service = MockTextFileService.return_value
+        mock_service.get_file_metadata.side_effect = NoContentFound(
+            "No files have been uploaded yet."
+        )
+
+        response = self.client.get("/file/latest/letters")
+
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertEqual(response.json, {"error": "No files have been uploaded yet."})
+
+
+class TestFileSearchView(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.api = Api(self.app)
+        self.api.add_namespace(ns)
+        self.client = self.app.test_client()
+
+    @patch("app.api.file.view.TextFileService")
+    def test_search_streams_matches(self, MockTextFileService):
+        mock_service = MockTextFileService.return_value
+        matches = [
+            {"file_id": "123", "line": 0, "text": "hello world"},
+            {"file_id": "456", "line": 7, "text": "say hello"},
+        ]
+        mock_service.iter_search.return_value = iter(matches)
+
+        response = self.client.get("/file/search?q=hello&limit=5")
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.mimetype, serializers.NDJSON_MIMETYPE)
+        self.assertEqual(
+            [json.loads(line) for line in response.data.splitlines()], matches
+        )
+        mock_service.iter_search.assert_called_once_with("hello", 5)
+
+    @patch("app.api.file.view.TextFileService")
+    def test_search_short_query(self, MockTextFileService):
+        mock_service = MockTextFileService.return_value
+        mock_service.iter_search.side_effect = ValueError("q is too short")
+
+        response = self.client.get("/file/search?q=hi")
+
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(response.json, {"error": "q is too short"})
+
+    @patch("app.api.file.view.TextFileService")
+    def test_search_invalid_limit(self, MockTextFileService):
+        response = self.client.get("/file/search?q=hello&limit=-1")
+
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        MockTextFileService.return_value.iter_search.assert_not_called()
+
 
 if __name__ == "__main__":
     unittest.main()
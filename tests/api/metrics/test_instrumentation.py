@@ -0,0 +1,44 @@
+import unittest
+
+from flask import Blueprint, Flask
+
+from app.api.metrics import instrumentation
+from app.api.metrics.instrumentation import timed
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        blueprint = Blueprint("api", __name__)
+
+        @blueprint.route("/file/sample")
+        def sample():
+            with timed("decode"):
+                return "ok"
+
+        self.app.register_blueprint(blueprint, url_prefix="/api/v1")
+        instrumentation.init_app(self.app)
+        self.client = self.app.test_client()
+
+    def test_server_timing_header_when_enabled(self):
+        self.app.config["SERVER_TIMING_ENABLED"] = True
+
+        response = self.client.get("/api/v1/file/sample")
+
+        timing = response.headers["Server-Timing"]
+        for phase in ("mongo", "gridfs", "decode", "serialize", "total"):
+            self.assertIn(f"{phase};dur=", timing)
+        self.assertIn('cache;desc="none"', timing)
+
+    def test_no_server_timing_header_by_default(self):
+        response = self.client.get("/api/v1/file/sample")
+
+        self.assertNotIn("Server-Timing", response.headers)
+
+    def test_timed_outside_request_is_a_no_op(self):
+        with timed("decode"):
+            pass
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import os
+import pstats
+import tempfile
+import time
+import unittest
+
+from flask import Blueprint, Flask, Response
+
+from app.api.profiling.profiler import CProfileRecorder, request_profiler
+from app.api.profiling.view import profiling_bp
+
+
+def busy():
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        pass
+    return "ok"
+
+
+class TestRequestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        self.app = Flask(__name__)
+        self.app.config.update(
+            PROFILING_ENABLED=True,
+            PROFILE_DIR=self.directory.name,
+            PROFILE_MODE="sample",
+            PROFILE_SAMPLE_RATE=0.0,
+            PROFILE_INTERVAL=0.001,
+            PROFILE_MAX_FILES=2,
+            PROFILE_TOKEN="secret",
+        )
+        blueprint = Blueprint("api", __name__)
+
+        @blueprint.route("/file/busy")
+        def busy_view():
+            return busy()
+
+        @blueprint.route("/file/stream")
+        def stream_view():
+            return Response(busy() for _ in range(2))
+
+        self.app.register_blueprint(blueprint, url_prefix="/api/v1")
+        self.app.register_blueprint(profiling_bp, url_prefix="/api")
+        request_profiler.init_app(self.app)
+        self.client = self.app.test_client()
+
+    def get(self, path, headers=(), **kwargs):
+        headers = {"X-Profile-Token": "secret", **dict(headers)}
+        response = self.client.get(path, headers=headers, **kwargs)
+        response.close()
+        return response
+
+    def read(self, name):
+        with open(os.path.join(self.directory.name, name)) as file:
+            return file.read()
+
+    def test_samples_collapsed_stacks_on_request(self):
+        response = self.get("/api/v1/file/busy", headers={"X-Profile": "1"})
+
+        name = response.headers["X-Profile-Name"]
+        self.assertTrue(name.endswith("-GET-api_v1_file_busy.folded"))
+        stacks = self.read(name).splitlines()
+        self.assertTrue(any(";busy (" in stack for stack in stacks))
+        for stack in stacks:
+            self.assertTrue(stack.rsplit(" ", 1)[1].isdigit())
+
+    def test_profiles_streamed_bodies(self):
+        response = self.get("/api/v1/file/stream", headers={"X-Profile": "sample"})
+
+        self.assertIn(";busy (", self.read(response.headers["X-Profile-Name"]))
+
+    def test_cprofile_writes_pstats(self):
+        response = self.get("/api/v1/file/busy", headers={"X-Profile": "cprofile"})
+
+        name = response.headers["X-Profile-Name"]
+        self.assertTrue(name.endswith(".pstats"))
+        stats = pstats.Stats(os.path.join(self.directory.name, name))
+        self.assertIn("busy", {function for _, _, function in stats.stats})
+
+    def test_cprofile_falls_back_to_sampling_when_busy(self):
+        with CProfileRecorder.tracing:
+            response = self.get("/api/v1/file/busy", headers={"X-Profile": "cprofile"})
+
+        self.assertTrue(response.headers["X-Profile-Name"].endswith(".folded"))
+
+    def test_leaves_requests_alone_by_default(self):
+        response = self.get("/api/v1/file/busy")
+
+        self.assertNotIn("X-Profile-Name", response.headers)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_sample_rate(self):
+        request_profiler.sample_rate = 1.0
+
+        self.assertIn("X-Profile-Name", self.get("/api/v1/file/busy").headers)
+        self.assertNotIn("X-Profile-Name", self.get("/api/profiles").headers)
+
+    def test_lists_and_downloads_profiles(self):
+        names = [
+            self.get("/api/v1/file/busy", headers={"X-Profile": "1"}).headers[
+                "X-Profile-Name"
+            ]
+            for _ in range(3)
+        ]
+
+        profiles = self.get("/api/profiles").json["profiles"]
+        self.assertEqual([profile["name"] for profile in profiles], names[:0:-1])
+        response = self.client.get(
+            f"/api/profiles/{names[-1]}", headers={"X-Profile-Token": "secret"}
+        )
+        self.assertEqual(response.get_data(as_text=True), self.read(names[-1]))
+        response.close()
+
+    def test_ignores_the_header_without_the_token(self):
+        for token in ("wrong", ""):
+            response = self.client.get(
+                "/api/v1/file/busy",
+                headers={"X-Profile": "cprofile", "X-Profile-Token": token},
+            )
+            self.assertNotIn("X-Profile-Name", response.headers)
+        request_profiler.token = None
+        response = self.get("/api/v1/file/busy", headers={"X-Profile": "cprofile"})
+        self.assertNotIn("X-Profile-Name", response.headers)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_listing_requires_the_token(self):
+        self.assertEqual(self.client.get("/api/profiles").status_code, 403)
+        response = self.client.get(
+            "/api/profiles/x.folded", headers={"X-Profile-Token": "wrong"}
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from flask.globals import app_ctx
+from pymongo.errors import OperationFailure
+
+from app import create_app
+from app.config import TestingConfig
+
+
+class TestCreateApp(unittest.TestCase):
+    @patch("app.ensure_indexes")
+    def test_starts_when_duplicates_block_the_hash_index(self, ensure_indexes):
+        ensure_indexes.side_effect = OperationFailure("E11000 duplicate key", 11000)
+
+        with self.assertLogs("app", "ERROR") as logs:
+            create_app("Development")
+        app_ctx.pop()
+
+        self.assertIn("--drop-duplicates", logs.output[0])
+
+    @patch("app.ensure_indexes")
+    def test_fails_on_other_index_errors(self, ensure_indexes):
+        ensure_indexes.side_effect = OperationFailure("not authorized", 13)
+
+        with self.assertRaises(OperationFailure):
+            create_app("Development")
+
+    def test_registers_profiles_only_when_profiling_is_enabled(self):
+        app = create_app("Testing")
+        app_ctx.pop()
+        self.assertNotIn("profiling.list_profiles", app.view_functions)
+
+        with tempfile.TemporaryDirectory() as directory, patch.multiple(
+            TestingConfig, PROFILING_ENABLED=True, PROFILE_DIR=directory
+        ):
+            app = create_app("Testing")
+            app_ctx.pop()
+        self.assertIn("profiling.list_profiles", app.view_functions)
+
+
+if __name__ == "__main__":
+    unittest.main()